@@ -0,0 +1,65 @@
+import os
+import json
+import random
+import string
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures')
+DEFAULT_FIXTURE = os.path.join(FIXTURE_DIR,'assets.json')
+
+
+def synthesize_assets_payload(asset_count=2000,seed=7,timestamp=1729000000000):
+    # same shape and value ranges as a CoinCap /v2/assets response, including the null fields it returns
+    rng = random.Random(seed)
+    data = []
+    for rank in range(1,asset_count + 1):
+        symbol = ''.join(rng.choices(string.ascii_uppercase,k=rng.randint(3,5)))
+        price = 10 ** rng.uniform(-6,5)
+        supply = 10 ** rng.uniform(6,12)
+        max_supply = supply * rng.uniform(1,3) if rng.random() < 0.4 else None
+        data.append({
+            'id':f'{symbol.lower()}-{rank}',
+            'rank':str(rank),
+            'symbol':symbol,
+            'name':f'{symbol.title()} Coin',
+            'supply':f'{supply:.10f}',
+            'maxSupply':f'{max_supply:.10f}' if max_supply else None,
+            'marketCapUsd':f'{price * supply:.10f}',
+            'volumeUsd24Hr':f'{price * supply * rng.uniform(0.001,0.2):.10f}',
+            'priceUsd':f'{price:.10f}',
+            'changePercent24Hr':f'{rng.gauss(0,4):.10f}',
+            'vwap24Hr':f'{price * rng.uniform(0.97,1.03):.10f}' if rng.random() < 0.9 else None,
+            'explorer':f'https://explorer.example/{symbol.lower()}' if rng.random() < 0.8 else None
+        })
+    return {'data':data,'timestamp':timestamp}
+
+
+def load_assets_payload(path=DEFAULT_FIXTURE,asset_count=2000):
+    if path and os.path.exists(path):
+        with open(path) as fixture_file:
+            return json.load(fixture_file)
+    return synthesize_assets_payload(asset_count)
+
+
+def record_assets_payload(http_source,endpoint,path=DEFAULT_FIXTURE,page_size=2000,max_pages=10):
+    payload,_ = http_source.fetch_paged(endpoint,page_size=page_size,max_pages=max_pages)
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'w') as fixture_file:
+        json.dump(payload,fixture_file)
+    return payload
+
+
+def price_ticks(payload,ticks,seed=11,interval_ms=30000):
+    # successive snapshots with small random walks, for paths that need changing prices
+    rng = random.Random(seed)
+    snapshots = []
+    data = payload['data']
+    for tick in range(ticks):
+        records = []
+        for record in data:
+            updated = dict(record)
+            if record.get('priceUsd'):
+                updated['priceUsd'] = f'{float(record["priceUsd"]) * (1 + rng.gauss(0,0.002)):.10f}'
+            records.append(updated)
+        snapshots.append({'data':records,'timestamp':payload['timestamp'] + tick * interval_ms})
+        data = records
+    return snapshots
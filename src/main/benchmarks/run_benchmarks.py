@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime,timezone
+from configparser import ConfigParser,ExtendedInterpolation
+
+from benchmarks.fixtures import DEFAULT_FIXTURE,load_assets_payload,record_assets_payload,price_ticks
+from data_ingestion.base_producer import BaseProducer
+from data_ingestion.http_source import HttpSource
+from data_ingestion.payload_decoder import decode_assets_payload
+from data_processing.aggregator import StreamingAggregator
+from utils.aws_connector import AWSConnector
+from utils.record_aggregation import RecordAggregator,deaggregate_records
+from utils.serializers import get_serializer
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# run history is local trend data, kept at the repository root and out of version control
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.dirname(MAIN_DIR)),'.benchmarks','history.jsonl')
+DEFAULT_CONFIG = os.path.join(MAIN_DIR,'config.ini')
+UNTHROTTLED = str(10 ** 12)
+
+
+def measure(func,records_per_call,iterations,warmup,allocation_iterations=3):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - start)
+    # tracemalloc slows every allocation, so it runs in its own pass after the timed one
+    tracemalloc.start()
+    peaks,blocks = [],[]
+    for _ in range(allocation_iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        blocks.append(sum(max(stat.count_diff,0) for stat in tracemalloc.take_snapshot().compare_to(before,'lineno')))
+    tracemalloc.stop()
+    quantiles = statistics.quantiles(timings,n=100) if len(timings) > 1 else timings * 99
+    total_seconds = sum(timings) / 1e9
+    return {
+        'iterations':iterations,
+        'records_per_call':records_per_call,
+        'records_per_second':records_per_call * iterations / total_seconds if total_seconds else 0.0,
+        'p50_ms':quantiles[49] / 1e6,
+        'p99_ms':quantiles[98] / 1e6,
+        'peak_alloc_bytes':max(peaks),
+        'retained_blocks':max(blocks)
+    }
+
+
+def local_connector(config_file,logger):
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(config_file)
+    aws_section = dict(config['aws']) | {
+        'backend':'local',
+        # limits are lifted so the cases time the client code rather than the modelled shard throttling
+        'local_shard_write_records_per_second':UNTHROTTLED,
+        'local_shard_write_bytes_per_second':UNTHROTTLED,
+        'local_shard_read_calls_per_second':UNTHROTTLED,
+        'local_shard_read_bytes_per_second':UNTHROTTLED
+    }
+    connector = AWSConnector(logger,aws_section)
+    connector.ensure_resources()
+    return connector
+
+
+def build_cases(payload,config_file,logger):
+    connector = local_connector(config_file,logger)
+    producer = BaseProducer(config_file,'api','aws',aws_connector=connector)
+    producer.config['spool_enabled'] = 'false'
+    producer.initialize()
+    batch = decode_assets_payload(payload)
+    records = producer.build_records(batch)
+    shard_hash_ranges = connector.get_shard_hash_ranges()
+    record_aggregator = RecordAggregator(shard_hash_ranges)
+    kinesis_client = connector.get_kinesis_client()
+    stream = connector.section['kinesis_stream']
+    shard_ids = [shard['ShardId'] for shard in kinesis_client.list_shards(StreamName=stream)['Shards']]
+    # the consumer case reads back what the producer path writes, several ticks deep
+    for snapshot in price_ticks(payload,5):
+        connector.write_to_kinesis_stream(producer.build_records(decode_assets_payload(snapshot)))
+    read_records = sum(len(kinesis_client.get_records(ShardIterator=kinesis_client.get_shard_iterator(
+        StreamName=stream,ShardId=shard_id,ShardIteratorType='TRIM_HORIZON')['ShardIterator'])['Records']) for shard_id in shard_ids)
+
+    # a consumer keeps one aggregator for its lifetime, so slot allocation stays out of the timed path
+    aggregator = StreamingAggregator(initial_assets=len(payload['data']))
+
+    def consumer_read():
+        for shard_id in shard_ids:
+            shard_iterator = kinesis_client.get_shard_iterator(StreamName=stream,ShardId=shard_id,ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+            response = kinesis_client.get_records(ShardIterator=shard_iterator,Limit=10000)
+            aggregator.handle_kinesis_records(shard_id,deaggregate_records(response['Records']))
+
+    json_serializer = get_serializer('json')
+    compact_serializer = get_serializer('compact')
+    compact_zlib_serializer = get_serializer('compact','zlib')
+    return {
+        'decode':(lambda:decode_assets_payload(payload),len(payload['data'])),
+        'build_records':(lambda:producer.build_records(batch),len(batch)),
+        'serialize_json':(lambda:json_serializer.encode_batch(batch),len(batch)),
+        'serialize_compact':(lambda:compact_serializer.encode_batch(batch),len(batch)),
+        'serialize_compact_zlib':(lambda:compact_zlib_serializer.encode_batch(batch),len(batch)),
+        'aggregate_kpl':(lambda:record_aggregator.aggregate(records),len(records)),
+        'put_records':(lambda:connector.write_to_kinesis_stream(records),len(records)),
+        'consumer_read':(consumer_read,read_records)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,cwd=MAIN_DIR,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+
+def baseline(history,case,window=5):
+    # median of recent runs, so one noisy run does not move the bar
+    values = [run['results'][case]['records_per_second'] for run in history if case in run.get('results',{})][-window:]
+    return statistics.median(values) if values else None
+
+
+def report(results,history,threshold):
+    regressions = []
+    print(f'{"case":<24}{"records/s":>14}{"p50 ms":>10}{"p99 ms":>10}{"peak KiB":>11}{"blocks":>9}{"vs base":>10}')
+    for case,result in results.items():
+        base = baseline(history,case)
+        change = ''
+        if base:
+            ratio = result['records_per_second'] / base - 1
+            change = f'{ratio * 100:+.1f}%'
+            if ratio < -threshold:
+                regressions.append(case)
+                change += ' !'
+        print(f'{case:<24}{result["records_per_second"]:>14,.0f}{result["p50_ms"]:>10.3f}{result["p99_ms"]:>10.3f}'
+              f'{result["peak_alloc_bytes"] / 1024:>11.1f}{result["retained_blocks"]:>9}{change:>10}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion and consumer hot paths against fixtures and the local AWS backend')
+    parser.add_argument('--config',default=DEFAULT_CONFIG)
+    parser.add_argument('--fixture',default=DEFAULT_FIXTURE)
+    parser.add_argument('--record',action='store_true',help='record a fresh fixture from the configured API endpoint first')
+    parser.add_argument('--assets',type=int,default=2000,help='asset count when no recorded fixture exists')
+    parser.add_argument('--cases',help='comma separated subset of cases to run')
+    parser.add_argument('--iterations',type=int,default=20)
+    parser.add_argument('--warmup',type=int,default=3)
+    parser.add_argument('--history',default=DEFAULT_HISTORY)
+    parser.add_argument('--no-history',action='store_true')
+    parser.add_argument('--regression-threshold',type=float,default=0.10)
+    parser.add_argument('--fail-on-regression',action='store_true')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('benchmarks')
+    logger.setLevel(logging.WARNING)
+    if args.record:
+        config = ConfigParser(interpolation=ExtendedInterpolation())
+        config.read(args.config)
+        api_key = os.getenv('API_KEY')
+        http_source = HttpSource(logger,headers={'Authorization':f'Bearer {api_key}'} if api_key else None)
+        record_assets_payload(http_source,config['api']['api_endpoint'],args.fixture)
+    payload = load_assets_payload(args.fixture,args.assets)
+    source = args.fixture if os.path.exists(args.fixture) else f'synthetic:{args.assets}'
+
+    cases = build_cases(payload,args.config,logger)
+    selected = [name.strip() for name in args.cases.split(',')] if args.cases else list(cases)
+    results = {}
+    for name in selected:
+        func,records_per_call = cases[name]
+        results[name] = measure(func,records_per_call,args.iterations,args.warmup)
+
+    history = load_history(args.history)
+    print(f'fixture={source} assets={len(payload["data"])} iterations={args.iterations}')
+    regressions = report(results,history,args.regression_threshold)
+    if not args.no_history:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)),exist_ok=True)
+        with open(args.history,'a') as history_file:
+            history_file.write(json.dumps({
+                'timestamp':datetime.now(timezone.utc).isoformat(),
+                'commit':git_commit(),
+                'python':platform.python_version(),
+                'machine':platform.machine(),
+                'fixture':source,
+                'results':results
+            }) + '\n')
+    if regressions:
+        print(f'Regressed more than {args.regression_threshold:.0%} against the recent median: {", ".join(regressions)}')
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+# run from src/main as python -m benchmarks.run_benchmarks
+if __name__=="__main__":
+    main()
@@ -1,55 +1,385 @@
 from utils.base_component import BaseComponent
-from utils.aws_connector import AWSConnector
-import requests
+from utils.aws_connector import AWSConnector,StreamUnavailableError
+from data_ingestion.payload_decoder import AssetBatch,decode_assets_payload
+from data_ingestion.delta_filter import DeltaFilter
+from data_ingestion.http_source import HttpSource
+from data_ingestion.sources import RestPollingSource,WebSocketPriceSource,IngestionPipeline
+from utils.serializers import get_serializer,missing_codec_module
+from utils.record_aggregation import RecordAggregator,KPL_DEFAULT_MAX_BYTES
+from utils.partitioner import HashKeyPartitioner
+from utils.write_ahead_spool import WriteAheadSpool
+from utils.kinesis_batch_writer import KinesisBatchWriter,KINESIS_MAX_BYTES_PER_RECORD
+from utils.metrics import get_registry,get_tracer,configure_metrics
 import os
 from dotenv import load_dotenv
 from typing import Dict
-import json
-import time
+import asyncio
+import threading
+
+POLL_ERRORS = get_registry().counter('api_poll_errors_total','API polls that failed after retries')
+POLL_NOT_MODIFIED = get_registry().counter('api_poll_not_modified_total','API polls answered with an unchanged payload')
+ASSETS_PUBLISHED = get_registry().counter('assets_published_total','Asset records handed to the Kinesis writer')
+QUEUE_DEPTH = get_registry().gauge('producer_queue_depth','Datasets waiting for the Kinesis writer',('queue',))
+SPOOL_PENDING = get_registry().gauge('spool_pending_records','Records spooled but not yet acknowledged by Kinesis')
+RECORDS_REJECTED = get_registry().counter('producer_records_rejected_total','Records dropped for exceeding the Kinesis record size limit')
 
 
 class BaseProducer(BaseComponent):
-    def __init__(self,config,section_name,aws_section):
+    def __init__(self,config,section_name,aws_section,aws_connector=None):
         super().__init__(config,section_name)
-        aws_section = self.read_config(config,aws_section)
-        self.aws_connector = AWSConnector(self.logger,aws_section)
+        self.aws_section = self.read_config(config,aws_section)
+        self.aws_connector = aws_connector or AWSConnector(self.logger,self.aws_section)
+        self.metrics_section = self.read_config(config,'metrics')
+        self.metrics_exporter = None
+        self.tracer = get_tracer()
+        # set by a supervised worker to the shards whose assets it publishes; None publishes everything
+        self.owned_shards = None
+        self.key_shards = {}
+        self.stop_event = threading.Event()
+        self.pipeline = None
+        self.pipeline_loop = None
+        self.spool_drainer = None
+        self.spool_ready = threading.Event()
+        self.spool_stop = threading.Event()
         
     def initialize(self):
         load_dotenv()
         self.api_key = os.getenv('API_KEY')
         self.api_endpoint = self.config.get('api_endpoint')    
         self.partition_key = self.config.get('partition_key')    
+        self.producer_mode = self.config.get('producer_mode','sync')
+        self.poll_interval_seconds = float(self.config.get('poll_interval_seconds',30))
+        self.queue_max_size = int(self.config.get('queue_max_size',10))
+        self.max_iterations = int(self.config.get('max_iterations',10))
+        self.teardown_on_exit = self.config.get('teardown_on_exit','true').lower() == 'true'
+        record_format = self.config.get('record_format','json')
+        # Firehose converts the stream to Parquet through a JSON deserializer, so binary records would fail every delivery
+        if record_format != 'json' and (self.aws_section or {}).get('firehose_enabled','true').lower() == 'true':
+            raise ValueError(f'record_format={record_format} cannot be written to a stream that Firehose delivers to the lake; '
+                             'use record_format=json or set firehose_enabled=false')
+        record_compression = self.config.get('record_compression','none')
+        missing_module = missing_codec_module(record_compression) if record_format == 'compact' else None
+        if missing_module:
+            raise ValueError(f'record_compression={record_compression} needs the {missing_module} package, which is not installed; '
+                             f'install {missing_module} or use record_compression=zlib')
+        self.serializer = get_serializer(record_format,record_compression)
+        self.aggregation_enabled = self.config.get('aggregation_enabled','false').lower() == 'true'
+        self.record_aggregator = RecordAggregator(max_bytes=int(self.config.get('aggregation_max_bytes',KPL_DEFAULT_MAX_BYTES)))
+        self.partition_strategy = self.config.get('partition_strategy','key')
+        self.partitioner = None
+        self.shard_ranges_loaded = False
+        self.page_size = int(self.config.get('page_size',2000))
+        self.max_pages = int(self.config.get('max_pages',10))
+        self.delta_filter = None
+        if self.config.get('delta_enabled','false').lower() == 'true':
+            self.delta_filter = DeltaFilter(fields=[name.strip() for name in self.config.get('delta_fields','priceUsd,volumeUsd24Hr,marketCapUsd,changePercent24Hr,supply').split(',')],
+                                            relative_tolerance=float(self.config.get('delta_relative_tolerance',1e-4)),
+                                            absolute_tolerance=float(self.config.get('delta_absolute_tolerance',0)),
+                                            full_snapshot_interval_seconds=float(self.config.get('full_snapshot_interval_seconds',300)))
+        self.http_source = HttpSource(self.logger,
+                                      headers={'Authorization':f'Bearer {self.api_key}'} if self.api_key else None,
+                                      connect_timeout=float(self.config.get('http_connect_timeout',3.05)),
+                                      read_timeout=float(self.config.get('http_read_timeout',10)),
+                                      max_retries=int(self.config.get('http_max_retries',5)),
+                                      backoff_seconds=float(self.config.get('http_backoff_seconds',0.5)),
+                                      max_backoff_seconds=float(self.config.get('http_max_backoff_seconds',30)),
+                                      pool_size=int(self.config.get('http_pool_size',10)),
+                                      max_concurrency=int(self.config.get('http_max_concurrency',4)),
+                                      conditional=self.delta_filter is not None)
+        self.metrics_exporter = configure_metrics(self.metrics_section)
+        self.spool = None
+        self.spool_drain_max_records = int(self.config.get('spool_drain_max_records',10000))
+        self.spool_retry_seconds = float(self.config.get('spool_retry_seconds',1))
+        self.spool_retry_max_seconds = float(self.config.get('spool_retry_max_seconds',30))
+        if self.config.get('spool_enabled','false').lower() == 'true':
+            self.spool = WriteAheadSpool(self.logger,self.config.get('spool_directory','spool'),
+                                         segment_max_bytes=int(self.config.get('spool_segment_max_bytes',67108864)),
+                                         fsync=self.config.get('spool_fsync','false').lower() == 'true')
    
     def _request_response(self)-> Dict:
         try:
-            headers = {'Authorization':f'Bearer{self.api_key}'}
-            response = requests.get(self.api_endpoint,headers=headers)
-            if response.status_code != 200:
-                raise Exception(f'API response error:{response.status_code}')
-                self.logger.exception(response.status_code,exc_info=True)
-            else:
-                return response.json()
+            with self.tracer.span('poll'):
+                payload,modified = self.http_source.fetch_paged(self.api_endpoint,page_size=self.page_size,max_pages=self.max_pages)
+            if not modified:
+                POLL_NOT_MODIFIED.inc()
+                # a quiet market can answer 304 for hours, so the cached payload goes out again when a full snapshot is due
+                if self.delta_filter and self.delta_filter.full_snapshot_due():
+                    self.logger.info('Assets endpoint unchanged since last poll, republishing it as the periodic full snapshot')
+                    return payload
+                self.logger.info('Assets endpoint unchanged since last poll')
+                return None
+            return payload
         except Exception as e:
-            self.logger.exception(e,exc_info=True)
-            raise Exception(f'error:{e}')
+            # a failed poll skips this cycle instead of stopping the producer
+            POLL_ERRORS.inc()
+            self.logger.error(f'Polling {self.api_endpoint} failed: {e}',exc_info=True)
+            return None
         
+    def _fetch_batch(self)-> AssetBatch:
+        payload = self._request_response()
+        if payload is None:
+            return None
+        # the API cannot be asked for a hash range, so each worker slices the response before any per-asset work
+        data = self._owned_assets(payload['data'])
+        if not data:
+            return None
+        with self.tracer.span('decode',assets=len(data)):
+            batch = decode_assets_payload({'data':data,'timestamp':payload['timestamp']})
+            if self.delta_filter:
+                batch = self.delta_filter.filter(batch)
+                self.logger.info(f'Publishing {len(batch)} of {len(data)} assets after delta filtering')
+        return batch if len(batch) else None
+
+    def build_records(self,dataset):
+        with self.tracer.span('build_records'):
+            if isinstance(dataset,AssetBatch):
+                records = dataset.to_kinesis_records(self.serializer,self.partition_key)
+            elif isinstance(dataset,list):
+                records = [{'Data': self.serializer.encode(record),'PartitionKey': str(record[self.partition_key])} for record in dataset]
+            else:
+                records = [{'Data': self.serializer.encode(record | {'Timestamp':dataset['timestamp']}),
+                            'PartitionKey': str(record[self.partition_key])} for record in dataset['data']]
+        ASSETS_PUBLISHED.inc(len(records))
+        return records
+
     def write_to_stream(self,dataset):
-        records = [{'Data': json.dumps(record | {'Timestamp':dataset['timestamp']}).encode('utf-8'),
-                    'PartitionKey': record['id']} for record in dataset['data']]
-        self.aws_connector.write_to_kinesis_stream(records)
+        self.write_records(self.build_records(dataset))
+
+    def _key_shard(self,partition_key):
+        # partition keys repeat every poll, so each is hashed to its shard once
+        shard = self.key_shards.get(partition_key)
+        if shard is None:
+            shard = self.key_shards[partition_key] = self.aws_connector.resolve_shard({'PartitionKey':partition_key})
+        return shard
+
+    def _owned_assets(self,data):
+        owned_shards = self.owned_shards
+        if owned_shards is None:
+            return data
+        return [record for record in data if self._key_shard(str(record[self.partition_key])) in owned_shards]
+
+    def _owned_records(self,records):
+        owned_shards = self.owned_shards
+        if owned_shards is None:
+            return records
+        return [record for record in records if self._key_shard(record['PartitionKey']) in owned_shards]
+
+    def _prepare_records(self,records):
+        if self.partition_strategy == 'explicit_hash' or self.aggregation_enabled:
+            try:
+                self._load_shard_ranges()
+            except StreamUnavailableError as e:
+                if self.spool is None:
+                    raise
+                # shard ranges need the stream, so records go into the spool as they are and are replayed unaggregated
+                self.logger.warning(f'Stream unavailable, spooling {len(records)} records without partitioning or aggregation: {e}')
+                return records
+        if self.partitioner:
+            records = self.partitioner.assign(records)
+        if self.aggregation_enabled:
+            with self.tracer.span('aggregate',records=len(records)):
+                records = self.record_aggregator.aggregate(records)
+        return records
+
+    def _reject_oversized(self,records):
+        # Kinesis can never accept these, so they are dropped here rather than spooled and replayed forever
+        accepted = [record for record in records if KinesisBatchWriter.record_size(record) <= KINESIS_MAX_BYTES_PER_RECORD]
+        rejected = len(records) - len(accepted)
+        if rejected:
+            RECORDS_REJECTED.inc(rejected)
+            self.logger.error(f'Rejected {rejected} records exceeding the Kinesis record limit of {KINESIS_MAX_BYTES_PER_RECORD} bytes')
+        return accepted
+
+    def write_records(self,records):
+        records = self._owned_records(records)
+        if not records:
+            return
+        records = self._reject_oversized(self._prepare_records(records))
+        if not records:
+            return
+        if self.spool is None:
+            with self.tracer.span('write',records=len(records)):
+                self.aws_connector.write_to_kinesis_stream(records)
+            return
+        with self.tracer.span('spool_append',records=len(records)):
+            self.spool.append(records)
+        SPOOL_PENDING.set(self.spool.pending_count())
+        self.spool_ready.set()
+
+    def drain_spool(self):
+        # replays oldest first, so a backlog left by a restart or throttling goes out before new records.
+        # Returns False when the stream rejected the pass, so the caller can back off
+        pending = self.spool.pending(self.spool_drain_max_records)
+        if not pending:
+            SPOOL_PENDING.set(0)
+            return True
+        try:
+            with self.tracer.span('write',records=len(pending)):
+                results = self.aws_connector.write_to_kinesis_stream([record for _,record in pending])
+        except Exception as e:
+            SPOOL_PENDING.set(self.spool.pending_count())
+            self.logger.warning(f'Kinesis write failed, {self.spool.pending_count()} records kept in spool for replay: {e}')
+            return False
+        failed = {id(record) for result in results for record in result.failed_records}
+        self.spool.acknowledge([seq for seq,record in pending if id(record) not in failed])
+        SPOOL_PENDING.set(self.spool.pending_count())
+        if failed:
+            self.logger.warning(f'{len(failed)} records kept in spool for replay, {self.spool.pending_count()} pending')
+        return not failed
+
+    def _run_spool_drainer(self):
+        # replays beside the poll and write path, so throttling or an outage delays delivery but never polling
+        failures = 0
+        while not self.spool_stop.is_set():
+            if failures:
+                self.spool_stop.wait(min(self.spool_retry_max_seconds,self.spool_retry_seconds * 2 ** (failures - 1)))
+            else:
+                self.spool_ready.wait()
+            self.spool_ready.clear()
+            if self.spool_stop.is_set():
+                return
+            if not self.drain_spool():
+                failures += 1
+                continue
+            failures = 0
+            if self.spool.pending_count():
+                self.spool_ready.set()
+
+    def start_spool_drainer(self):
+        self.spool_stop.clear()
+        # records recovered from a previous run go out without waiting for the first write
+        self.spool_ready.set()
+        self.spool_drainer = threading.Thread(target=self._run_spool_drainer,name='spool-drainer',daemon=True)
+        self.spool_drainer.start()
+
+    def stop_spool_drainer(self):
+        if self.spool_drainer is None:
+            return
+        self.spool_stop.set()
+        self.spool_ready.set()
+        self.spool_drainer.join()
+        self.spool_drainer = None
+
+    def close_spool(self):
+        self.stop_spool_drainer()
+        # one last replay on the way out; it stops at the first rejected pass instead of retrying
+        while self.spool.pending_count() and self.drain_spool():
+            pass
+        if self.spool.pending_count():
+            self.logger.warning(f'{self.spool.pending_count()} records remain in spool and will be replayed on the next start')
+        self.spool.close()
+
+    def _load_shard_ranges(self):
+        if self.shard_ranges_loaded:
+            return
+        self.aws_connector.ensure_resources()
+        shard_hash_ranges = self.aws_connector.get_shard_hash_ranges()
+        self.record_aggregator.set_shard_hash_ranges(shard_hash_ranges)
+        if self.partition_strategy == 'explicit_hash':
+            self.partitioner = HashKeyPartitioner(self.logger,shard_hash_ranges,
+                                                  rate_window_seconds=float(self.config.get('partition_rate_window_seconds',5)),
+                                                  rebalance_interval_seconds=float(self.config.get('partition_rebalance_interval_seconds',60)),
+                                                  imbalance_threshold=float(self.config.get('partition_imbalance_threshold',1.25)))
+        self.shard_ranges_loaded = True
+
+    async def _poll_api(self,queue):
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        polls = 0
+        while not self.stop_event.is_set() and (self.max_iterations <= 0 or polls < self.max_iterations):
+            polls += 1
+            dataset = await asyncio.to_thread(self._fetch_batch)
+            # blocks while the queue is full so a slow writer throttles polling
+            if dataset is not None:
+                await queue.put(dataset)
+                QUEUE_DEPTH.set(queue.qsize(),queue='producer')
+            next_poll += self.poll_interval_seconds
+            delay = next_poll - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.logger.warning(f'Poll cycle overran interval by {-delay:.3f}s')
+                next_poll = loop.time()
+        await queue.put(None)
+
+    async def _write_stream(self,queue):
+        while True:
+            dataset = await queue.get()
+            QUEUE_DEPTH.set(queue.qsize(),queue='producer')
+            try:
+                if dataset is None:
+                    return
+                await asyncio.to_thread(self.write_to_stream,dataset)
+            finally:
+                queue.task_done()
+
+    async def run_async(self):
+        queue = asyncio.Queue(maxsize=self.queue_max_size)
+        tasks = {asyncio.create_task(self._poll_api(queue)),asyncio.create_task(self._write_stream(queue))}
+        done,pending = await asyncio.wait(tasks,return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    def build_sources(self):
+        sources = []
+        for source_name in [name.strip() for name in self.config.get('sources','rest').split(',') if name.strip()]:
+            if source_name == 'rest':
+                sources.append(RestPollingSource(self.logger,'rest',self._fetch_batch,self.poll_interval_seconds,
+                                                 self.max_iterations if self.max_iterations > 0 else None))
+            elif source_name == 'websocket':
+                sources.append(WebSocketPriceSource(self.logger,'websocket',self.config.get('websocket_endpoint'),
+                                                    reconnect_delay_seconds=float(self.config.get('websocket_reconnect_delay_seconds',1))))
+            else:
+                raise ValueError(f'Unknown ingestion source {source_name}')
+        return sources
+
+    async def run_pipeline(self):
+        self.pipeline = IngestionPipeline(self.logger,self.build_sources(),self.build_records,self.write_records,
+                                          queue_max_size=self.queue_max_size,
+                                          max_batch_records=int(self.config.get('pipeline_max_batch_records',500)),
+                                          linger_seconds=float(self.config.get('pipeline_linger_seconds',0.2)),
+                                          drain_timeout_seconds=float(self.config.get('pipeline_drain_timeout_seconds',30)))
+        self.pipeline_loop = asyncio.get_running_loop()
+        if self.stop_event.is_set():
+            return
+        await self.pipeline.run()
+
+    def stop(self):
+        self.stop_event.set()
+        # the pipeline's stop event belongs to its loop, so it is set from that loop's thread
+        if self.pipeline and self.pipeline_loop and not self.pipeline_loop.is_closed():
+            self.pipeline_loop.call_soon_threadsafe(self.pipeline.stop)
 
     def run(self):
         try:
             self.initialize()
-            counter = 0
-            while counter < 10:
-                dataset = self._request_response()
-                self.write_to_stream(dataset)
-                time.sleep(30)
-                counter += 1
-            self.aws_connector.delete_streams()
+            if self.spool:
+                self.start_spool_drainer()
+            if self.producer_mode == 'async':
+                asyncio.run(self.run_async())
+            elif self.producer_mode == 'pipeline':
+                asyncio.run(self.run_pipeline())
+            else:
+                counter = 0
+                while not self.stop_event.is_set() and (self.max_iterations <= 0 or counter < self.max_iterations):
+                    dataset = self._fetch_batch()
+                    if dataset is not None:
+                        self.write_to_stream(dataset)
+                    self.stop_event.wait(self.poll_interval_seconds)
+                    counter += 1
+            if self.spool:
+                self.close_spool()
+            if self.teardown_on_exit:
+                self.aws_connector.delete_streams()
             self.logger.info('API processing complete. Exiting script')
         except Exception as e:
             self.logger.error(e,exc_info=True)
+        finally:
+            self.stop_spool_drainer()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop()
+            self.tracer.close()
       
     
\ No newline at end of file
@@ -0,0 +1,57 @@
+import time
+import numpy as np
+
+DEFAULT_DELTA_FIELDS = ('priceUsd','volumeUsd24Hr','marketCapUsd','changePercent24Hr','supply')
+
+
+class DeltaFilter():
+    def __init__(self,fields=DEFAULT_DELTA_FIELDS,relative_tolerance=1e-4,absolute_tolerance=0.0,full_snapshot_interval_seconds=300):
+        self.fields = tuple(fields)
+        self.relative_tolerance = relative_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.full_snapshot_interval_seconds = full_snapshot_interval_seconds
+        self.asset_slots = {}
+        self.published = {name:np.empty(0,dtype=np.float64) for name in self.fields}
+        self.published_rank = np.empty(0,dtype=np.int64)
+        self.last_full_snapshot = None
+
+    def _slots(self,ids):
+        slots = np.fromiter((self.asset_slots.setdefault(asset_id,len(self.asset_slots)) for asset_id in ids),dtype=np.int64,count=len(ids))
+        size = len(self.asset_slots)
+        if size > len(self.published_rank):
+            grow = max(size,2 * len(self.published_rank)) - len(self.published_rank)
+            for name in self.fields:
+                self.published[name] = np.concatenate([self.published[name],np.full(grow,np.nan)])
+            self.published_rank = np.concatenate([self.published_rank,np.full(grow,-1,dtype=np.int64)])
+        return slots
+
+    def full_snapshot_due(self):
+        return self.last_full_snapshot is None or time.monotonic() - self.last_full_snapshot >= self.full_snapshot_interval_seconds
+
+    def _is_full_snapshot_due(self):
+        if self.full_snapshot_due():
+            self.last_full_snapshot = time.monotonic()
+            return True
+        return False
+
+    def filter(self,batch):
+        slots = self._slots(batch.ids.tolist())
+        if self._is_full_snapshot_due():
+            changed = np.ones(len(slots),dtype=bool)
+        else:
+            # rank moves are always published; numeric fields only once they leave the tolerance band
+            changed = batch.ints['rank'] != self.published_rank[slots]
+            for name in self.fields:
+                current,previous = batch.floats[name],self.published[name][slots]
+                current_missing,previous_missing = np.isnan(current),np.isnan(previous)
+                with np.errstate(invalid='ignore'):
+                    moved = np.abs(current - previous) > np.maximum(self.absolute_tolerance,self.relative_tolerance * np.abs(previous))
+                changed |= (moved & ~current_missing & ~previous_missing) | (current_missing != previous_missing)
+        indices = np.flatnonzero(changed)
+        published_slots = slots[indices]
+        for name in self.fields:
+            self.published[name][published_slots] = batch.floats[name][indices]
+        self.published_rank[published_slots] = batch.ints['rank'][indices]
+        if len(indices) == len(slots):
+            return batch
+        return batch.take(indices)
@@ -0,0 +1,142 @@
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime,timezone
+from requests.adapters import HTTPAdapter
+from utils.metrics import get_registry
+
+RETRYABLE_STATUS_CODES = {429,500,502,503,504}
+
+HTTP_RETRIES = get_registry().counter('http_retries_total','API request retries by cause',('cause',))
+HTTP_REQUEST_LATENCY = get_registry().histogram('http_request_latency_seconds','Latency of single API requests',('status',))
+
+
+class ApiResponseError(Exception):
+    def __init__(self,status_code,url,message=None):
+        super().__init__(message or f'API response error:{status_code} for {url}')
+        self.status_code = status_code
+        self.url = url
+
+
+class ApiRateLimitError(ApiResponseError):
+    def __init__(self,url,retry_after):
+        super().__init__(429,url,f'API rate limit exceeded for {url}, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class HttpSource():
+    def __init__(self,logger,headers=None,connect_timeout=3.05,read_timeout=10,max_retries=5,backoff_seconds=0.5,
+                 max_backoff_seconds=30,pool_size=10,max_concurrency=4,conditional=False):
+        self.logger = logger
+        self.timeout = (connect_timeout,read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_concurrency = max_concurrency
+        self.conditional = conditional
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+        self.session.mount('https://',adapter)
+        self.session.mount('http://',adapter)
+        self.session.headers.update({'Accept-Encoding':'gzip, deflate','Accept':'application/json'})
+        self.session.headers.update(headers or {})
+        self._validators = {}
+        self._validators_lock = threading.Lock()
+
+    @staticmethod
+    def _retry_after_seconds(value):
+        if not value:
+            return None
+        try:
+            return max(float(value),0.0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(),0.0)
+        except (TypeError,ValueError):
+            return None
+
+    def _backoff(self,attempt):
+        return random.uniform(0,min(self.max_backoff_seconds,self.backoff_seconds * (2 ** attempt)))
+
+    def fetch(self,url,params=None):
+        cache_key = (url,tuple(sorted((params or {}).items())))
+        headers = {}
+        if self.conditional:
+            with self._validators_lock:
+                etag,last_modified,_ = self._validators.get(cache_key,(None,None,None))
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url,params=params,headers=headers,timeout=self.timeout)
+            except (requests.ConnectionError,requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                HTTP_RETRIES.inc(cause=type(e).__name__)
+                delay = self._backoff(attempt)
+                self.logger.info(f'Request to {url} failed ({e}). Retry {attempt + 1} in {delay:.2f}s')
+            else:
+                HTTP_REQUEST_LATENCY.observe(time.perf_counter() - start,status=response.status_code)
+                if response.status_code == 304:
+                    with self._validators_lock:
+                        return self._validators[cache_key][2],False
+                if response.status_code == 200:
+                    payload = response.json()
+                    if self.conditional:
+                        with self._validators_lock:
+                            self._validators[cache_key] = (response.headers.get('ETag'),response.headers.get('Last-Modified'),payload)
+                    return payload,True
+                retry_after = self._retry_after_seconds(response.headers.get('Retry-After'))
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise ApiResponseError(response.status_code,url)
+                if attempt >= self.max_retries:
+                    if response.status_code == 429:
+                        raise ApiRateLimitError(url,retry_after)
+                    raise ApiResponseError(response.status_code,url)
+                HTTP_RETRIES.inc(cause=response.status_code)
+                # Retry-After is honoured up to the backoff cap, so one hostile header cannot stall a poll for an hour
+                delay = min(retry_after,self.max_backoff_seconds) if retry_after is not None else self._backoff(attempt)
+                self.logger.info(f'API returned {response.status_code} for {url}. Retry {attempt + 1} in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
+
+    def fetch_many(self,requests_to_send):
+        # requests_to_send maps a name to (url, params); results keep the same keys
+        with ThreadPoolExecutor(max_workers=max(1,min(self.max_concurrency,len(requests_to_send)))) as executor:
+            futures = {name:executor.submit(self.fetch,url,params) for name,(url,params) in requests_to_send.items()}
+            return {name:future.result() for name,future in futures.items()}
+
+    def fetch_paged(self,url,page_size=2000,max_pages=10,params=None):
+        pages = []
+        modified = False
+        offset = 0
+        while len(pages) < max_pages:
+            wave = min(self.max_concurrency,max_pages - len(pages))
+            wave_requests = {index:(url,(params or {}) | {'limit':page_size,'offset':offset + index * page_size}) for index in range(wave)}
+            results = self.fetch_many(wave_requests)
+            last_page_full = True
+            for index in range(wave):
+                payload,page_modified = results[index]
+                pages.append(payload)
+                modified |= page_modified
+                if len(payload.get('data',[])) < page_size:
+                    last_page_full = False
+                    break
+            if not last_page_full:
+                break
+            offset += wave * page_size
+        data = [record for page in pages for record in page.get('data',[])]
+        timestamp = max((page.get('timestamp',0) for page in pages),default=0)
+        return {'data':data,'timestamp':timestamp},modified
+
+    def close(self):
+        self.session.close()
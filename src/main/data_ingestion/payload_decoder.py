@@ -0,0 +1,68 @@
+import sys
+import numpy as np
+from dataclasses import dataclass,field
+from typing import Dict
+from utils.serializers import ASSET_STRING_FIELDS,ASSET_INT_FIELDS,ASSET_FLOAT_FIELDS,JsonSerializer
+
+INT_MISSING = -1
+
+
+@dataclass
+class AssetBatch:
+    timestamp: int
+    strings: Dict[str,np.ndarray] = field(default_factory=dict)
+    ints: Dict[str,np.ndarray] = field(default_factory=dict)
+    floats: Dict[str,np.ndarray] = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.strings['id'])
+
+    @property
+    def ids(self):
+        return self.strings['id']
+
+    def column(self,name):
+        for columns in (self.floats,self.ints,self.strings):
+            if name in columns:
+                return columns[name]
+        raise KeyError(name)
+
+    def take(self,indices):
+        return AssetBatch(timestamp=self.timestamp,
+                          strings={name:column[indices] for name,column in self.strings.items()},
+                          ints={name:column[indices] for name,column in self.ints.items()},
+                          floats={name:column[indices] for name,column in self.floats.items()})
+
+    def to_records(self):
+        # one tolist() per column keeps the per-row work to a dict build
+        names = list(self.strings) + list(self.ints) + list(self.floats)
+        columns = [column.tolist() for column in self.strings.values()]
+        columns += [[None if value == INT_MISSING else value for value in column.tolist()] for column in self.ints.values()]
+        columns += [[None if value != value else value for value in column.tolist()] for column in self.floats.values()]
+        timestamp = self.timestamp
+        return [dict(zip(names,row),Timestamp=timestamp) for row in zip(*columns)]
+
+    def to_kinesis_records(self,serializer=None,partition_key='id'):
+        serializer = serializer or JsonSerializer()
+        partition_keys = [str(key) for key in self.column(partition_key).tolist()]
+        return [{'Data':data,'PartitionKey':key} for data,key in zip(serializer.encode_batch(self),partition_keys)]
+
+
+def _float_column(data,name):
+    values = np.array([record.get(name) or 'nan' for record in data],dtype=object)
+    return values.astype(np.float64)
+
+
+def _int_column(data,name):
+    values = np.array([record.get(name) or INT_MISSING for record in data],dtype=object)
+    return values.astype(np.int64)
+
+
+def decode_assets_payload(payload):
+    data = payload['data']
+    strings = {name:np.array([sys.intern(record[name]) if record.get(name) is not None else None for record in data],dtype=object)
+               for name in ASSET_STRING_FIELDS}
+    return AssetBatch(timestamp=int(payload['timestamp']),
+                      strings=strings,
+                      ints={name:_int_column(data,name) for name in ASSET_INT_FIELDS},
+                      floats={name:_float_column(data,name) for name in ASSET_FLOAT_FIELDS})
@@ -0,0 +1,190 @@
+import json
+import time
+import random
+import asyncio
+from abc import ABC,abstractmethod
+from utils.metrics import get_registry
+
+QUEUE_DEPTH = get_registry().gauge('producer_queue_depth','Datasets waiting for the Kinesis writer',('queue',))
+SOURCE_DATASETS = get_registry().counter('source_datasets_total','Datasets emitted per ingestion source',('source',))
+
+
+class Source(ABC):
+    def __init__(self,logger,name):
+        self.logger = logger
+        self.name = name
+
+    @abstractmethod
+    async def run(self,emit,stop_event):
+        pass
+
+
+class RestPollingSource(Source):
+    def __init__(self,logger,name,fetch,poll_interval_seconds=30,max_iterations=None):
+        super().__init__(logger,name)
+        self.fetch = fetch
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_iterations = max_iterations
+
+    async def run(self,emit,stop_event):
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        iteration = 0
+        while not stop_event.is_set() and (self.max_iterations is None or iteration < self.max_iterations):
+            dataset = await asyncio.to_thread(self.fetch)
+            if dataset is not None:
+                await emit(self.name,dataset)
+            iteration += 1
+            next_poll += self.poll_interval_seconds
+            delay = next_poll - loop.time()
+            if delay <= 0:
+                self.logger.warning(f'Source {self.name} poll cycle overran interval by {-delay:.3f}s')
+                next_poll = loop.time()
+                continue
+            try:
+                await asyncio.wait_for(stop_event.wait(),timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class WebSocketPriceSource(Source):
+    def __init__(self,logger,name,url,reconnect_delay_seconds=1,max_reconnect_delay_seconds=60,open_timeout=10):
+        super().__init__(logger,name)
+        self.url = url
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self.max_reconnect_delay_seconds = max_reconnect_delay_seconds
+        self.open_timeout = open_timeout
+
+    @staticmethod
+    def parse_message(message,timestamp):
+        # CoinCap pushes {"bitcoin": "6929.82", ...} with only the assets whose price moved
+        prices = json.loads(message)
+        return [{'id':asset_id,'priceUsd':price,'Timestamp':timestamp} for asset_id,price in prices.items()]
+
+    async def run(self,emit,stop_event):
+        import websockets
+
+        delay = self.reconnect_delay_seconds
+        while not stop_event.is_set():
+            try:
+                async with websockets.connect(self.url,open_timeout=self.open_timeout,max_size=None) as websocket:
+                    self.logger.info(f'Source {self.name} connected to {self.url}')
+                    delay = self.reconnect_delay_seconds
+                    stop_wait = asyncio.ensure_future(stop_event.wait())
+                    try:
+                        while True:
+                            receive = asyncio.ensure_future(websocket.recv())
+                            done,_ = await asyncio.wait({receive,stop_wait},return_when=asyncio.FIRST_COMPLETED)
+                            if stop_wait in done:
+                                receive.cancel()
+                                return
+                            records = self.parse_message(receive.result(),int(time.time() * 1000))
+                            if records:
+                                await emit(self.name,records)
+                    finally:
+                        stop_wait.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f'Source {self.name} disconnected: {e}. Reconnecting in {delay:.1f}s')
+                try:
+                    await asyncio.wait_for(stop_event.wait(),timeout=random.uniform(0,delay))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2,self.max_reconnect_delay_seconds)
+
+
+class IngestionPipeline():
+    def __init__(self,logger,sources,build_records,write_records,queue_max_size=100,max_batch_records=500,linger_seconds=0.2,
+                 drain_timeout_seconds=30):
+        self.logger = logger
+        self.sources = sources
+        self.build_records = build_records
+        self.write_records = write_records
+        self.queue_max_size = queue_max_size
+        self.max_batch_records = max_batch_records
+        self.linger_seconds = linger_seconds
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.stop_event = None
+
+    async def _emit(self,source_name,dataset):
+        SOURCE_DATASETS.inc(source=source_name)
+        # serializing a snapshot is CPU work, so it runs beside the loop like the writes in _flush
+        records = await asyncio.to_thread(self.build_records,dataset)
+        if records:
+            # blocks when the writer falls behind, applying backpressure to every source
+            await self.queue.put(records)
+            QUEUE_DEPTH.set(self.queue.qsize(),queue='pipeline')
+
+    async def _flush(self,buffer):
+        if buffer:
+            await asyncio.to_thread(self.write_records,buffer)
+
+    async def _batch_writer(self,sources_done):
+        loop = asyncio.get_running_loop()
+        buffer = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(),0)
+            try:
+                records = await asyncio.wait_for(self.queue.get(),timeout=timeout)
+            except asyncio.TimeoutError:
+                records = None
+            if records is not None:
+                self.queue.task_done()
+                QUEUE_DEPTH.set(self.queue.qsize(),queue='pipeline')
+                if not buffer:
+                    deadline = loop.time() + self.linger_seconds
+                buffer.extend(records)
+            if len(buffer) >= self.max_batch_records or (buffer and loop.time() >= deadline):
+                await self._flush(buffer)
+                buffer,deadline = [],None
+            if sources_done.is_set() and self.queue.empty():
+                await self._flush(buffer)
+                return
+
+    async def _drain(self,writer,sources_done):
+        # whatever the sources already emitted is flushed before the writer goes away, whether they stopped or failed
+        if writer.done():
+            return
+        sources_done.set()
+        try:
+            # wakes the writer if it is blocked on an empty queue; a full queue means it is busy anyway
+            self.queue.put_nowait([])
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(asyncio.shield(writer),timeout=self.drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            self.logger.error(f'Batch writer did not drain within {self.drain_timeout_seconds}s, '
+                              f'dropping {self.queue.qsize()} queued batches')
+            writer.cancel()
+
+    def stop(self):
+        if self.stop_event:
+            self.stop_event.set()
+
+    async def run(self):
+        self.stop_event = asyncio.Event()
+        self.queue = asyncio.Queue(maxsize=self.queue_max_size)
+        sources_done = asyncio.Event()
+        writer = asyncio.create_task(self._batch_writer(sources_done))
+        source_tasks = [asyncio.create_task(source.run(self._emit,self.stop_event),name=source.name) for source in self.sources]
+        try:
+            pending = set(source_tasks)
+            while pending:
+                done,pending = await asyncio.wait(pending | {writer},return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(writer)
+                if writer in done:
+                    writer.result()
+                    raise RuntimeError('Batch writer stopped before the sources finished')
+                for task in done:
+                    if task.exception():
+                        self.logger.error(f'Source {task.get_name()} failed: {task.exception()}')
+                        raise task.exception()
+        finally:
+            self.stop_event.set()
+            for task in source_tasks:
+                task.cancel()
+            await asyncio.gather(*source_tasks,return_exceptions=True)
+            await self._drain(writer,sources_done)
@@ -0,0 +1,266 @@
+from array import array
+from utils.serializers import decode_record
+from utils.metrics import get_registry
+import math
+import time
+
+END_TO_END_LAG = get_registry().histogram('end_to_end_lag_seconds','Time from the API snapshot timestamp to aggregation',
+                                          buckets=(0.1,0.5,1,2.5,5,10,30,60,120,300,600))
+
+
+class StreamingAggregator():
+    def __init__(self,tumbling_window_seconds=60,sliding_window_seconds=300,sliding_capacity=1024,initial_assets=256):
+        self.tumbling_window_ms = int(tumbling_window_seconds * 1000)
+        self.sliding_window_ms = int(sliding_window_seconds * 1000)
+        self.capacity = sliding_capacity
+        self.asset_index = {}
+        self.asset_ids = []
+        self._allocated = 0
+
+        # tumbling window state, one slot per asset
+        self.bar_start = array('q')
+        self.bar_open = array('d')
+        self.bar_high = array('d')
+        self.bar_low = array('d')
+        self.bar_close = array('d')
+        self.bar_quantity = array('d')
+        self.bar_volume = array('d')
+        self.bar_ticks = array('q')
+
+        # sliding window state: running sums plus one ring buffer of `capacity` ticks per asset
+        self.last_price = array('d')
+        self.last_volume_24h = array('d')
+        self.ring_head = array('q')
+        self.ring_count = array('q')
+        self.inserts_since_resync = array('q')
+        self.sum_quantity = array('d')
+        self.sum_volume = array('d')
+        # variance sums are kept around a per-asset shift near the mean, so they do not cancel catastrophically
+        self.volume_shift = array('d')
+        self.sum_volume_shifted = array('d')
+        self.sum_volume_shifted_sq = array('d')
+        self.return_shift = array('d')
+        self.sum_return_shifted = array('d')
+        self.sum_return_shifted_sq = array('d')
+        self.return_count = array('q')
+        self.ring_ts = array('q')
+        self.ring_price = array('d')
+        self.ring_volume = array('d')
+        self.ring_return = array('d')
+        self.ring_has_return = array('b')
+        self._grow(initial_assets)
+
+    def _grow(self,size):
+        extra = size - self._allocated
+        for column in (self.bar_start,self.bar_ticks,self.ring_head,self.ring_count,self.inserts_since_resync,self.return_count):
+            column.extend([0] * extra)
+        for column in (self.bar_open,self.bar_high,self.bar_low,self.bar_close,self.bar_quantity,self.bar_volume,
+                       self.last_price,self.last_volume_24h,self.sum_quantity,self.sum_volume,
+                       self.volume_shift,self.sum_volume_shifted,self.sum_volume_shifted_sq,
+                       self.return_shift,self.sum_return_shifted,self.sum_return_shifted_sq):
+            column.extend([0.0] * extra)
+        self.ring_ts.extend([0] * (extra * self.capacity))
+        for column in (self.ring_price,self.ring_volume,self.ring_return):
+            column.extend([0.0] * (extra * self.capacity))
+        self.ring_has_return.extend([0] * (extra * self.capacity))
+        self._allocated = size
+
+    def slot(self,asset_id):
+        slot = self.asset_index.get(asset_id)
+        if slot is None:
+            slot = len(self.asset_ids)
+            if slot >= self._allocated:
+                self._grow(max(1,self._allocated * 2))
+            self.asset_index[asset_id] = slot
+            self.asset_ids.append(asset_id)
+            self.bar_start[slot] = -1
+            self.last_price[slot] = math.nan
+            self.last_volume_24h[slot] = math.nan
+        return slot
+
+    def _closed_bar(self,slot):
+        quantity = self.bar_quantity[slot]
+        return {
+            'id':self.asset_ids[slot],
+            'window_start':self.bar_start[slot],
+            'window_end':self.bar_start[slot] + self.tumbling_window_ms,
+            'open':self.bar_open[slot],
+            'high':self.bar_high[slot],
+            'low':self.bar_low[slot],
+            'close':self.bar_close[slot],
+            'vwap':self.bar_volume[slot] / quantity if quantity else self.bar_close[slot],
+            'volume':self.bar_volume[slot],
+            'ticks':self.bar_ticks[slot]
+        }
+
+    def _update_tumbling(self,slot,timestamp,price,volume):
+        window_start = timestamp - timestamp % self.tumbling_window_ms
+        closed_bar = None
+        if self.bar_start[slot] != window_start:
+            if self.bar_start[slot] >= 0 and self.bar_ticks[slot]:
+                closed_bar = self._closed_bar(slot)
+            self.bar_start[slot] = window_start
+            self.bar_open[slot] = self.bar_high[slot] = self.bar_low[slot] = price
+            self.bar_quantity[slot] = self.bar_volume[slot] = 0.0
+            self.bar_ticks[slot] = 0
+        if price > self.bar_high[slot]:
+            self.bar_high[slot] = price
+        if price < self.bar_low[slot]:
+            self.bar_low[slot] = price
+        self.bar_close[slot] = price
+        self.bar_quantity[slot] += volume / price if price > 0 else 0.0
+        self.bar_volume[slot] += volume
+        self.bar_ticks[slot] += 1
+        return closed_bar
+
+    def _evict_oldest(self,slot):
+        base = slot * self.capacity
+        count = self.ring_count[slot]
+        position = base + (self.ring_head[slot] - count) % self.capacity
+        price,volume = self.ring_price[position],self.ring_volume[position]
+        self.sum_quantity[slot] -= volume / price if price > 0 else 0.0
+        self.sum_volume[slot] -= volume
+        shifted = volume - self.volume_shift[slot]
+        self.sum_volume_shifted[slot] -= shifted
+        self.sum_volume_shifted_sq[slot] -= shifted * shifted
+        if self.ring_has_return[position]:
+            shifted = self.ring_return[position] - self.return_shift[slot]
+            self.sum_return_shifted[slot] -= shifted
+            self.sum_return_shifted_sq[slot] -= shifted * shifted
+            self.return_count[slot] -= 1
+        self.ring_count[slot] = count - 1
+
+    def _resync(self,slot):
+        # rebuilds the running sums from the ring around the current means; doing it once per window turnover keeps it
+        # amortized O(1), follows the mean as it moves and stops insert/evict rounding from accumulating
+        base = slot * self.capacity
+        count = self.ring_count[slot]
+        positions = [base + (self.ring_head[slot] - count + offset) % self.capacity for offset in range(count)]
+        volumes = [self.ring_volume[position] for position in positions]
+        returns = [self.ring_return[position] for position in positions if self.ring_has_return[position]]
+        self.sum_volume[slot] = math.fsum(volumes)
+        self.sum_quantity[slot] = math.fsum(self.ring_volume[position] / self.ring_price[position]
+                                            for position in positions if self.ring_price[position] > 0)
+        self.volume_shift[slot] = self.sum_volume[slot] / count if count else 0.0
+        self.sum_volume_shifted[slot] = math.fsum(volume - self.volume_shift[slot] for volume in volumes)
+        self.sum_volume_shifted_sq[slot] = math.fsum((volume - self.volume_shift[slot]) ** 2 for volume in volumes)
+        self.return_shift[slot] = math.fsum(returns) / len(returns) if returns else 0.0
+        self.sum_return_shifted[slot] = math.fsum(log_return - self.return_shift[slot] for log_return in returns)
+        self.sum_return_shifted_sq[slot] = math.fsum((log_return - self.return_shift[slot]) ** 2 for log_return in returns)
+        self.inserts_since_resync[slot] = 0
+
+    def _update_sliding(self,slot,timestamp,price,volume):
+        base = slot * self.capacity
+        horizon = timestamp - self.sliding_window_ms
+        # each tick is evicted once, so eviction is amortized O(1) per update
+        while self.ring_count[slot] and (self.ring_count[slot] >= self.capacity or
+                                         self.ring_ts[base + (self.ring_head[slot] - self.ring_count[slot]) % self.capacity] <= horizon):
+            self._evict_oldest(slot)
+
+        position = base + self.ring_head[slot]
+        previous_price = self.last_price[slot]
+        has_return = previous_price > 0 and price > 0
+        log_return = math.log(price / previous_price) if has_return else 0.0
+        self.ring_ts[position] = timestamp
+        self.ring_price[position] = price
+        self.ring_volume[position] = volume
+        self.ring_return[position] = log_return
+        self.ring_has_return[position] = has_return
+        self.ring_head[slot] = (self.ring_head[slot] + 1) % self.capacity
+        self.ring_count[slot] += 1
+
+        self.sum_quantity[slot] += volume / price if price > 0 else 0.0
+        self.sum_volume[slot] += volume
+        shifted = volume - self.volume_shift[slot]
+        self.sum_volume_shifted[slot] += shifted
+        self.sum_volume_shifted_sq[slot] += shifted * shifted
+        if has_return:
+            shifted = log_return - self.return_shift[slot]
+            self.sum_return_shifted[slot] += shifted
+            self.sum_return_shifted_sq[slot] += shifted * shifted
+            self.return_count[slot] += 1
+        self.last_price[slot] = price
+        self.inserts_since_resync[slot] += 1
+        if self.inserts_since_resync[slot] >= self.ring_count[slot]:
+            self._resync(slot)
+
+    def _tick_volume(self,slot,volume_24h):
+        # CoinCap only reports a rolling 24h USD total, so the volume traded since the previous tick is its increase;
+        # a decrease means more old volume rolled out than was traded and counts as no volume
+        if volume_24h != volume_24h:
+            return 0.0
+        previous = self.last_volume_24h[slot]
+        self.last_volume_24h[slot] = volume_24h
+        if previous != previous:
+            return 0.0
+        return max(volume_24h - previous,0.0)
+
+    def update(self,asset_id,timestamp,price,volume_24h):
+        slot = self.slot(asset_id)
+        volume = self._tick_volume(slot,volume_24h)
+        closed_bar = self._update_tumbling(slot,timestamp,price,volume)
+        self._update_sliding(slot,timestamp,price,volume)
+        return closed_bar
+
+    def update_records(self,records):
+        closed_bars = []
+        for record in records:
+            price = record.get('priceUsd')
+            if price is None:
+                continue
+            volume_24h = record.get('volumeUsd24Hr')
+            closed_bar = self.update(record['id'],int(record['Timestamp']),float(price),float(volume_24h) if volume_24h is not None else math.nan)
+            if closed_bar:
+                closed_bars.append(closed_bar)
+        return closed_bars
+
+    def update_batch(self,batch):
+        closed_bars = []
+        timestamp = batch.timestamp
+        volumes = batch.floats['volumeUsd24Hr'].tolist()
+        for asset_id,price,volume in zip(batch.ids.tolist(),batch.floats['priceUsd'].tolist(),volumes):
+            if price != price:
+                continue
+            closed_bar = self.update(asset_id,timestamp,price,volume)
+            if closed_bar:
+                closed_bars.append(closed_bar)
+        return closed_bars
+
+    def handle_kinesis_records(self,shard_id,records):
+        decoded = [decode_record(record['Data']) for record in records]
+        if decoded:
+            END_TO_END_LAG.observe(time.time() - max(int(record['Timestamp']) for record in decoded) / 1000)
+        return self.update_records(decoded)
+
+    @staticmethod
+    def _std(shifted_total,shifted_total_sq,count):
+        if count < 2:
+            return 0.0
+        variance = (shifted_total_sq - shifted_total * shifted_total / count) / (count - 1)
+        return math.sqrt(variance) if variance > 0 else 0.0
+
+    def sliding_stats(self,asset_id):
+        slot = self.asset_index.get(asset_id)
+        if slot is None or not self.ring_count[slot]:
+            return None
+        count = self.ring_count[slot]
+        sum_quantity = self.sum_quantity[slot]
+        volume_std = self._std(self.sum_volume_shifted[slot],self.sum_volume_shifted_sq[slot],count)
+        latest_volume = self.ring_volume[slot * self.capacity + (self.ring_head[slot] - 1) % self.capacity]
+        # the mean is taken relative to the shift, which keeps the z-score's numerator free of cancellation too
+        latest_deviation = latest_volume - self.volume_shift[slot] - self.sum_volume_shifted[slot] / count
+        return {
+            'id':asset_id,
+            'ticks':count,
+            'vwap':self.sum_volume[slot] / sum_quantity if sum_quantity > 0 else self.last_price[slot],
+            'volatility':self._std(self.sum_return_shifted[slot],self.sum_return_shifted_sq[slot],self.return_count[slot]),
+            'volume':self.sum_volume[slot],
+            'volume_zscore':latest_deviation / volume_std if volume_std else 0.0,
+            'last_price':self.last_price[slot]
+        }
+
+    def current_bar(self,asset_id):
+        slot = self.asset_index.get(asset_id)
+        if slot is None or not self.bar_ticks[slot]:
+            return None
+        return self._closed_bar(slot)
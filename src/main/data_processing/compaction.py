@@ -0,0 +1,284 @@
+import io
+import os
+import json
+import uuid
+import argparse
+import tempfile
+import numpy as np
+from datetime import datetime,timedelta,timezone
+from configparser import ConfigParser,ExtendedInterpolation
+from botocore.exceptions import ClientError
+
+from utils.base_component import BaseComponent
+from utils.aws_connector import AWSConnector
+from utils.metrics import get_registry
+from utils.record_aggregation import partition_key_hash
+from utils.glue_schema import compacted_table_input
+from data_processing.lake_reader import PARQUET_MAGIC,resolve_columns
+
+COMPACTED_FILES = get_registry().counter('lake_compacted_files_total','Parquet files written by the compaction job')
+COMPACTED_ROWS = get_registry().counter('lake_compacted_rows_total','Rows written by the compaction job')
+COMPACTED_SOURCES = get_registry().counter('lake_compacted_sources_total','Source objects merged by the compaction job')
+HOUR_MILLIS = 3600 * 1000
+
+
+def empty_manifest():
+    return {'version':0,'updated_at':None,'files':[],'sources':[],'stale':[]}
+
+
+def partition_path(hour,asset_bucket):
+    hour_start = datetime.fromtimestamp(hour * HOUR_MILLIS / 1000,timezone.utc)
+    return f'date={hour_start:%Y-%m-%d}/hour={hour_start:%H}/asset_bucket={asset_bucket}'
+
+
+class LakeCompactor(BaseComponent):
+    def __init__(self,config,section_name,aws_section,aws_connector=None):
+        super().__init__(config,section_name)
+        self.aws_section = self.read_config(config,aws_section)
+        self.aws_connector = aws_connector or AWSConnector(self.logger,self.aws_section)
+        self._bucket_cache = {}
+
+    def initialize(self):
+        self.source_bucket = self.config.get('source_bucket',self.aws_section['firehose_s3_bucket'])
+        self.source_prefix = self.config.get('source_prefix',self.aws_section['firehose_s3_prefix']).strip('/')
+        self.target_bucket = self.config.get('target_bucket',self.source_bucket)
+        self.target_prefix = self.config.get('target_prefix','crypto_compacted').strip('/')
+        self.manifest_key = self.config.get('manifest_key',f'{self.target_prefix}/_manifest.json')
+        self.asset_buckets = int(self.config.get('asset_buckets',16))
+        self.row_group_rows = int(self.config.get('row_group_rows',262144))
+        self.row_groups_per_file = int(self.config.get('row_groups_per_file',4))
+        self.compression = self.config.get('compression','zstd')
+        self.compression_level = int(self.config.get('compression_level',3))
+        self.timestamp_column = self.config.get('timestamp_column','Timestamp')
+        self.asset_column = self.config.get('asset_column','id')
+        self.lookback_days = int(self.config.get('lookback_days',1))
+        self.delete_sources = self.config.get('delete_sources','false').lower() == 'true'
+        self.stale_retention_seconds = float(self.config.get('stale_retention_seconds',3600))
+        self.source_reader = self.aws_connector.get_lake_reader({'bucket':self.source_bucket,'prefix':self.source_prefix})
+        self.glue_database = self.config.get('glue_database',self.aws_section.get('glue_kinesis_database'))
+        self.glue_table = self.config.get('glue_table')
+        self.glue_projection_start = self.config.get('glue_projection_start','2024-01-01')
+
+    def register_table(self):
+        # the compacted layout gets its own projected table so queries prune on date, hour and asset bucket
+        table_input = compacted_table_input(self.glue_table,self.target_bucket,self.target_prefix,self.asset_buckets,self.glue_projection_start)
+        return self.aws_connector.create_glue_table(self.aws_connector.get_glue_client(),self.glue_database,self.glue_table,table_input)
+
+    def load_manifest(self):
+        try:
+            response = self.aws_connector.get_s3_client().get_object(Bucket=self.target_bucket,Key=self.manifest_key)
+        except ClientError as e:
+            # only a missing manifest starts a new one; any other error aborts rather than overwrite the live manifest
+            if e.response.get('Error',{}).get('Code') in ('NoSuchKey','404'):
+                return empty_manifest()
+            raise
+        return json.loads(response['Body'].read())
+
+    def save_manifest(self,manifest):
+        manifest['version'] += 1
+        manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+        # a single put replaces the manifest, so readers see either the old file set or the new one
+        if self.aws_connector.write_to_s3(self.target_bucket,None,self.manifest_key,json.dumps(manifest).encode('utf-8')) is None:
+            raise IOError(f'Unable to write s3://{self.target_bucket}/{self.manifest_key}')
+
+    def read_object(self,bucket,key):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        data = self.aws_connector.read_from_s3(bucket,None,key,decode=False)
+        if data is None:
+            raise IOError(f'Unable to read s3://{bucket}/{key}')
+        if data[-len(PARQUET_MAGIC):] == PARQUET_MAGIC:
+            table = pq.read_table(io.BytesIO(data))
+        else:
+            # objects delivered without format conversion hold one JSON record per line
+            table = pa.Table.from_pylist([json.loads(line) for line in data.splitlines() if line.strip()])
+        # Firehose Parquet and JSON objects spell the key columns differently, so both are merged under the configured names
+        renames = {actual:name for name,actual in resolve_columns([self.timestamp_column,self.asset_column],table.column_names).items()}
+        return table.rename_columns([renames.get(name,name) for name in table.column_names])
+
+    def _asset_bucket(self,asset_id):
+        asset_bucket = self._bucket_cache.get(asset_id)
+        if asset_bucket is None:
+            # the same hash Kinesis routes partition keys with, so an asset always lands in one bucket
+            asset_bucket = self._bucket_cache[asset_id] = partition_key_hash(str(asset_id)) % self.asset_buckets
+        return asset_bucket
+
+    def partition_table(self,table):
+        # sorted by asset and timestamp first; the stable partition sort keeps that order inside each partition
+        table = table.sort_by([(self.asset_column,'ascending'),(self.timestamp_column,'ascending')])
+        hours = table[self.timestamp_column].to_numpy().astype(np.int64) // HOUR_MILLIS
+        asset_buckets = np.fromiter((self._asset_bucket(asset_id) for asset_id in table[self.asset_column].to_pylist()),
+                                    dtype=np.int64,count=table.num_rows)
+        keys = hours * self.asset_buckets + asset_buckets
+        order = np.argsort(keys,kind='stable')
+        keys = keys[order]
+        table = table.take(order)
+        boundaries = [0] + (np.flatnonzero(np.diff(keys)) + 1).tolist() + [table.num_rows]
+        return {partition_path(int(keys[start] // self.asset_buckets),int(keys[start] % self.asset_buckets)):
+                table.slice(start,end - start) for start,end in zip(boundaries,boundaries[1:]) if end > start}
+
+    def write_partition(self,partition,table,run_id):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        rows_per_file = self.row_group_rows * self.row_groups_per_file
+        entries = []
+        for index,offset in enumerate(range(0,table.num_rows,rows_per_file)):
+            chunk = table.slice(offset,rows_per_file)
+            buffer = io.BytesIO()
+            # file boundaries fall on row group boundaries, so every file holds whole row groups
+            with pq.ParquetWriter(buffer,chunk.schema,compression=self.compression,compression_level=self.compression_level) as writer:
+                writer.write_table(chunk,row_group_size=self.row_group_rows)
+            data = buffer.getvalue()
+            key = f'{self.target_prefix}/{partition}/part-{run_id}-{index:05d}.{self.compression}.parquet'
+            if self.aws_connector.write_to_s3(self.target_bucket,None,key,data) is None:
+                raise IOError(f'Unable to write s3://{self.target_bucket}/{key}')
+            timestamps = pc.min_max(chunk[self.timestamp_column]).as_py()
+            entries.append({
+                'key':key,
+                'partition':partition,
+                'rows':chunk.num_rows,
+                'bytes':len(data),
+                'row_groups':-(-chunk.num_rows // self.row_group_rows),
+                'min_timestamp':timestamps['min'],
+                'max_timestamp':timestamps['max'],
+                'min_asset':chunk[self.asset_column][0].as_py(),
+                'max_asset':chunk[self.asset_column][chunk.num_rows - 1].as_py()
+            })
+            COMPACTED_FILES.inc()
+            COMPACTED_ROWS.inc(chunk.num_rows)
+        return entries
+
+    def expire_stale(self,manifest):
+        s3_client = self.aws_connector.get_s3_client()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_retention_seconds)
+        retained = []
+        for entry in manifest['stale']:
+            # retired files stay readable for a while so scans that started on the previous manifest can finish
+            if datetime.fromisoformat(entry['retired_at']) < cutoff:
+                s3_client.delete_object(Bucket=self.target_bucket,Key=entry['key'])
+            else:
+                retained.append(entry)
+        manifest['stale'] = retained
+
+    def spill_sources(self,sources,spill_dir):
+        import pyarrow.parquet as pq
+
+        # each source is split by partition onto local disk, so memory holds one object now and one partition later
+        spilled = {}
+        rows = 0
+        for index,key in enumerate(sources):
+            table = self.read_object(self.source_bucket,key)
+            rows += table.num_rows
+            for partition,part in self.partition_table(table).items():
+                path = os.path.join(spill_dir,f'{index:06d}-{partition.replace("/","-")}.parquet')
+                pq.write_table(part,path,compression='none')
+                spilled.setdefault(partition,[]).append(path)
+        return spilled,rows
+
+    def compact(self,start,end):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        manifest = self.load_manifest()
+        # a source dated before the window's first day is never listed again, so the manifest stops tracking it
+        first_prefix = self.source_reader.partition_prefixes(start,end)[0]
+        compacted_sources = {key for key in manifest['sources'] if key >= first_prefix}
+        sources = [key for key,_ in self.source_reader.list_objects(start,end) if key not in compacted_sources]
+        if not sources:
+            self.logger.info(f'No new objects under s3://{self.source_bucket}/{self.source_prefix} to compact')
+            self.expire_stale(manifest)
+            return manifest
+        run_id = f'{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+        written = []
+        with tempfile.TemporaryDirectory(prefix='compaction-') as spill_dir:
+            spilled,incoming_rows = self.spill_sources(sources,spill_dir)
+            # partitions that already have compacted files are rewritten together with the new rows
+            replaced = [entry for entry in manifest['files'] if entry['partition'] in spilled]
+            for partition in sorted(spilled):
+                tables = [pq.read_table(path) for path in spilled[partition]] + \
+                         [self.read_object(self.target_bucket,entry['key']) for entry in replaced if entry['partition'] == partition]
+                merged = pa.concat_tables(tables,promote_options='default') if len(tables) > 1 else tables[0]
+                written.extend(self.write_partition(partition,self.partition_table(merged)[partition],run_id))
+
+        retired_at = datetime.now(timezone.utc).isoformat()
+        replaced_keys = {entry['key'] for entry in replaced}
+        manifest['files'] = [entry for entry in manifest['files'] if entry['key'] not in replaced_keys] + written
+        manifest['stale'].extend({'key':key,'retired_at':retired_at} for key in sorted(replaced_keys))
+        manifest['sources'] = sorted(compacted_sources.union(sources))
+        self.expire_stale(manifest)
+        self.save_manifest(manifest)
+        COMPACTED_SOURCES.inc(len(sources))
+        if self.delete_sources:
+            s3_client = self.aws_connector.get_s3_client()
+            for key in sources:
+                s3_client.delete_object(Bucket=self.source_bucket,Key=key)
+            manifest['sources'] = []
+            self.save_manifest(manifest)
+        self.logger.info(f'Compacted {len(sources)} objects ({incoming_rows} rows) into {len(written)} files '
+                         f'across {len(spilled)} partitions, retiring {len(replaced)} files')
+        return manifest
+
+    def run(self,start=None,end=None):
+        try:
+            self.initialize()
+            end = end or datetime.now(timezone.utc)
+            start = start or end - timedelta(days=self.lookback_days)
+            if self.glue_table:
+                self.register_table()
+            return self.compact(start,end)
+        except Exception as e:
+            self.logger.error(e,exc_info=True)
+            return None
+
+
+def seed_local_sources(compactor,ticks):
+    from benchmarks.fixtures import load_assets_payload,price_ticks
+
+    # Firehose-style raw objects, one JSON record per line, under the arrival-date prefix
+    snapshots = price_ticks(load_assets_payload(),ticks)
+    for tick,snapshot in enumerate(snapshots):
+        arrival = datetime.fromtimestamp(snapshot['timestamp'] / 1000,timezone.utc)
+        body = '\n'.join(json.dumps(record | {'Timestamp':snapshot['timestamp']}) for record in snapshot['data'])
+        compactor.aws_connector.write_to_s3(compactor.source_bucket,compactor.source_prefix,
+                                            f'{arrival:%Y/%m/%d}/seed-{tick:05d}',body.encode('utf-8'))
+    return (datetime.fromtimestamp(snapshots[0]['timestamp'] / 1000,timezone.utc),
+            datetime.fromtimestamp(snapshots[-1]['timestamp'] / 1000 + 1,timezone.utc))
+
+
+def parse_time(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact raw Firehose objects into partitioned, sorted zstd Parquet files')
+    parser.add_argument('--config',default='config.ini')
+    parser.add_argument('--start',type=parse_time,help='ISO start time, defaults to lookback_days before --end')
+    parser.add_argument('--end',type=parse_time,help='ISO end time, defaults to now')
+    parser.add_argument('--local',action='store_true',help='run against the in-process local AWS backend')
+    parser.add_argument('--seed-ticks',type=int,default=0,help='with --local, write this many synthetic price ticks first')
+    args = parser.parse_args()
+
+    aws_connector = None
+    if args.local:
+        config = ConfigParser(interpolation=ExtendedInterpolation())
+        config.read(args.config)
+        aws_connector = AWSConnector(BaseComponent.logger,dict(config['aws']) | {'backend':'local','resource_manifest':''})
+    compactor = LakeCompactor(args.config,'compaction','aws',aws_connector=aws_connector)
+    start,end = args.start,args.end
+    if args.local and args.seed_ticks:
+        compactor.initialize()
+        seeded_start,seeded_end = seed_local_sources(compactor,args.seed_ticks)
+        # seeded ticks carry fixture timestamps, so cover them rather than the last day
+        start,end = start or seeded_start,end or seeded_end
+    manifest = compactor.run(start,end)
+    if manifest is not None:
+        print(f'manifest version {manifest["version"]}: {len(manifest["files"])} files, '
+              f'{sum(entry["rows"] for entry in manifest["files"])} rows')
+
+
+# run from src/main as python -m data_processing.compaction
+if __name__=="__main__":
+    main()
@@ -0,0 +1,213 @@
+from utils.base_component import BaseComponent
+from utils.aws_connector import AWSConnector
+from utils.record_aggregation import deaggregate_records
+from utils.metrics import get_registry,get_tracer,configure_metrics
+from data_processing.price_index import PriceIndex,PriceIndexServer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime,timezone
+import sqlite3
+import threading
+import time
+
+RECORDS_READ = get_registry().counter('kinesis_records_read_total','Records read per shard after de-aggregation',('stream','shard'))
+READ_THROTTLES = get_registry().counter('kinesis_read_throttles_total','get_records calls rejected for throughput',('stream','shard'))
+MILLIS_BEHIND = get_registry().gauge('kinesis_millis_behind_latest','How far each shard consumer trails the stream tip',('stream','shard'))
+ARRIVAL_LAG = get_registry().histogram('kinesis_arrival_lag_seconds','Time from Kinesis arrival to consumer handoff',('stream',))
+
+
+class CheckpointStore():
+    def __init__(self,db_path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path,check_same_thread=False)
+        with self._connection:
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS checkpoints (
+                                        stream TEXT NOT NULL,
+                                        shard_id TEXT NOT NULL,
+                                        sequence_number TEXT,
+                                        closed INTEGER NOT NULL DEFAULT 0,
+                                        updated_at REAL NOT NULL,
+                                        PRIMARY KEY (stream,shard_id))''')
+
+    def get(self,stream,shard_id):
+        with self._lock:
+            row = self._connection.execute('SELECT sequence_number,closed FROM checkpoints WHERE stream=? AND shard_id=?',
+                                           (stream,shard_id)).fetchone()
+        return (row[0],bool(row[1])) if row else (None,False)
+
+    def save(self,stream,shard_id,sequence_number,closed=False):
+        with self._lock, self._connection:
+            self._connection.execute('''INSERT INTO checkpoints (stream,shard_id,sequence_number,closed,updated_at) VALUES (?,?,?,?,?)
+                                        ON CONFLICT(stream,shard_id) DO UPDATE SET
+                                        sequence_number=COALESCE(excluded.sequence_number,sequence_number),
+                                        closed=excluded.closed,updated_at=excluded.updated_at''',
+                                     (stream,shard_id,sequence_number,int(closed),time.time()))
+
+    def closed_shards(self,stream):
+        with self._lock:
+            rows = self._connection.execute('SELECT shard_id FROM checkpoints WHERE stream=? AND closed=1',(stream,)).fetchall()
+        return {row[0] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class BaseConsumer(BaseComponent):
+    def __init__(self,config,section_name,aws_section,aws_connector=None,record_handler=None):
+        super().__init__(config,section_name)
+        aws_section = self.read_config(config,aws_section)
+        self.aws_section = aws_section
+        self.aws_connector = aws_connector or AWSConnector(self.logger,aws_section)
+        self.record_handler = record_handler
+        self.price_index = None
+        self.price_index_server = None
+        # set by a supervised worker to the shards it holds leases on; None consumes every shard
+        self.owned_shards = None
+        self.metrics_section = self.read_config(config,'metrics')
+        self.metrics_exporter = None
+        self.tracer = get_tracer()
+        self.stop_event = threading.Event()
+        self._active_shards = set()
+        self._active_lock = threading.Lock()
+
+    def initialize(self):
+        self.stream = self.config.get('kinesis_stream',self.aws_section['kinesis_stream'])
+        self.iterator_type = self.config.get('iterator_type',self.aws_section.get('iterator_type','LATEST')).strip()
+        self.poll_interval_seconds = float(self.config.get('poll_interval_seconds',1))
+        self.max_records_per_call = int(self.config.get('max_records_per_call',10000))
+        self.shard_refresh_seconds = float(self.config.get('shard_refresh_seconds',30))
+        self.max_workers = int(self.config.get('max_workers',int(self.aws_section.get('shard_count',1)) * 2))
+        self.checkpoint_store = CheckpointStore(self.config.get('checkpoint_db','checkpoints.db'))
+        self.kinesis_client = self.aws_connector.get_kinesis_client()
+        self.metrics_exporter = configure_metrics(self.metrics_section)
+        if self.config.get('price_index_enabled','false').lower() == 'true':
+            self.price_index = PriceIndex(ring_capacity=int(self.config.get('price_index_ring_capacity',256)),
+                                          initial_assets=int(self.config.get('price_index_initial_assets',2048)))
+            self.price_index_server = PriceIndexServer(self.price_index,self.config.get('price_index_host','127.0.0.1'),
+                                                       int(self.config.get('price_index_port',8765)),
+                                                       self.config.get('price_index_socket') or None).start()
+            self.logger.info('Latest-price index API started')
+        if self.record_handler is None:
+            self.record_handler = self.price_index.handle_kinesis_records if self.price_index else self._log_records
+
+    def _log_records(self,shard_id,records):
+        self.logger.info(f'Read {len(records)} records from {self.stream}/{shard_id}')
+
+    def list_shards(self):
+        shards = []
+        response = self.kinesis_client.list_shards(StreamName=self.stream)
+        while True:
+            shards.extend(response['Shards'])
+            next_token = response.get('NextToken')
+            if not next_token:
+                return shards
+            # StreamName must not be sent together with NextToken
+            response = self.kinesis_client.list_shards(NextToken=next_token)
+
+    def _get_shard_iterator(self,shard_id,default_iterator_type):
+        sequence_number,_ = self.checkpoint_store.get(self.stream,shard_id)
+        if sequence_number:
+            response = self.kinesis_client.get_shard_iterator(StreamName=self.stream,ShardId=shard_id,
+                                                              ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                                                              StartingSequenceNumber=sequence_number)
+        else:
+            response = self.kinesis_client.get_shard_iterator(StreamName=self.stream,ShardId=shard_id,
+                                                              ShardIteratorType=default_iterator_type)
+        return response['ShardIterator']
+
+    def consume_shard(self,shard_id,default_iterator_type):
+        exceptions = self.kinesis_client.exceptions
+        try:
+            shard_iterator = self._get_shard_iterator(shard_id,default_iterator_type)
+            backoff = self.poll_interval_seconds
+            while shard_iterator and not self.stop_event.is_set() and self._owns(shard_id):
+                try:
+                    response = self.kinesis_client.get_records(ShardIterator=shard_iterator,Limit=self.max_records_per_call)
+                except exceptions.ProvisionedThroughputExceededException:
+                    READ_THROTTLES.inc(stream=self.stream,shard=shard_id)
+                    backoff = min(backoff * 2,30)
+                    self.logger.info(f'Read throttled on {self.stream}/{shard_id}. Backing off {backoff}s')
+                    self.stop_event.wait(backoff)
+                    continue
+                except exceptions.ExpiredIteratorException:
+                    shard_iterator = self._get_shard_iterator(shard_id,default_iterator_type)
+                    continue
+                backoff = self.poll_interval_seconds
+                records = response['Records']
+                MILLIS_BEHIND.set(response.get('MillisBehindLatest',0),stream=self.stream,shard=shard_id)
+                if records:
+                    arrival = records[-1].get('ApproximateArrivalTimestamp')
+                    if arrival:
+                        ARRIVAL_LAG.observe((datetime.now(timezone.utc) - arrival).total_seconds(),stream=self.stream)
+                    with self.tracer.span('consume_batch',shard=shard_id,records=len(records)):
+                        user_records = deaggregate_records(records)
+                        self.record_handler(shard_id,user_records)
+                    RECORDS_READ.inc(len(user_records),stream=self.stream,shard=shard_id)
+                    self.checkpoint_store.save(self.stream,shard_id,records[-1]['SequenceNumber'])
+                shard_iterator = response.get('NextShardIterator')
+                # a shard that is caught up is polled at the configured interval; GetRecords allows 5 calls/sec/shard
+                if not records or not response.get('MillisBehindLatest'):
+                    self.stop_event.wait(self.poll_interval_seconds)
+            if not shard_iterator:
+                self.checkpoint_store.save(self.stream,shard_id,None,closed=True)
+                self.logger.info(f'Shard {self.stream}/{shard_id} is closed and fully consumed')
+        except Exception as e:
+            self.logger.error(f'Consumer for {self.stream}/{shard_id} failed: {e}',exc_info=True)
+        finally:
+            with self._active_lock:
+                self._active_shards.discard(shard_id)
+
+    def _owns(self,shard_id):
+        owned_shards = self.owned_shards
+        return owned_shards is None or shard_id in owned_shards
+
+    def _ready_shards(self,shards):
+        closed = self.checkpoint_store.closed_shards(self.stream)
+        shard_ids = {shard['ShardId'] for shard in shards}
+        ready = []
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in closed or shard_id in self._active_shards:
+                continue
+            # children of a resharded shard start only after their parents are drained, preserving per-key order
+            parents = [shard.get(key) for key in ('ParentShardId','AdjacentParentShardId') if shard.get(key)]
+            pending_parents = [parent for parent in parents if parent in shard_ids and parent not in closed]
+            if pending_parents:
+                continue
+            # a child holds every record written since the split, whether its parents were drained here, by another
+            # worker or aged out of retention; a checkpoint, if any, still takes precedence in _get_shard_iterator
+            iterator_type = 'TRIM_HORIZON' if parents else self.iterator_type
+            ready.append((shard_id,iterator_type))
+        return ready
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        try:
+            self.initialize()
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    while not self.stop_event.is_set():
+                        for shard_id,iterator_type in self._ready_shards(self.list_shards()):
+                            if not self._owns(shard_id):
+                                continue
+                            with self._active_lock:
+                                self._active_shards.add(shard_id)
+                            self.logger.info(f'Starting consumer for {self.stream}/{shard_id} from {iterator_type}')
+                            executor.submit(self.consume_shard,shard_id,iterator_type)
+                        self.stop_event.wait(self.shard_refresh_seconds)
+                finally:
+                    # workers only exit once the stop event is set, so set it before the executor joins them
+                    self.stop()
+            self.checkpoint_store.close()
+            self.logger.info('Kinesis consumer stopped')
+        except KeyboardInterrupt:
+            self.logger.info('Kinesis consumer interrupted')
+        except Exception as e:
+            self.logger.error(e,exc_info=True)
+        finally:
+            if self.price_index_server:
+                self.price_index_server.stop()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop()
@@ -0,0 +1,292 @@
+import io
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime,timedelta,timezone
+from utils.metrics import get_registry
+
+RANGE_REQUESTS = get_registry().counter('lake_range_requests_total','Ranged GETs issued by the lake reader')
+RANGE_BYTES = get_registry().counter('lake_range_bytes_total','Bytes fetched by ranged GETs')
+ROW_GROUPS = get_registry().counter('lake_row_groups_total','Parquet row groups seen by the lake reader',('outcome',))
+PARQUET_MAGIC = b'PAR1'
+
+
+class S3RangeFile(io.RawIOBase):
+    # seekable read-only view of an S3 object; every read is a ranged GET, with one cached block for small reads
+    def __init__(self,s3_client,bucket,key,size=None,min_range_bytes=65536):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket,Key=key)['ContentLength']
+        self.min_range_bytes = min_range_bytes
+        self.position = 0
+        self.block_start = 0
+        self.block = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self,offset,whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        self.position = min(max(self.position,0),self.size)
+        return self.position
+
+    def _fetch(self,start,end):
+        response = self.s3_client.get_object(Bucket=self.bucket,Key=self.key,Range=f'bytes={start}-{end - 1}')
+        data = response['Body'].read()
+        RANGE_REQUESTS.inc()
+        RANGE_BYTES.inc(len(data))
+        return data
+
+    def read(self,size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size,self.size)
+        if end <= self.position:
+            return b''
+        block_end = self.block_start + len(self.block)
+        if not (self.block_start <= self.position and end <= block_end):
+            if end - self.position >= self.min_range_bytes:
+                data = self._fetch(self.position,end)
+                self.position = end
+                return data
+            # small reads (footer, page headers) pull a whole block so neighbours come from memory
+            self.block_start = self.position
+            self.block = self._fetch(self.position,min(self.position + self.min_range_bytes,self.size))
+        data = self.block[self.position - self.block_start:end - self.block_start]
+        self.position = end
+        return data
+
+    def readinto(self,buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value,datetime):
+        return value if value is None or value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromtimestamp(value / 1000,timezone.utc)
+
+
+def _to_millis(value):
+    return None if value is None else int(_to_datetime(value).timestamp() * 1000)
+
+
+OPERATORS = {
+    '=':lambda low,high,value:low <= value <= high,
+    '==':lambda low,high,value:low <= value <= high,
+    '!=':lambda low,high,value:not (low == high == value),
+    '<':lambda low,high,value:low < value,
+    '<=':lambda low,high,value:low <= value,
+    '>':lambda low,high,value:high > value,
+    '>=':lambda low,high,value:high >= value,
+    'in':lambda low,high,values:any(low <= value <= high for value in values)
+}
+
+
+def resolve_columns(names,schema_names):
+    # Glue lowercases column names, so Firehose Parquet holds timestamp where JSON records and the config say Timestamp
+    lookup = {name.lower():name for name in schema_names}
+    return {name:name if name in schema_names else lookup.get(name.lower(),name) for name in names}
+
+
+def row_group_may_match(row_group,column_indices,filters):
+    # min/max statistics can only rule a row group out; missing statistics always keep it
+    for column,operator,value in filters:
+        index = column_indices.get(column)
+        if index is None:
+            continue
+        statistics = row_group.column(index).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        try:
+            if not OPERATORS[operator](statistics.min,statistics.max,value):
+                return False
+        except TypeError:
+            continue
+    return True
+
+
+def filter_expression(filters):
+    import pyarrow.compute as pc
+
+    expression = None
+    for column,operator,value in filters:
+        field = pc.field(column)
+        if operator in ('=','=='):
+            condition = field == value
+        elif operator == '!=':
+            condition = field != value
+        elif operator == '<':
+            condition = field < value
+        elif operator == '<=':
+            condition = field <= value
+        elif operator == '>':
+            condition = field > value
+        elif operator == '>=':
+            condition = field >= value
+        elif operator == 'in':
+            condition = field.isin(list(value))
+        else:
+            raise ValueError(f'Unsupported filter operator {operator}')
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+class LakeReader():
+    def __init__(self,logger,s3_client,bucket,prefix,list_workers=8,read_workers=4,batch_size=65536,min_range_bytes=65536,
+                 partition_slack_seconds=900,timestamp_column='Timestamp',manifest_key=None):
+        self.logger = logger
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.list_workers = list_workers
+        self.read_workers = read_workers
+        self.batch_size = batch_size
+        self.min_range_bytes = min_range_bytes
+        # Firehose partitions by arrival time, which trails the record timestamp
+        self.partition_slack = timedelta(seconds=partition_slack_seconds)
+        self.timestamp_column = timestamp_column
+        self.manifest_key = manifest_key
+
+    def partition_prefixes(self,start=None,end=None):
+        if start is None or end is None:
+            return [f'{self.prefix}/']
+        day = (_to_datetime(start) - self.partition_slack).date()
+        last_day = (_to_datetime(end) + self.partition_slack).date()
+        prefixes = []
+        while day <= last_day:
+            prefixes.append(f'{self.prefix}/{day:%Y/%m/%d}/')
+            day += timedelta(days=1)
+        return prefixes
+
+    def _list_prefix(self,prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        return [(item['Key'],item['Size']) for page in paginator.paginate(Bucket=self.bucket,Prefix=prefix)
+                for item in page.get('Contents',[]) if item['Size']]
+
+    def list_manifest_objects(self,start=None,end=None):
+        # a compacted layout is listed from its manifest, so files retired by a later compaction are never read
+        manifest = json.loads(self.s3_client.get_object(Bucket=self.bucket,Key=self.manifest_key)['Body'].read())
+        start,end = _to_millis(start),_to_millis(end)
+        objects = [(entry['key'],entry['bytes']) for entry in manifest['files']
+                   if (start is None or entry['max_timestamp'] >= start) and (end is None or entry['min_timestamp'] < end)]
+        self.logger.info(f'Lake manifest s3://{self.bucket}/{self.manifest_key} v{manifest["version"]}: '
+                         f'{len(objects)} of {len(manifest["files"])} files in range')
+        return sorted(objects)
+
+    def list_objects(self,start=None,end=None):
+        if self.manifest_key:
+            return self.list_manifest_objects(start,end)
+        prefixes = self.partition_prefixes(start,end)
+        with ThreadPoolExecutor(max_workers=max(1,min(self.list_workers,len(prefixes)))) as executor:
+            objects = [item for listed in executor.map(self._list_prefix,prefixes) for item in listed]
+        self.logger.info(f'Lake listing s3://{self.bucket}/{self.prefix}: {len(prefixes)} partitions, {len(objects)} objects')
+        return sorted(objects)
+
+    def count_objects(self,start=None,end=None):
+        return len(self.list_objects(start,end))
+
+    def _open(self,key,size):
+        return S3RangeFile(self.s3_client,self.bucket,key,size,self.min_range_bytes)
+
+    def _is_parquet(self,source):
+        source.seek(-len(PARQUET_MAGIC),io.SEEK_END)
+        magic = source.read(len(PARQUET_MAGIC))
+        source.seek(0)
+        return magic == PARQUET_MAGIC
+
+    def _scan_parquet(self,source,columns,filters):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(source)
+        metadata = parquet_file.metadata
+        schema = parquet_file.schema_arrow
+        resolved = resolve_columns(list(columns or []) + [column for column,_,_ in filters],schema.names)
+        filters = [(resolved[column],operator,value) for column,operator,value in filters]
+        expression = filter_expression(filters) if filters else None
+        column_indices = {metadata.schema.column(index).path:index for index in range(metadata.num_columns)}
+        row_groups = []
+        for index in range(metadata.num_row_groups):
+            if row_group_may_match(metadata.row_group(index),column_indices,filters):
+                row_groups.append(index)
+        ROW_GROUPS.inc(len(row_groups),outcome='read')
+        ROW_GROUPS.inc(metadata.num_row_groups - len(row_groups),outcome='pruned')
+        if not row_groups:
+            return
+        # filter columns are read even when not projected, then dropped after filtering
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys([resolved[column] for column in columns if resolved[column] in schema.names] +
+                                              [column for column,_,_ in filters if column in schema.names]))
+        for batch in parquet_file.iter_batches(batch_size=self.batch_size,row_groups=row_groups,columns=read_columns):
+            yield from self._finish_batch(batch,columns,resolved,expression)
+
+    def _scan_json_lines(self,source,columns,filters):
+        import pyarrow as pa
+
+        rows = [json.loads(line) for line in source.read().splitlines() if line.strip()]
+        for offset in range(0,len(rows),self.batch_size):
+            batch = pa.RecordBatch.from_pylist(rows[offset:offset + self.batch_size])
+            resolved = resolve_columns(list(columns or []) + [column for column,_,_ in filters],batch.schema.names)
+            expression = filter_expression([(resolved[column],operator,value) for column,operator,value in filters]) if filters else None
+            yield from self._finish_batch(batch,columns,resolved,expression)
+
+    def _finish_batch(self,batch,columns,resolved,expression):
+        import pyarrow as pa
+
+        if expression is not None:
+            table = pa.Table.from_batches([batch]).filter(expression)
+            batches = table.to_batches()
+        else:
+            batches = [batch]
+        for batch in batches:
+            if columns is not None:
+                # projected columns come back under the requested names, whatever case the object stores them in
+                present = [column for column in columns if resolved[column] in batch.schema.names]
+                batch = pa.RecordBatch.from_arrays([batch.column(resolved[column]) for column in present],names=present)
+            if batch.num_rows:
+                yield batch
+
+    def _scan_object(self,key,size,columns,filters):
+        source = self._open(key,size)
+        if self._is_parquet(source):
+            return list(self._scan_parquet(source,columns,filters))
+        # objects delivered without format conversion hold one JSON record per line
+        return list(self._scan_json_lines(source,columns,filters))
+
+    def scan(self,start=None,end=None,columns=None,filters=None):
+        filters = list(filters or [])
+        if start is not None:
+            filters.append((self.timestamp_column,'>=',_to_millis(start)))
+        if end is not None:
+            filters.append((self.timestamp_column,'<',_to_millis(end)))
+        objects = self.list_objects(start,end)
+        # objects are fetched a few ahead of the consumer, and yielded in key order
+        with ThreadPoolExecutor(max_workers=max(1,self.read_workers)) as executor:
+            pending = deque()
+            for key,size in objects:
+                pending.append(executor.submit(self._scan_object,key,size,columns,filters))
+                if len(pending) > self.read_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def read_table(self,start=None,end=None,columns=None,filters=None):
+        import pyarrow as pa
+
+        batches = list(self.scan(start,end,columns,filters))
+        return pa.Table.from_batches(batches) if batches else None
@@ -0,0 +1,247 @@
+import os
+import json
+import math
+import time
+import threading
+import numpy as np
+from array import array
+from bisect import bisect_left
+from urllib.parse import urlsplit,parse_qs
+from socketserver import ThreadingMixIn,UnixStreamServer
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from utils.serializers import decode_record,ASSET_STRING_FIELDS,ASSET_FLOAT_FIELDS
+from utils.metrics import get_registry
+
+INDEXED_ASSETS = get_registry().gauge('price_index_assets','Assets held by the latest-price index')
+INDEX_UPDATES = get_registry().counter('price_index_updates_total','Records applied to the latest-price index')
+QUERY_LATENCY = get_registry().histogram('price_index_query_seconds','Latest-price index query latency',('endpoint',),
+                                         buckets=(0.00005,0.0001,0.00025,0.0005,0.001,0.0025,0.01,0.1))
+MISSING_RANK = -1
+TEXT_FIELDS = tuple(name for name in ASSET_STRING_FIELDS if name != 'id')
+
+
+class PriceIndex():
+    def __init__(self,ring_capacity=256,initial_assets=256):
+        self.capacity = ring_capacity
+        self.asset_index = {}
+        self.asset_ids = []
+        self._allocated = 0
+        self.lock = threading.Lock()
+
+        # latest snapshot, one slot per asset
+        self.timestamp = array('q')
+        self.rank = array('q')
+        self.floats = {name:array('d') for name in ASSET_FLOAT_FIELDS}
+        self.texts = {name:[] for name in TEXT_FIELDS}
+
+        # recent ticks: one ring buffer of `capacity` entries per asset, oldest entry at head - count
+        self.ring_head = array('q')
+        self.ring_count = array('q')
+        self.ring_ts = array('q')
+        self.ring_price = array('d')
+        self.ring_volume = array('d')
+        self._grow(initial_assets)
+
+    def _grow(self,size):
+        extra = size - self._allocated
+        for column in (self.timestamp,self.ring_head,self.ring_count):
+            column.extend([0] * extra)
+        self.rank.extend([MISSING_RANK] * extra)
+        for column in self.floats.values():
+            column.extend([math.nan] * extra)
+        for column in self.texts.values():
+            column.extend([None] * extra)
+        self.ring_ts.extend([0] * (extra * self.capacity))
+        for column in (self.ring_price,self.ring_volume):
+            column.extend([0.0] * (extra * self.capacity))
+        self._allocated = size
+
+    def _slot(self,asset_id):
+        slot = self.asset_index.get(asset_id)
+        if slot is None:
+            slot = len(self.asset_ids)
+            if slot >= self._allocated:
+                self._grow(max(1,self._allocated * 2))
+            self.asset_index[asset_id] = slot
+            self.asset_ids.append(asset_id)
+            self.timestamp[slot] = -1
+        return slot
+
+    def _append_tick(self,slot,timestamp,price,volume):
+        count = self.ring_count[slot]
+        base = slot * self.capacity
+        # shards deliver independently, so a late tick is dropped rather than breaking the ring's time order
+        if count and self.ring_ts[base + (self.ring_head[slot] - 1) % self.capacity] >= timestamp:
+            return
+        position = base + self.ring_head[slot]
+        self.ring_ts[position] = timestamp
+        self.ring_price[position] = price
+        self.ring_volume[position] = volume
+        self.ring_head[slot] = (self.ring_head[slot] + 1) % self.capacity
+        if count < self.capacity:
+            self.ring_count[slot] = count + 1
+
+    def update(self,record):
+        timestamp = int(record['Timestamp'])
+        slot = self._slot(record['id'])
+        # partial records (price-only websocket ticks) update just the fields they carry
+        if timestamp >= self.timestamp[slot]:
+            self.timestamp[slot] = timestamp
+            rank = record.get('rank')
+            if rank is not None:
+                self.rank[slot] = int(rank)
+            for name,column in self.floats.items():
+                value = record.get(name)
+                if value is not None:
+                    column[slot] = float(value)
+            for name,column in self.texts.items():
+                value = record.get(name)
+                if value is not None:
+                    column[slot] = value
+        price = record.get('priceUsd')
+        if price is not None:
+            volume = record.get('volumeUsd24Hr')
+            self._append_tick(slot,timestamp,float(price),float(volume) if volume is not None else self.floats['volumeUsd24Hr'][slot])
+
+    def update_records(self,records):
+        with self.lock:
+            for record in records:
+                if record.get('id') is not None and record.get('Timestamp') is not None:
+                    self.update(record)
+            INDEXED_ASSETS.set(len(self.asset_ids))
+        INDEX_UPDATES.inc(len(records))
+
+    def handle_kinesis_records(self,shard_id,records):
+        self.update_records([decode_record(record['Data']) for record in records])
+
+    def _snapshot(self,slot):
+        snapshot = {'id':self.asset_ids[slot],'Timestamp':self.timestamp[slot],
+                    'rank':self.rank[slot] if self.rank[slot] != MISSING_RANK else None}
+        for name,column in self.texts.items():
+            snapshot[name] = column[slot]
+        for name,column in self.floats.items():
+            value = column[slot]
+            snapshot[name] = value if value == value else None
+        return snapshot
+
+    def get(self,asset_id):
+        with self.lock:
+            slot = self.asset_index.get(asset_id)
+            return self._snapshot(slot) if slot is not None else None
+
+    def get_many(self,asset_ids):
+        with self.lock:
+            return [self._snapshot(self.asset_index[asset_id]) for asset_id in asset_ids if asset_id in self.asset_index]
+
+    def top(self,field='marketCapUsd',n=10,ascending=False):
+        if field not in self.floats:
+            raise ValueError(f'Cannot rank by {field}')
+        with self.lock:
+            size = len(self.asset_ids)
+            if not size or n <= 0:
+                return []
+            # a zero-copy view over the column; it is dropped before the lock is released so the array can grow again
+            values = np.frombuffer(self.floats[field],dtype=np.float64,count=size)
+            keys = values if ascending else -values
+            keys = np.where(np.isnan(keys),np.inf,keys)
+            n = min(n,size)
+            candidates = np.argpartition(keys,n - 1)[:n] if n < size else np.arange(size)
+            slots = candidates[np.argsort(keys[candidates],kind='stable')].tolist()
+            del values,keys
+            return [self._snapshot(slot) for slot in slots if self.floats[field][slot] == self.floats[field][slot]]
+
+    def ticks(self,asset_id,start=None,end=None):
+        with self.lock:
+            slot = self.asset_index.get(asset_id)
+            if slot is None:
+                return None
+            count = self.ring_count[slot]
+            base = slot * self.capacity
+            positions = [base + (self.ring_head[slot] - count + offset) % self.capacity for offset in range(count)]
+            timestamps = [self.ring_ts[position] for position in positions]
+            first = bisect_left(timestamps,start) if start is not None else 0
+            last = bisect_left(timestamps,end) if end is not None else count
+            ticks = []
+            for index in range(first,last):
+                volume = self.ring_volume[positions[index]]
+                ticks.append({'Timestamp':timestamps[index],'priceUsd':self.ring_price[positions[index]],
+                              'volumeUsd24Hr':volume if volume == volume else None})
+            return ticks
+
+    def stats(self):
+        with self.lock:
+            size = len(self.asset_ids)
+            return {'assets':size,'ring_capacity':self.capacity,
+                    'latest_timestamp':max(self.timestamp[:size]) if size else None}
+
+
+class _UnixHTTPServer(ThreadingMixIn,UnixStreamServer):
+    daemon_threads = True
+
+
+class PriceIndexServer():
+    # read-only JSON API over the index, on TCP or a unix socket
+    def __init__(self,index,host='127.0.0.1',port=8765,unix_socket=None):
+        index_ref = index
+
+        class IndexHandler(BaseHTTPRequestHandler):
+            def _send(self,status,body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {name:values[-1] for name,values in parse_qs(url.query).items()}
+                parts = [part for part in url.path.split('/') if part]
+                start = time.perf_counter()
+                try:
+                    if parts == ['health']:
+                        endpoint,status,body = 'health',200,index_ref.stats()
+                    elif parts == ['assets']:
+                        ids = [asset_id for asset_id in query.get('ids','').split(',') if asset_id]
+                        endpoint,status,body = 'assets',200,index_ref.get_many(ids)
+                    elif len(parts) == 2 and parts[0] == 'assets':
+                        snapshot = index_ref.get(parts[1])
+                        endpoint,status,body = 'asset',200 if snapshot else 404,snapshot or {'error':f'Unknown asset {parts[1]}'}
+                    elif len(parts) == 3 and parts[0] == 'assets' and parts[2] == 'ticks':
+                        ticks = index_ref.ticks(parts[1],int(query['start']) if 'start' in query else None,
+                                                int(query['end']) if 'end' in query else None)
+                        if ticks is None:
+                            endpoint,status,body = 'ticks',404,{'error':f'Unknown asset {parts[1]}'}
+                        else:
+                            endpoint,status,body = 'ticks',200,ticks
+                    elif parts == ['top']:
+                        endpoint,status,body = 'top',200,index_ref.top(query.get('by','marketCapUsd'),int(query.get('n',10)),
+                                                                      query.get('order','desc') == 'asc')
+                    else:
+                        endpoint,status,body = 'unknown',404,{'error':f'Unknown path {url.path}'}
+                except ValueError as e:
+                    endpoint,status,body = 'invalid',400,{'error':str(e)}
+                QUERY_LATENCY.observe(time.perf_counter() - start,endpoint=endpoint)
+                self._send(status,body)
+
+            def log_message(self,format,*args):
+                pass
+
+        self.unix_socket = unix_socket
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            self.server = _UnixHTTPServer(unix_socket,IndexHandler)
+        else:
+            self.server = ThreadingHTTPServer((host,port),IndexHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,name='price-index-api',daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
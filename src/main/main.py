@@ -1,9 +1,28 @@
+import argparse
+from datetime import datetime,timedelta
 from data_ingestion.base_producer import BaseProducer
 
 def main():
-    producer = BaseProducer('config.ini','api','aws')
-    response = producer.run()
-    print(response)
+    parser = argparse.ArgumentParser(description='Run the crypto stream producer')
+    parser.add_argument('--mode',choices=['single','supervisor','teardown'],default='single',
+                        help='single: one producer that tears the streams down when done; supervisor: producer and consumer '
+                             'worker processes with shard leases; teardown: drain and delete the streams')
+    parser.add_argument('--config',default='config.ini')
+    args = parser.parse_args()
+
+    if args.mode == 'supervisor':
+        from supervisor import Supervisor
+        Supervisor(args.config,'supervisor','aws').run()
+    elif args.mode == 'teardown':
+        producer = BaseProducer(args.config,'api','aws')
+        connector = producer.aws_connector
+        # a separate teardown run did not see the streams start, so the drain check looks back over the metrics window
+        connector.kinesis_stream_start_time = datetime.now() - timedelta(seconds=int(connector.section.get('firehose_metrics_window_seconds',900)))
+        connector.delete_streams()
+    else:
+        producer = BaseProducer(args.config,'api','aws')
+        response = producer.run()
+        print(response)
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
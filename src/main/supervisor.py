@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import signal
+import sqlite3
+import threading
+import multiprocessing
+from configparser import ConfigParser,ExtendedInterpolation
+from utils.base_component import BaseComponent
+from utils.logging_pipeline import setup_logging
+from utils.aws_connector import AWSConnector
+from utils.lease_store import LeaseStore
+from utils.metrics import get_registry,configure_metrics
+
+SUPERVISED_WORKERS = get_registry().gauge('supervisor_workers','Worker processes the supervisor is running',('role',))
+WORKER_RESTARTS = get_registry().counter('supervisor_worker_restarts_total','Worker processes restarted after exiting',('role',))
+ROLES = ('producer','consumer')
+
+
+def worker_log_file(log_file,role,worker_id):
+    if not log_file:
+        return log_file
+    root,extension = os.path.splitext(log_file)
+    return f'{root}.{role}-{worker_id}{extension}'
+
+
+def setup_worker_logging(config_file,role,worker_id):
+    # rotating one file from several processes loses and interleaves records, so every worker writes its own;
+    # the component built afterwards finds logging configured and keeps it
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(config_file)
+    section = dict(config['logging']) if config.has_section('logging') else {}
+    section['log_file'] = worker_log_file(section.get('log_file','crypto_stream.log'),role,worker_id)
+    setup_logging(BaseComponent.logger,section)
+
+
+def run_worker(role,worker_id,config_file,lease_db,workers,stop_event,lease_ttl_seconds,max_iterations):
+    # each worker is its own process and interpreter, so producers and consumers are no longer bound to one GIL
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGTERM,lambda signum,frame:stop_event.set())
+    setup_worker_logging(config_file,role,worker_id)
+    if role == 'producer':
+        from data_ingestion.base_producer import BaseProducer
+        component = BaseProducer(config_file,'api','aws')
+        # the supervisor provisions once and never tears down; spools are per worker so replay stays ordered
+        component.config['teardown_on_exit'] = 'false'
+        component.config['max_iterations'] = str(max_iterations)
+        component.config['spool_directory'] = os.path.join(component.config.get('spool_directory','spool'),f'producer-{worker_id}')
+    else:
+        from data_processing.kinesis_consumer import BaseConsumer
+        component = BaseConsumer(config_file,'consumer','aws')
+        # checkpoints stay shared so a shard resumes where its previous owner stopped; listeners get their own address
+        component.config['price_index_port'] = str(int(component.config.get('price_index_port',8765)) + worker_id)
+        if component.config.get('price_index_socket'):
+            component.config['price_index_socket'] = f'{component.config["price_index_socket"]}.{worker_id}'
+    # the supervisor owns Firehose tuning and serves the base metrics port; workers take the ports after it
+    component.aws_connector.section['firehose_autotune'] = 'false'
+    if component.aws_connector.backend == 'local':
+        # the emulator lives inside each process, so a local worker provisions its own copy of the streams
+        component.aws_connector.ensure_resources()
+    if component.metrics_section:
+        component.metrics_section['prometheus_port'] = str(int(component.metrics_section.get('prometheus_port',9108)) + 1 +
+                                                           worker_id * len(ROLES) + ROLES.index(role))
+    logger = component.logger
+    owner = f'{role}-{worker_id}-{os.getpid()}'
+    lease_store = LeaseStore(lease_db)
+    component.owned_shards = lease_store.balance(role,owner,workers.value,lease_ttl_seconds)
+    logger.info(f'Worker {owner} started with shards {sorted(component.owned_shards)}')
+
+    def keep_leases():
+        # renewing at a third of the TTL leaves two chances before another worker may take the lease over
+        while not stop_event.wait(lease_ttl_seconds / 3):
+            try:
+                owned_shards = lease_store.balance(role,owner,workers.value,lease_ttl_seconds)
+            except sqlite3.Error as e:
+                logger.error(f'Worker {owner} could not renew leases: {e}')
+                continue
+            if owned_shards != component.owned_shards:
+                logger.info(f'Worker {owner} now owns shards {sorted(owned_shards)}')
+                component.owned_shards = owned_shards
+        component.stop()
+
+    lease_thread = threading.Thread(target=keep_leases,name='lease-keeper',daemon=True)
+    lease_thread.start()
+    try:
+        component.run()
+    finally:
+        stopped = stop_event.is_set()
+        stop_event.set()
+        lease_thread.join()
+        lease_store.release(role,owner)
+        lease_store.close()
+    # a bounded producer finishing its iterations is done; any other return without a stop request is a failure
+    sys.exit(0 if stopped or (role == 'producer' and max_iterations > 0) else 1)
+
+
+class Supervisor(BaseComponent):
+    def __init__(self,config,section_name,aws_section,aws_connector=None):
+        super().__init__(config,section_name)
+        self.config_file = config
+        self.aws_section = self.read_config(config,aws_section)
+        self.aws_connector = aws_connector or AWSConnector(self.logger,self.aws_section)
+        self.metrics_section = self.read_config(config,'metrics')
+        self.metrics_exporter = None
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = threading.Event()
+        self.workers = {}
+
+    def initialize(self):
+        self.lease_db = self.config.get('lease_db','leases.db')
+        self.lease_ttl_seconds = float(self.config.get('lease_ttl_seconds',30))
+        self.configured_workers = {role:int(self.config.get(f'{role}_workers',0)) for role in ROLES}
+        self.max_workers_per_role = int(self.config.get('max_workers_per_role',8))
+        self.check_interval_seconds = float(self.config.get('check_interval_seconds',2))
+        self.shard_refresh_seconds = float(self.config.get('shard_refresh_seconds',60))
+        self.restart_backoff_seconds = float(self.config.get('restart_backoff_seconds',1))
+        self.max_restart_backoff_seconds = float(self.config.get('max_restart_backoff_seconds',60))
+        self.healthy_after_seconds = float(self.config.get('healthy_after_seconds',60))
+        self.stop_timeout_seconds = float(self.config.get('stop_timeout_seconds',30))
+        self.worker_max_iterations = int(self.config.get('worker_max_iterations',0))
+        self.lease_store = LeaseStore(self.lease_db)
+        self.worker_counts = {role:self.context.Value('i',0) for role in ROLES}
+        self.metrics_exporter = configure_metrics(self.metrics_section)
+
+    def open_shards(self):
+        paginator = self.aws_connector.get_kinesis_client().get_paginator('list_shards')
+        # closed parents still hold unread records, but only open shards take new writes and set the worker count
+        return sorted(shard['ShardId'] for page in paginator.paginate(StreamName=self.aws_section['kinesis_stream'])
+                      for shard in page['Shards'] if 'EndingSequenceNumber' not in shard['SequenceNumberRange'])
+
+    def all_shards(self):
+        paginator = self.aws_connector.get_kinesis_client().get_paginator('list_shards')
+        return sorted(shard['ShardId'] for page in paginator.paginate(StreamName=self.aws_section['kinesis_stream'])
+                      for shard in page['Shards'])
+
+    def target_workers(self,role,shard_count):
+        configured = self.configured_workers[role]
+        return max(1,min(configured or shard_count,shard_count or 1,self.max_workers_per_role))
+
+    def refresh_assignment(self):
+        open_shards = self.open_shards()
+        self.lease_store.sync_resources('producer',open_shards)
+        self.lease_store.sync_resources('consumer',self.all_shards())
+        for role in ROLES:
+            target = self.target_workers(role,len(open_shards))
+            if target != self.worker_counts[role].value:
+                self.logger.info(f'Scaling {role} workers from {self.worker_counts[role].value} to {target} for {len(open_shards)} open shards')
+            self.worker_counts[role].value = target
+            self.scale(role,target)
+
+    def _start_worker(self,role,index):
+        handle = self.workers.get((role,index)) or {'restarts':0,'backoff':self.restart_backoff_seconds}
+        stop_event = self.context.Event()
+        process = self.context.Process(target=run_worker,name=f'{role}-{index}',
+                                       args=(role,index,self.config_file,self.lease_db,self.worker_counts[role],stop_event,
+                                             self.lease_ttl_seconds,self.worker_max_iterations))
+        process.start()
+        handle.update({'process':process,'stop_event':stop_event,'started_at':time.monotonic(),'next_start':None,'finished':False})
+        self.workers[(role,index)] = handle
+        self.logger.info(f'Started {role} worker {index} as pid {process.pid}')
+
+    def _stop_worker(self,key):
+        handle = self.workers.pop(key)
+        process = handle.get('process')
+        if process is None or not process.is_alive():
+            return
+        handle['stop_event'].set()
+        process.join(self.stop_timeout_seconds)
+        if process.is_alive():
+            self.logger.warning(f'{key[0]} worker {key[1]} did not stop within {self.stop_timeout_seconds}s, terminating')
+            process.terminate()
+            process.join()
+
+    def scale(self,role,target):
+        for index in range(target):
+            if (role,index) not in self.workers:
+                self._start_worker(role,index)
+        for key in [key for key in self.workers if key[0] == role and key[1] >= target]:
+            self._stop_worker(key)
+        SUPERVISED_WORKERS.set(target,role=role)
+
+    def check_workers(self):
+        now = time.monotonic()
+        for (role,index),handle in list(self.workers.items()):
+            process = handle['process']
+            if handle['finished'] or process.is_alive():
+                continue
+            if handle['next_start'] is None:
+                if process.exitcode == 0:
+                    handle['finished'] = True
+                    self.logger.info(f'{role} worker {index} finished')
+                    continue
+                # a worker that stayed up for a while starts over from the base backoff
+                if now - handle['started_at'] >= self.healthy_after_seconds:
+                    handle['backoff'] = self.restart_backoff_seconds
+                handle['next_start'] = now + handle['backoff']
+                self.logger.warning(f'{role} worker {index} exited with {process.exitcode}, restarting in {handle["backoff"]:.1f}s')
+                handle['backoff'] = min(handle['backoff'] * 2,self.max_restart_backoff_seconds)
+            elif now >= handle['next_start']:
+                handle['restarts'] += 1
+                WORKER_RESTARTS.inc(role=role)
+                self._start_worker(role,index)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        previous_handlers = {}
+        try:
+            self.initialize()
+            # provisioning happens once here; workers only produce and consume, and nothing here deletes streams
+            self.aws_connector.ensure_resources()
+            if threading.current_thread() is threading.main_thread():
+                previous_handlers[signal.SIGTERM] = signal.signal(signal.SIGTERM,lambda signum,frame:self.stop())
+            self.refresh_assignment()
+            next_refresh = time.monotonic() + self.shard_refresh_seconds
+            while not self.stop_event.is_set():
+                self.check_workers()
+                if time.monotonic() >= next_refresh:
+                    self.refresh_assignment()
+                    next_refresh = time.monotonic() + self.shard_refresh_seconds
+                if self.workers and all(handle['finished'] for handle in self.workers.values()):
+                    self.logger.info('All workers finished')
+                    break
+                self.stop_event.wait(self.check_interval_seconds)
+        except KeyboardInterrupt:
+            self.logger.info('Supervisor interrupted')
+        except Exception as e:
+            self.logger.error(e,exc_info=True)
+        finally:
+            for key in list(self.workers):
+                self._stop_worker(key)
+            for signum,handler in previous_handlers.items():
+                signal.signal(signum,handler)
+            if getattr(self,'lease_store',None):
+                self.lease_store.close()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop()
+            self.logger.info('Supervisor stopped')
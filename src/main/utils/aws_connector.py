@@ -1,10 +1,24 @@
-import sys
 import boto3
 import json
 import botocore
+import threading
+from bisect import bisect_right
 from datetime import datetime
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError,PartialCredentialsError
 from botocore.exceptions import ClientError
+from utils.kinesis_batch_writer import KinesisBatchWriter
+from utils.resource_provisioner import ResourceProvisioner
+from utils.firehose_controller import FirehoseDeliveryController
+from utils.glue_schema import raw_table_input,table_changes,evolve_table_input
+from utils.local_aws import LocalSession,get_local_backend
+from utils.record_aggregation import partition_key_hash
+from data_processing.lake_reader import LakeReader
+
+
+class StreamUnavailableError(Exception):
+    # credentials or provisioning failed; producers keep their records and retry instead of exiting
+    pass
 
 
 class AWSConnector():
@@ -12,38 +26,78 @@ class AWSConnector():
         self.logger = logger
         self.section = aws_section
         self.region = self.section['region']
+        self.backend = self.section.get('backend','aws')
+        if self.backend == 'local':
+            self.session = LocalSession(get_local_backend(
+                region=self.region,
+                write_records_per_second=int(self.section.get('local_shard_write_records_per_second',1000)),
+                write_bytes_per_second=int(self.section.get('local_shard_write_bytes_per_second',1048576)),
+                read_calls_per_second=int(self.section.get('local_shard_read_calls_per_second',5)),
+                read_bytes_per_second=int(self.section.get('local_shard_read_bytes_per_second',2097152)),
+                request_latency_seconds=float(self.section.get('local_request_latency_seconds',0))),region_name=self.region)
+        else:
+            self.session = boto3.Session(region_name=self.region)
+        self.client_config = Config(
+            max_pool_connections=int(self.section.get('client_max_pool_connections',10)),
+            tcp_keepalive=self.section.get('client_tcp_keepalive','true').lower() == 'true',
+            retries={
+                'mode':self.section.get('client_retry_mode','standard'),
+                'max_attempts':int(self.section.get('client_retry_max_attempts',5))
+            }
+        )
+        self._clients = {}
+        self._clients_lock = threading.Lock()
         self.account_id = self.get_account_id()
+        if self.backend == 'local':
+            # the emulator starts empty, so the bucket Firehose delivers to has to exist up front
+            self.get_s3_client().create_bucket(Bucket=self.section['firehose_s3_bucket'])
         self.flag_setup_resource = 0
+        self._shard_index = None
+        self._delivery_controller = None
+        self.batch_writer = None
         self.kinesis_stream_start_time = datetime.now()
+        # records this process got into the stream, which the drain check waits for Firehose to deliver
+        self.records_written = 0
+        self._records_written_lock = threading.Lock()
         self.retry_max_attempts = self.section['retry_max_attempts']
         self.retry_delay_seconds = self.section['retry_delay_seconds']
         self.cloudwatch_log_group = self.section['cloudwatch_log_group']
         self.cloudwatch_log_stream = self.section['cloudwatch_log_stream']
-        self.session = boto3.Session()
+
+    def get_client(self,service):
+        client = self._clients.get(service)
+        if client is None:
+            # session.client is not thread safe, and a cached client keeps its connection pool warm
+            with self._clients_lock:
+                client = self._clients.get(service)
+                if client is None:
+                    client = self.session.client(service,config=self.client_config)
+                    self._clients[service] = client
+        return client
 
     def get_sts_client(self):
-        return boto3.client('sts')
+        return self.get_client('sts')
 
     def get_logs_client(self):
-        return boto3.client('logs')
+        return self.get_client('logs')
 
     def get_cloudwatch_client(self):
-        return boto3.client('cloudwatch')
+        return self.get_client('cloudwatch')
 
     def get_s3_client(self):
-        return self.session.client('s3')
+        return self.get_client('s3')
 
     def get_kinesis_client(self):
-        return self.session.client('kinesis')
+        return self.get_client('kinesis')
     
     def get_firehose_client(self):
-        return self.session.client('firehose')
+        return self.get_client('firehose')
     
     def get_iam_client(self):
-        return self.session.client('iam')
+        return self.get_client('iam')
     
     def get_glue_client(self):
-        return self.session.client('glue')
+        return self.get_client('glue')
 
     def waiter_log_retry(self,attempts,delay):
                 self.logger.info(f'Waiter retrying ...Attemps {attempts}:delay {delay}seconds')
@@ -54,13 +108,13 @@ class AWSConnector():
     
     def create_managed_policy(self,iam_client,policy,policy_document,policy_description):
         try:
-            iam_client.create_policy(
+            response = iam_client.create_policy(
             PolicyName=policy,
             PolicyDocument=policy_document,
             Description=policy_description
             )
             self.logger.info(f'Policy {policy} created')
-            return True
+            return response['Policy']['Arn']
         except iam_client.exceptions.EntityAlreadyExistsException:
             self.logger.info(f'Policy {policy} already exists')
             return True
@@ -68,7 +122,7 @@ class AWSConnector():
             self.logger.error(e,exc_info=True)
             return None
 
-    def create_glue_table(self,glue_client,glue_database,glue_table):
+    def create_glue_table(self,glue_client,glue_database,glue_table,table_input=None):
         try:
             glue_client.create_database(DatabaseInput={'Name':glue_database})
         except glue_client.exceptions.AlreadyExistsException:
@@ -76,22 +130,22 @@ class AWSConnector():
         except Exception as e:
             self.logger.error(e,exc_info=True)
 
+        table_input = table_input or raw_table_input(glue_table,self.section['firehose_s3_bucket'],self.section['firehose_s3_prefix'],
+                                                     self.section.get('glue_projection_start','2024/01/01'))
         try:
-            glue_client.create_table(
-                DatabaseName=glue_database,
-                TableInput={
-                    'Name':glue_table,
-                    'StorageDescriptor':{
-                        'Columns':[
-                            {'Name':'Data','Type':'struct<id:string,rank:string>'}
-                        ]
-                    }
-                }
-            )
-            self.logger.info(f'Glue table : {glue_table} created in {self.region}')
-            return True
-        except glue_client.exceptions.AlreadyExistsException:
-            self.logger.info(f'Glue table : {glue_table} already exists')
+            try:
+                current = glue_client.get_table(DatabaseName=glue_database,Name=glue_table)['Table']
+            except glue_client.exceptions.EntityNotFoundException:
+                glue_client.create_table(DatabaseName=glue_database,TableInput=table_input)
+                self.logger.info(f'Glue table : {glue_table} created in {self.region}')
+                return True
+            changes = table_changes(current,table_input)
+            if not changes:
+                self.logger.info(f'Glue table : {glue_table} already exists with the current schema')
+                return True
+            # update_table archives the previous definition as a table version; Firehose reads the LATEST one
+            glue_client.update_table(DatabaseName=glue_database,TableInput=evolve_table_input(current,table_input))
+            self.logger.info(f'Glue table : {glue_table} evolved to a new version: {", ".join(changes)}')
             return True
         except Exception as e:
             self.logger.error(f'Unable to create glue table {glue_table},{e}',exc_info=True)
@@ -126,10 +180,13 @@ class AWSConnector():
             s3_client = self.get_s3_client()
             s3_client.head_bucket(Bucket=bucket)
             return f'arn:aws:s3:::{bucket}'
-        except s3_client.meta.client.exceptions_BUCKETNOTFOUND as e:
+        except ClientError as e:
             self.logger.error(e,exc_info=True)
             return None
     
+    def format_kinesis_stream_ARN(self,stream):
+        return f'arn:aws:kinesis:{self.region}:{self.account_id}:stream/{stream}'
+
     def get_kinesis_stream_ARN(self,kinesis_client,stream):
         try:
             return kinesis_client.describe_stream(StreamName=stream)['StreamDescription']['StreamARN']
@@ -198,6 +255,37 @@ class AWSConnector():
             self.logger.error(e,exc_info=True)
             return None
            
+    def list_attached_role_policy_ARNs(self,iam_client,role):
+        paginator = iam_client.get_paginator('list_attached_role_policies')
+        return {policy['PolicyName']:policy['PolicyArn']
+                for page in paginator.paginate(RoleName=role)
+                for policy in page['AttachedPolicies']}
+
+    def list_local_policy_ARNs(self,iam_client):
+        paginator = iam_client.get_paginator('list_policies')
+        return {policy['PolicyName']:policy['Arn']
+                for page in paginator.paginate(Scope='Local',OnlyAttached=False)
+                for policy in page['Policies']}
+
+    def reconcile_role_policies(self,iam_client,role,managed_policies):
+        attached_policies = self.list_attached_role_policy_ARNs(iam_client,role)
+        missing_policies = [policy for policy in managed_policies if policy.get('policy_name') not in attached_policies]
+        self.logger.info(f'Role {role}: {len(attached_policies)} policies attached, {len(missing_policies)} to reconcile')
+        if not missing_policies:
+            return True
+
+        local_policies = self.list_local_policy_ARNs(iam_client)
+        for policy in missing_policies:
+            policy_name = policy.get('policy_name')
+            policy_ARN = local_policies.get(policy_name)
+            if not policy_ARN:
+                policy_ARN = self.create_managed_policy(iam_client,policy_name,json.dumps(policy.get('policy_document')),policy.get('policy_description'))
+                if policy_ARN is True:
+                    policy_ARN = f'arn:aws:iam::{self.account_id}:policy/{policy_name}'
+            if not policy_ARN or not self.attach_policy_to_role(iam_client,role,policy_name,policy_ARN):
+                return False
+        return True
+
     def get_service_policy_ARN(self,iam_client,service_role_policy):
         return f'arn:aws:iam::aws:policy/service-role/{service_role_policy}'
         
@@ -248,21 +336,7 @@ class AWSConnector():
             for policy,arn in dict_policy_iams.items():
                 managed_policies = managed_policies.replace(policy,arn)
             managed_policies = json.loads(managed_policies)
-            
-            for policy in managed_policies:
-                policy_name = policy.get('policy_name')
-                policy_description = policy.get('policy_description')
-                policy_document = json.dumps(policy.get('policy_document'))
-                self.create_managed_policy(iam_client,policy_name,policy_document,policy_description)
-
-                policy_ARN = self.get_role_policy_ARN(iam_client,firehose_role,policy_name)
-                if not policy_ARN:
-                        policy_ARN = self.get_unattached_policy_ARN(iam_client,firehose_role,policy_name,scope='Local')
-                if policy_ARN:
-                            response = self.attach_policy_to_role(iam_client,firehose_role,policy_name,policy_ARN)
-                            if not response:
-                                return False
-            return True
+            return self.reconcile_role_policies(iam_client,firehose_role,managed_policies)
 
         except Exception as e:
             self.logger.error(f'Unable to attach policies for {firehose_role}: {e}',exc_info=True)
@@ -271,6 +345,7 @@ class AWSConnector():
     def create_cloudwatch_log_group(self,log_client):
         try:
             log_client.create_log_group(logGroupName=self.cloudwatch_log_group)
+            return True
         except log_client.exceptions.ResourceAlreadyExistsException:
             self.logger.info(f'Log group : {self.cloudwatch_log_group} already exists')
             return True
@@ -281,6 +356,7 @@ class AWSConnector():
     def create_cloudwatch_log_stream(self,log_client):
         try:
             log_client.create_log_stream(logGroupName=self.cloudwatch_log_group,logStreamName=self.cloudwatch_log_stream)
+            return True
         except log_client.exceptions.ResourceAlreadyExistsException:
             self.logger.info(f'Log stream : {self.cloudwatch_log_stream}  in group {self.cloudwatch_log_group} already exists')
             return True
@@ -302,6 +378,7 @@ class AWSConnector():
             self.logger.error(e,exc_info=True)
 
         try:
+            delivery_controller = self.get_delivery_controller()
             firehose_client.create_delivery_stream(
             DeliveryStreamName=firehose_stream,
             DeliveryStreamType='KinesisStreamAsSource',
@@ -314,10 +391,7 @@ class AWSConnector():
                 'RoleARN': role_ARN,
                 'Prefix': self.stream_s3_prefix,
                 'ErrorOutputPrefix':'error=!{firehose:error-output-type}/!{timestamp:yyyy/MM/dd}',
-                'BufferingHints': {
-                    'SizeInMBs': 64,
-                    'IntervalInSeconds': 30
-                },
+                'BufferingHints': delivery_controller.buffering_hints(),
                 'CloudWatchLoggingOptions': {
                 'Enabled': True,
                 'LogGroupName': self.cloudwatch_log_group,
@@ -337,13 +411,7 @@ class AWSConnector():
                             'OpenXJsonSerDe': {}
                         }
                     },
-                    'OutputFormatConfiguration': {
-                        'Serializer': {
-                            'ParquetSerDe': {
-                                'Compression':'GZIP'
-                            }
-                        }
-                    },
+                    'OutputFormatConfiguration': delivery_controller.output_format(),
                     'Enabled': True
                 }
             }
@@ -354,28 +422,35 @@ class AWSConnector():
             self.logger.error(e,exc_info=True)
             raise
     
+    def get_delivery_controller(self):
+        if self._delivery_controller is None:
+            self._delivery_controller = FirehoseDeliveryController(
+                self.logger,self.get_firehose_client(),self.get_cloudwatch_client(),self.section['firehose_stream'],
+                buffer_size_mb=int(self.section.get('firehose_buffer_size_mb',64)),
+                buffer_interval_seconds=int(self.section.get('firehose_buffer_interval_seconds',30)),
+                compression=self.section.get('firehose_compression','GZIP'),
+                target_file_size_mb=int(self.section.get('firehose_target_file_size_mb',128)),
+                target_freshness_seconds=float(self.section.get('firehose_target_freshness_seconds',600)),
+                metrics_period_seconds=int(self.section.get('firehose_metrics_period_seconds',60)),
+                metrics_window_seconds=int(self.section.get('firehose_metrics_window_seconds',900)),
+                tune_interval_seconds=float(self.section.get('firehose_tune_interval_seconds',300)),
+                drain_timeout_seconds=float(self.section.get('firehose_drain_timeout_seconds',900)),
+                drain_poll_seconds=float(self.section.get('firehose_drain_poll_seconds',30)))
+        return self._delivery_controller
+
+    def firehose_enabled(self):
+        return self.section.get('firehose_enabled','true').lower() == 'true'
+
+    def start_delivery_tuning(self):
+        if self.firehose_enabled() and self.section.get('firehose_autotune','false').lower() == 'true':
+            self.get_delivery_controller().start()
+
     def check_for_data_persistance(self,cloudwatch_client,s3_client,firehose_stream):
-        while True:
-            firehose_metrics = cloudwatch_client.get_metric_statistics(
-                Namespace='AWS/KinesisFirehose',
-                MetricName='IncomingBytes',
-                Dimensions=[
-                {
-                'Name': 'DeliveryStreamName',
-                'Value': firehose_stream
-                }
-                ],
-                StartTime=self.kinesis_stream_start_time,
-                EndTime=datetime.now(),
-                Period = 60,
-                Statistics=['Sum'],
-                Unit='Bytes'
-            )
-            #incoming_bytes = firehose_metrics['IncomingBytes']
-            #s3_delivery = firehose_metrics['DeliveryToS3.Success']
-            print(firehose_metrics)
-            break
-        return True
+        delivery_controller = self.get_delivery_controller()
+        delivery_controller.stop()
+        with self._records_written_lock:
+            records_written = self.records_written
+        return delivery_controller.wait_for_drain(self.kinesis_stream_start_time,records_written)
     
     def delete_kinesis_stream(self,kinesis_client,stream,kinesis_delay,kinesis_max_attempts):
         try:
@@ -398,8 +473,7 @@ class AWSConnector():
             self.logger.info(f'Kinesis stream:{stream} deleted in {self.region}')
             return True
         except Exception as e:
-            self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise StreamUnavailableError(f'Kinesis stream:{stream} could not be deleted in {self.region}: {e}') from e
     
     def delete_firehose_stream(self,firehose_client,stream,kinesis_delay,kinesis_max_attempts):
         try:
@@ -416,9 +490,17 @@ class AWSConnector():
             self.logger.info(f'Firehose stream {stream} not found in {self.region}')
             return True
         except Exception as e:
-            self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise StreamUnavailableError(f'Firehose stream:{stream} could not be deleted in {self.region}: {e}') from e
     
+    def get_resource_provisioner(self):
+        resource_keys = ['kinesis_stream','firehose_enabled','firehose_stream','firehose_role','glue_kinesis_database','glue_kinesis_table',
+                         'firehose_s3_bucket','firehose_s3_prefix','shard_count','cloudwatch_log_group','cloudwatch_log_stream','policies']
+        fingerprint_values = {key:self.section.get(key) for key in resource_keys} | {'region':self.region,'account_id':self.account_id}
+        # emulator state does not outlive the process, so a manifest would skip steps that must run again
+        manifest_path = None if self.backend == 'local' else self.section.get('resource_manifest','resource_manifest.json')
+        return ResourceProvisioner(self.logger,manifest_path,fingerprint_values,
+                                   max_workers=int(self.section.get('provisioning_workers',4)))
+
     def setup_resources(self):
         try:
             kinesis_stream = self.section['kinesis_stream']
@@ -433,69 +515,140 @@ class AWSConnector():
             shard_count = int(self.section['shard_count'])
             retry_delay=int(self.section['retry_delay_seconds'])
             retry_max_attempts=int(self.section['retry_max_attempts'])
-            kinesis_client = self.get_kinesis_client()
-            glue_client = self.get_glue_client()
-            firehose_client = self.get_firehose_client()
-            log_client = self.get_logs_client()
 
             self.logger.info(f'glue_kinesis_database:{glue_kinesis_database},glue_kinesis_table:{glue_kinesis_table}')
 
-            self.create_glue_table(glue_client,glue_kinesis_database,glue_kinesis_table)
-            kinesis_start_tiem = self.create_kinesis_stream(kinesis_client,kinesis_stream,shard_count,retry_delay,retry_max_attempts)
-
-            kinesis_stream_ARN = self.get_kinesis_stream_ARN(kinesis_client,kinesis_stream)
-            bucket_ARN = self.get_s3_bucket_ARN(firehose_s3_bucket)
+            # ARNs are derived from names so IAM policies can be reconciled while the stream is still being created
+            kinesis_stream_ARN = self.format_kinesis_stream_ARN(kinesis_stream)
+            bucket_ARN = f'arn:aws:s3:::{firehose_s3_bucket}'
             glue_table_ARN = self.get_glue_table_ARN(glue_kinesis_database,glue_kinesis_table)
             glue_database_ARN = self.get_glue_database_ARN(glue_kinesis_database)
             firehose_ARN = self.get_kinesis_firehose_ARN(firehose_stream)
             catalog_ARN = self.get_glue_catalog_ARN()
-            self.create_cloudwatch_log_group(log_client)
-            self.create_cloudwatch_log_stream(log_client)
 
-            role_response = self.verify_roles_policies(firehose_role,kinesis_stream_ARN,bucket_ARN,glue_table_ARN,glue_database_ARN,firehose_ARN,catalog_ARN)
-            
-            if role_response:
-                firehouse_reponse = self.create_kinesis_firehose(firehose_client,firehose_stream,firehose_role,glue_kinesis_database,glue_kinesis_table,bucket_ARN,kinesis_stream_ARN)
-                if firehouse_reponse :
-                    return True
-                else:
-                    self.logger.info(f'unable to create kinesis firehose {firehose_stream}')
-            else:
+            def setup_glue(_):
+                if self.create_glue_table(self.get_glue_client(),glue_kinesis_database,glue_kinesis_table):
+                    return {'glue_table_ARN':glue_table_ARN,'glue_database_ARN':glue_database_ARN}
+
+            def setup_kinesis(_):
+                kinesis_client = self.get_kinesis_client()
+                if self.create_kinesis_stream(kinesis_client,kinesis_stream,shard_count,retry_delay,retry_max_attempts):
+                    return {'kinesis_stream_ARN':self.get_kinesis_stream_ARN(kinesis_client,kinesis_stream)}
+
+            def setup_s3(_):
+                verified_bucket_ARN = self.get_s3_bucket_ARN(firehose_s3_bucket)
+                if verified_bucket_ARN:
+                    return {'bucket_ARN':verified_bucket_ARN}
+
+            def setup_cloudwatch(_):
+                log_client = self.get_logs_client()
+                if self.create_cloudwatch_log_group(log_client) and self.create_cloudwatch_log_stream(log_client):
+                    return {'log_group':self.cloudwatch_log_group,'log_stream':self.cloudwatch_log_stream}
+
+            def setup_iam(_):
+                if self.verify_roles_policies(firehose_role,kinesis_stream_ARN,bucket_ARN,glue_table_ARN,glue_database_ARN,firehose_ARN,catalog_ARN):
+                    return {'role_ARN':self.get_role_ARN(self.get_iam_client(),firehose_role)}
                 self.logger.error(f'Policies could not be attached to role {firehose_role}')
-                sys.exit(1)
-        except NoCredentialsError as e:
-            self.logger.error(e,exc_info=True)
-            sys.exit(1)
-        except PartialCredentialsError as e :
+
+            def setup_firehose(resolved):
+                if self.create_kinesis_firehose(self.get_firehose_client(),firehose_stream,firehose_role,glue_kinesis_database,glue_kinesis_table,
+                                                resolved['s3']['bucket_ARN'],resolved['kinesis']['kinesis_stream_ARN']):
+                    return {'firehose_ARN':firehose_ARN}
+                self.logger.info(f'unable to create kinesis firehose {firehose_stream}')
+
+            provisioner = self.get_resource_provisioner()
+            provisioner.add_step('kinesis',setup_kinesis)
+            # the Glue table, bucket, log group and role only exist to serve Firehose delivery
+            if self.firehose_enabled():
+                provisioner.add_step('glue',setup_glue)
+                provisioner.add_step('s3',setup_s3)
+                provisioner.add_step('cloudwatch',setup_cloudwatch)
+                provisioner.add_step('iam',setup_iam)
+                provisioner.add_step('firehose',setup_firehose,depends_on=['glue','kinesis','s3','cloudwatch','iam'])
+            results,failed = provisioner.run()
+            if failed:
+                self.logger.error(f'Resource setup failed for steps: {sorted(failed)}')
+                raise StreamUnavailableError(f'Resource setup failed for steps: {sorted(failed)}')
+            return True
+        except StreamUnavailableError:
+            raise
+        except (NoCredentialsError,PartialCredentialsError) as e:
             self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise StreamUnavailableError(f'AWS credentials unavailable: {e}') from e
         except Exception as e:
             self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise StreamUnavailableError(f'Resource setup failed: {e}') from e
+
+    def ensure_resources(self):
+        if not self.flag_setup_resource:
+            self.setup_resources()
+            self.flag_setup_resource = 1
+            self.start_delivery_tuning()
+        if self.batch_writer is None:
+            self.batch_writer = self.create_batch_writer()
+
+    def create_batch_writer(self):
+        # one writer per connector, so its thread pool is reused by every write rather than started per call
+        return KinesisBatchWriter(self.logger,self.get_kinesis_client(),self.section['kinesis_stream'],
+                                  max_records=int(self.section.get('kinesis_batch_max_records',500)),
+                                  max_bytes=int(self.section.get('kinesis_batch_max_bytes',5242880)),
+                                  max_workers=int(self.section.get('kinesis_write_workers',4)),
+                                  max_retries=int(self.section.get('kinesis_write_max_retries',5)),
+                                  base_delay=float(self.section.get('kinesis_retry_base_delay_seconds',0.1)),
+                                  shard_resolver=self.resolve_shard)
+
+    def get_shard_hash_ranges(self,stream=None):
+        stream = stream or self.section['kinesis_stream']
+        paginator = self.get_kinesis_client().get_paginator('list_shards')
+        # closed parent shards keep their range after a reshard but no longer accept writes
+        return [(shard['HashKeyRange']['StartingHashKey'],shard['HashKeyRange']['EndingHashKey'])
+                for page in paginator.paginate(StreamName=stream)
+                for shard in page['Shards']
+                if 'EndingSequenceNumber' not in shard['SequenceNumberRange']]
+
+    def resolve_shard(self,record):
+        # built on first use, which is the first throttled record, so healthy writes never list shards
+        if self._shard_index is None:
+            paginator = self.get_kinesis_client().get_paginator('list_shards')
+            shards = sorted((int(shard['HashKeyRange']['StartingHashKey']),shard['ShardId'])
+                            for page in paginator.paginate(StreamName=self.section['kinesis_stream'])
+                            for shard in page['Shards']
+                            if 'EndingSequenceNumber' not in shard['SequenceNumberRange'])
+            self._shard_index = ([start for start,_ in shards],[shard_id for _,shard_id in shards])
+        starts,shard_ids = self._shard_index
+        if not shard_ids:
+            return ''
+        hash_key = record.get('ExplicitHashKey')
+        hash_value = int(hash_key) if hash_key is not None else partition_key_hash(record['PartitionKey'])
+        return shard_ids[max(bisect_right(starts,hash_value) - 1,0)]
 
     def write_to_kinesis_stream(self,data):
         try:
             kinesis_stream = self.section['kinesis_stream']
-            kinesis_client = self.get_kinesis_client()
-            if not self.flag_setup_resource:
-                self.setup_resources()
-                self.flag_setup_resource = 1
+            self.ensure_resources()
 
             if self.flag_setup_resource:
-                response = kinesis_client.put_records(
-                            StreamName = kinesis_stream,
-                            Records = data
-                                )
-                self.logger.info(f'Data written to stream {kinesis_stream} :{response}')
-        except NoCredentialsError as e:
-            self.logger.error(e,exc_info=True)
-            sys.exit(1)
-        except PartialCredentialsError as e :
+                results = self.batch_writer.write(data)
+                failed_count = sum(len(result.failed_records) for result in results)
+                errors = [result.error for result in results if result.error]
+                # a call error that left nothing written is handled like before batching: as a failed write
+                if errors and failed_count == len(data):
+                    raise errors[0]
+                with self._records_written_lock:
+                    self.records_written += len(data) - failed_count
+                if failed_count:
+                    self.logger.error(f'{failed_count} records could not be written to stream {kinesis_stream} after retries')
+                self.logger.info(f'Data written to stream {kinesis_stream} :{len(data) - failed_count} records in {len(results)} batches')
+                return results
+        except StreamUnavailableError:
+            raise
+        except (NoCredentialsError,PartialCredentialsError) as e:
             self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise StreamUnavailableError(f'AWS credentials unavailable: {e}') from e
         except Exception as e:
+            # transient errors are left to the caller, which can keep the batch for replay
             self.logger.error(e,exc_info=True)
-            sys.exit(1)
+            raise
     
     def delete_streams(self):
         try:
@@ -507,24 +660,36 @@ class AWSConnector():
             firehose_stream = self.section['firehose_stream']
             retry_delay=int(self.section['retry_delay_seconds'])
             retry_max_attempts=int(self.section['retry_max_attempts'])
-            data_persisted = self.check_for_data_persistance(cloudwatch_client,s3_client,firehose_stream)
+            firehose_enabled = self.firehose_enabled()
+            data_persisted = self.check_for_data_persistance(cloudwatch_client,s3_client,firehose_stream) if firehose_enabled else True
             if data_persisted :
                 kinesis_reponse = self.delete_kinesis_stream(kinesis_client,kinesis_stream,retry_delay,retry_max_attempts)
-                firehose_reponse = self.delete_firehose_stream(firehose_client,firehose_stream,retry_delay,retry_max_attempts)
+                firehose_reponse = self.delete_firehose_stream(firehose_client,firehose_stream,retry_delay,retry_max_attempts) if firehose_enabled else True
+                self.get_resource_provisioner().clear_manifest(['kinesis','firehose'])
+                self.flag_setup_resource = 0
+                self._shard_index = None
+                if self.batch_writer is not None:
+                    self.batch_writer.close()
+                    self.batch_writer = None
                 if kinesis_reponse and firehose_reponse:
                     self.logger.info(f'Deleted kinesis stream:{kinesis_stream} and firehose stream:{firehose_stream}')
+            else:
+                self.logger.warning(f'Firehose stream {firehose_stream} has undelivered data; leaving {kinesis_stream} and {firehose_stream} in place')
         except Exception as e:
             self.logger.error(e,exc_info=True)
 
-    def read_from_kinesis_stream(self,stream,shard_id,iterator_type='LATEST'):
+    def read_from_kinesis_stream(self,stream=None,shard_id=None,iterator_type=None):
         try:
             kinesis_client = self.get_kinesis_client()
-            stream = self.section['stream']
-            iterator_type = self.section['iterator_type']
+            stream = stream or self.section['kinesis_stream']
+            iterator_type = iterator_type or self.section['iterator_type'].strip()
 
-            response = kinesis_client.describe_stream(StreamName= stream,Region= self.region)
-            shards = response['StreamDescription']['Shards']
-            shard_ids = [shard['ShardId'] for shard in shards]
+            if shard_id:
+                shard_ids = [shard_id]
+            else:
+                paginator = kinesis_client.get_paginator('list_shards')
+                shard_ids = [shard['ShardId'] for page in paginator.paginate(StreamName=stream) for shard in page['Shards']]
+            records = []
             for shard_id in shard_ids:
                 shard_iterator_response = kinesis_client.get_shard_iterator(
                     StreamName = stream,
@@ -534,8 +699,8 @@ class AWSConnector():
 
                 shard_iterator = shard_iterator_response['ShardIterator']
                 response = kinesis_client.get_records(ShardIterator=shard_iterator )
-                records = response['Records']
-                return records
+                records.extend(response['Records'])
+            return records
         
         except NoCredentialsError as e:
             self.logger.error(e,exc_info=True)
@@ -547,13 +712,13 @@ class AWSConnector():
             self.logger.error(e,exc_info=True)
             return None
 
-    def read_from_s3(self,bucket,prefix,key):
+    def read_from_s3(self,bucket,prefix,key,decode=True):
         try:
             s3_client =  self.get_s3_client()
             object_key = f'{prefix}/{key}' if prefix else key
             response = s3_client.get_object(Bucket=bucket,Key=object_key )
-            data = response['Body'].read().decode('utf-8')
-            return data
+            data = response['Body'].read()
+            return data.decode('utf-8') if decode else data
         except s3_client.exceptions.NoSuchKey as e:
             self.logger.error(e,exc_info=True)
             return None
@@ -568,7 +733,32 @@ class AWSConnector():
             return None
     
     def get_s3_bucket_prefix_count(self,bucket,prefix):
-        pass
+        try:
+            s3_client =  self.get_s3_client()
+            paginator = s3_client.get_paginator('list_objects_v2')
+            return sum(len(page.get('Contents',[])) for page in paginator.paginate(Bucket=bucket,Prefix=prefix or ''))
+        except NoCredentialsError as e:
+            self.logger.error(e,exc_info=True)
+            return None
+        except PartialCredentialsError as e :
+            self.logger.error(e,exc_info=True)
+            return None
+        except Exception as e:
+            self.logger.error(e,exc_info=True)
+            return None
+
+    def get_lake_reader(self,lake_section=None):
+        lake_section = lake_section or {}
+        return LakeReader(self.logger,self.get_s3_client(),
+                          lake_section.get('bucket',self.section['firehose_s3_bucket']),
+                          lake_section.get('prefix',self.section['firehose_s3_prefix']),
+                          list_workers=int(lake_section.get('list_workers',8)),
+                          read_workers=int(lake_section.get('read_workers',4)),
+                          batch_size=int(lake_section.get('batch_size',65536)),
+                          min_range_bytes=int(lake_section.get('min_range_bytes',65536)),
+                          partition_slack_seconds=float(lake_section.get('partition_slack_seconds',900)),
+                          timestamp_column=lake_section.get('timestamp_column','Timestamp'),
+                          manifest_key=lake_section.get('manifest_key') or None)
     
     def write_to_s3(self,bucket,prefix,key,data):
         try:
@@ -3,28 +3,30 @@ from configparser import ConfigParser,ExtendedInterpolation
 from abc import ABC,abstractmethod
 from dataclasses import dataclass    
 from typing import Dict
+from utils.logging_pipeline import setup_logging,logging_configured
 
 class BaseComponent(ABC):
     logger = logging.getLogger(__name__)
 
     def __init__(self,config_file:str,section_name:str):
-        self._setup_logging()
+        self._setup_logging(config_file)
         self.config = self.read_config(config_file,section_name)
 
-    def _setup_logging(self):
-        self.logger.setLevel("INFO")
-        formatter = logging.Formatter("%(asctime)s - %(levelname)s- %(message)s",style='%')
-        handler = logging.FileHandler("crypto_stream.log",mode="w")
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+    def _setup_logging(self,config_file:str):
+        # one queue-backed pipeline per process; later components reuse it without re-reading the config file
+        if logging_configured():
+            return
+        config = ConfigParser(interpolation=ExtendedInterpolation())
+        config.read(config_file)
+        setup_logging(self.logger,dict(config['logging']) if config.has_section('logging') else None)
     
     def read_config(self,config_file:str,section_name:str) -> Dict :
         config = ConfigParser(interpolation=ExtendedInterpolation())
         config.read(config_file)
         try:
             return dict(config[section_name])
-        except ConfigParser.NoSectionError as error:
-            self.logger.error(error,exc_info=True) 
+        except KeyError as error:
+            self.logger.error(f'Section {error} not found in {config_file}')
 
     @abstractmethod
     def initialize(self):
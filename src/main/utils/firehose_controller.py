@@ -0,0 +1,193 @@
+import time
+import threading
+from datetime import datetime,timedelta,timezone
+from utils.metrics import get_registry
+
+FRESHNESS = get_registry().gauge('firehose_data_freshness_seconds','Age of the oldest record not yet delivered to S3',('stream',))
+BUFFER_SIZE = get_registry().gauge('firehose_buffer_size_mb','Current Firehose buffering size hint',('stream',))
+BUFFER_INTERVAL = get_registry().gauge('firehose_buffer_interval_seconds','Current Firehose buffering interval hint',('stream',))
+RETUNES = get_registry().counter('firehose_buffer_updates_total','Buffering hint updates applied by the delivery controller',('stream',))
+
+PARQUET_COMPRESSIONS = ('UNCOMPRESSED','GZIP','SNAPPY')
+# Firehose limits; format conversion raises the minimum buffer size to 64 MB
+MIN_SIZE_MB,MAX_SIZE_MB,CONVERSION_MIN_SIZE_MB = 1,128,64
+MIN_INTERVAL_SECONDS,MAX_INTERVAL_SECONDS = 0,900
+
+# query id -> (metric name, statistic); a stream sourced from Kinesis reports its intake as DataReadFromKinesisStream,
+# the IncomingBytes/IncomingRecords pair is only published for Direct PUT
+DELIVERY_METRICS = {
+    'incoming_bytes':('DataReadFromKinesisStream.Bytes','Sum'),
+    'incoming_records':('DataReadFromKinesisStream.Records','Sum'),
+    'delivery_success':('DeliveryToS3.Success','Average'),
+    'delivered_records':('DeliveryToS3.Records','Sum'),
+    'delivered_bytes':('DeliveryToS3.Bytes','Sum'),
+    'data_freshness':('DeliveryToS3.DataFreshness','Maximum')
+}
+
+
+def _clamp(value,low,high):
+    return max(low,min(high,value))
+
+
+class FirehoseDeliveryController():
+    def __init__(self,logger,firehose_client,cloudwatch_client,stream,buffer_size_mb=64,buffer_interval_seconds=30,
+                 compression='GZIP',format_conversion=True,target_file_size_mb=128,target_freshness_seconds=600,
+                 metrics_period_seconds=60,metrics_window_seconds=900,tune_interval_seconds=300,min_change_ratio=0.1,
+                 drain_timeout_seconds=900,drain_poll_seconds=30):
+        compression = compression.upper()
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(f'Unsupported Firehose Parquet compression {compression}')
+        self.logger = logger
+        self.firehose_client = firehose_client
+        self.cloudwatch_client = cloudwatch_client
+        self.stream = stream
+        self.compression = compression
+        self.min_size_mb = CONVERSION_MIN_SIZE_MB if format_conversion else MIN_SIZE_MB
+        self.buffer_size_mb = int(_clamp(buffer_size_mb,self.min_size_mb,MAX_SIZE_MB))
+        self.buffer_interval_seconds = int(_clamp(buffer_interval_seconds,MIN_INTERVAL_SECONDS,MAX_INTERVAL_SECONDS))
+        self.target_file_size_mb = target_file_size_mb
+        self.target_freshness_seconds = target_freshness_seconds
+        self.metrics_period_seconds = metrics_period_seconds
+        self.metrics_window_seconds = metrics_window_seconds
+        self.tune_interval_seconds = tune_interval_seconds
+        self.min_change_ratio = min_change_ratio
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.drain_poll_seconds = drain_poll_seconds
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def buffering_hints(self):
+        return {'SizeInMBs':self.buffer_size_mb,'IntervalInSeconds':self.buffer_interval_seconds}
+
+    def output_format(self):
+        return {'Serializer':{'ParquetSerDe':{'Compression':self.compression}}}
+
+    def fetch_metrics(self,start_time,end_time=None,period=None):
+        end_time = end_time or datetime.now(timezone.utc)
+        period = period or self.metrics_period_seconds
+        queries = [{
+            'Id':query_id,
+            'MetricStat':{
+                'Metric':{'Namespace':'AWS/Firehose','MetricName':metric_name,
+                          'Dimensions':[{'Name':'DeliveryStreamName','Value':self.stream}]},
+                'Period':period,
+                'Stat':statistic
+            },
+            'ReturnData':True
+        } for query_id,(metric_name,statistic) in DELIVERY_METRICS.items()]
+        # one batched call per page covers every delivery metric
+        series = {query_id:[] for query_id in DELIVERY_METRICS}
+        request = {'MetricDataQueries':queries,'StartTime':start_time,'EndTime':end_time,'ScanBy':'TimestampAscending'}
+        while True:
+            response = self.cloudwatch_client.get_metric_data(**request)
+            for result in response['MetricDataResults']:
+                series[result['Id']].extend(zip(result['Timestamps'],result['Values']))
+            if not response.get('NextToken'):
+                return series
+            request['NextToken'] = response['NextToken']
+
+    def summarize(self,series,window_seconds):
+        incoming_bytes = sum(value for _,value in series['incoming_bytes'])
+        freshness = [value for _,value in series['data_freshness']]
+        success = [value for _,value in series['delivery_success']]
+        return {
+            'incoming_bytes':incoming_bytes,
+            'incoming_records':sum(value for _,value in series['incoming_records']),
+            'delivered_records':sum(value for _,value in series['delivered_records']),
+            'delivered_bytes':sum(value for _,value in series['delivered_bytes']),
+            'incoming_bytes_per_second':incoming_bytes / window_seconds if window_seconds else 0.0,
+            'max_freshness_seconds':max(freshness) if freshness else None,
+            'success_ratio':sum(success) / len(success) if success else None
+        }
+
+    def recommend(self,summary):
+        size_mb,interval = self.buffer_size_mb,self.buffer_interval_seconds
+        rate = summary['incoming_bytes_per_second']
+        if rate > 0:
+            # a file closes on whichever hint is hit first, so size the interval to fill the target file
+            target_bytes = self.target_file_size_mb * 1024 * 1024
+            size_mb = int(_clamp(self.target_file_size_mb,self.min_size_mb,MAX_SIZE_MB))
+            interval = _clamp(target_bytes / rate,MIN_INTERVAL_SECONDS,min(MAX_INTERVAL_SECONDS,self.target_freshness_seconds))
+        freshness = summary['max_freshness_seconds']
+        if freshness and freshness > self.target_freshness_seconds:
+            interval = min(interval,self.buffer_interval_seconds * self.target_freshness_seconds / freshness)
+        interval = int(_clamp(interval,MIN_INTERVAL_SECONDS,MAX_INTERVAL_SECONDS))
+        return size_mb,interval
+
+    def _significant(self,size_mb,interval):
+        return (abs(size_mb - self.buffer_size_mb) / self.buffer_size_mb > self.min_change_ratio or
+                abs(interval - self.buffer_interval_seconds) / max(self.buffer_interval_seconds,1) > self.min_change_ratio)
+
+    def apply(self,size_mb,interval):
+        description = self.firehose_client.describe_delivery_stream(DeliveryStreamName=self.stream)['DeliveryStreamDescription']
+        self.firehose_client.update_destination(
+            DeliveryStreamName=self.stream,
+            CurrentDeliveryStreamVersionId=description['VersionId'],
+            DestinationId=description['Destinations'][0]['DestinationId'],
+            ExtendedS3DestinationUpdate={'BufferingHints':{'SizeInMBs':size_mb,'IntervalInSeconds':interval}}
+        )
+        self.logger.info(f'Firehose {self.stream} buffering hints updated from {self.buffer_size_mb} MB/{self.buffer_interval_seconds}s '
+                         f'to {size_mb} MB/{interval}s')
+        self.buffer_size_mb,self.buffer_interval_seconds = size_mb,interval
+        RETUNES.inc(stream=self.stream)
+
+    def tune_once(self):
+        end_time = datetime.now(timezone.utc)
+        series = self.fetch_metrics(end_time - timedelta(seconds=self.metrics_window_seconds),end_time)
+        summary = self.summarize(series,self.metrics_window_seconds)
+        if summary['max_freshness_seconds'] is not None:
+            FRESHNESS.set(summary['max_freshness_seconds'],stream=self.stream)
+        if summary['success_ratio'] is not None and summary['success_ratio'] < 1:
+            self.logger.warning(f'Firehose {self.stream} S3 delivery success ratio {summary["success_ratio"]:.2f}')
+        size_mb,interval = self.recommend(summary)
+        if self._significant(size_mb,interval):
+            self.apply(size_mb,interval)
+        BUFFER_SIZE.set(self.buffer_size_mb,stream=self.stream)
+        BUFFER_INTERVAL.set(self.buffer_interval_seconds,stream=self.stream)
+        return summary
+
+    def _run(self):
+        while not self.stop_event.wait(self.tune_interval_seconds):
+            try:
+                self.tune_once()
+            except Exception as e:
+                self.logger.error(e,exc_info=True)
+
+    def start(self):
+        if self.thread:
+            return self
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run,name='firehose-controller',daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def wait_for_drain(self,since,expected_records=None):
+        # drained once every record Firehose took in has been delivered and the intake has stopped growing.
+        # CloudWatch trails by minutes, so the writer's own count is the floor: zero means there is nothing to wait for,
+        # and metrics still reading zero right after the last write never count as drained
+        if expected_records == 0:
+            self.logger.info(f'Firehose {self.stream} drain check skipped: no records were written to its source stream')
+            return True
+        deadline = time.monotonic() + self.drain_timeout_seconds
+        since = since if since.tzinfo else since.astimezone(timezone.utc)
+        previous_incoming = None
+        while True:
+            end_time = datetime.now(timezone.utc)
+            summary = self.summarize(self.fetch_metrics(since,end_time),(end_time - since).total_seconds())
+            incoming,delivered = summary['incoming_records'],summary['delivered_records']
+            self.logger.info(f'Firehose {self.stream} drain check: {delivered:.0f}/{incoming:.0f} records delivered'
+                             + (f', {expected_records} written' if expected_records is not None else ''))
+            if delivered >= max(incoming,expected_records or 0) and incoming == previous_incoming:
+                return True
+            if time.monotonic() >= deadline:
+                self.logger.warning(f'Firehose {self.stream} not drained after {self.drain_timeout_seconds}s: '
+                                    f'{incoming - delivered:.0f} records outstanding')
+                return False
+            previous_incoming = incoming
+            time.sleep(self.drain_poll_seconds)
@@ -0,0 +1,118 @@
+import json
+import hashlib
+from utils.serializers import ASSET_STRING_FIELDS,ASSET_INT_FIELDS,ASSET_FLOAT_FIELDS
+
+PARQUET_INPUT_FORMAT = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat'
+PARQUET_OUTPUT_FORMAT = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat'
+PARQUET_SERDE = 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'
+
+
+def asset_columns():
+    # same field set the serializers encode, typed so Parquet conversion keeps numbers as numbers
+    columns = [{'Name':name,'Type':'string'} for name in ASSET_STRING_FIELDS]
+    columns += [{'Name':name,'Type':'int'} for name in ASSET_INT_FIELDS]
+    columns += [{'Name':name,'Type':'double'} for name in ASSET_FLOAT_FIELDS]
+    columns.append({'Name':'Timestamp','Type':'bigint'})
+    return columns
+
+
+def schema_fingerprint(columns,partition_keys):
+    document = json.dumps([[(column['Name'].lower(),column['Type']) for column in group] for group in (columns,partition_keys)])
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()[:16]
+
+
+def _table_input(name,location,columns,partition_keys,projection,description):
+    parameters = {
+        'classification':'parquet',
+        'EXTERNAL':'TRUE',
+        'projection.enabled':'true',
+        'schema_fingerprint':schema_fingerprint(columns,partition_keys)
+    } | projection
+    return {
+        'Name':name,
+        'Description':description,
+        'TableType':'EXTERNAL_TABLE',
+        'Parameters':parameters,
+        'PartitionKeys':partition_keys,
+        'StorageDescriptor':{
+            'Columns':columns,
+            'Location':location,
+            'InputFormat':PARQUET_INPUT_FORMAT,
+            'OutputFormat':PARQUET_OUTPUT_FORMAT,
+            'SerdeInfo':{'SerializationLibrary':PARQUET_SERDE,'Parameters':{'serialization.format':'1'}}
+        }
+    }
+
+
+def raw_table_input(name,bucket,prefix,projection_start='2024/01/01'):
+    # Firehose writes under prefix/yyyy/MM/dd, so one projected date key covers the layout without crawlers
+    location = f's3://{bucket}/{prefix.strip("/")}/'
+    projection = {
+        'projection.dt.type':'date',
+        'projection.dt.format':'yyyy/MM/dd',
+        'projection.dt.range':f'{projection_start},NOW',
+        'projection.dt.interval':'1',
+        'projection.dt.interval.unit':'DAYS',
+        'storage.location.template':location + '${dt}/'
+    }
+    return _table_input(name,location,asset_columns(),[{'Name':'dt','Type':'string'}],projection,
+                        'CoinCap asset snapshots delivered by Firehose')
+
+
+def compacted_table_input(name,bucket,prefix,asset_buckets,projection_start='2024-01-01'):
+    location = f's3://{bucket}/{prefix.strip("/")}/'
+    projection = {
+        'projection.date.type':'date',
+        'projection.date.format':'yyyy-MM-dd',
+        'projection.date.range':f'{projection_start},NOW',
+        'projection.date.interval':'1',
+        'projection.date.interval.unit':'DAYS',
+        'projection.hour.type':'integer',
+        'projection.hour.range':'0,23',
+        'projection.hour.digits':'2',
+        'projection.asset_bucket.type':'integer',
+        'projection.asset_bucket.range':f'0,{asset_buckets - 1}',
+        'storage.location.template':location + 'date=${date}/hour=${hour}/asset_bucket=${asset_bucket}/'
+    }
+    partition_keys = [{'Name':'date','Type':'string'},{'Name':'hour','Type':'string'},{'Name':'asset_bucket','Type':'int'}]
+    return _table_input(name,location,asset_columns(),partition_keys,projection,
+                        'CoinCap asset snapshots compacted by hour and asset bucket')
+
+
+def _same_partition_keys(current,desired):
+    return ([(key['Name'].lower(),key['Type']) for key in current.get('PartitionKeys',[])] ==
+            [(key['Name'].lower(),key['Type']) for key in desired['PartitionKeys']])
+
+
+def evolve_table_input(current,desired):
+    # a different partition layout is a new table definition, which also replaces the old single Data struct column
+    if not _same_partition_keys(current,desired):
+        return desired
+    # otherwise columns are only added or retyped, never dropped, so files written under older versions stay readable
+    current_columns = current.get('StorageDescriptor',{}).get('Columns',[])
+    desired_types = {column['Name'].lower():column for column in desired['StorageDescriptor']['Columns']}
+    columns = [desired_types.get(column['Name'].lower(),column) for column in current_columns]
+    known = {column['Name'].lower() for column in current_columns}
+    columns += [column for column in desired['StorageDescriptor']['Columns'] if column['Name'].lower() not in known]
+    evolved = dict(desired)
+    evolved['StorageDescriptor'] = dict(desired['StorageDescriptor'],Columns=columns)
+    evolved['Parameters'] = dict(desired['Parameters'],schema_fingerprint=schema_fingerprint(columns,desired['PartitionKeys']))
+    return evolved
+
+
+def table_changes(current,desired):
+    changes = [] if _same_partition_keys(current,desired) else ['set partition keys']
+    current_columns = {column['Name'].lower():column['Type'] for column in current.get('StorageDescriptor',{}).get('Columns',[])}
+    for column in desired['StorageDescriptor']['Columns']:
+        current_type = current_columns.get(column['Name'].lower())
+        if current_type is None:
+            changes.append(f'add {column["Name"]} {column["Type"]}')
+        elif current_type != column['Type']:
+            changes.append(f'retype {column["Name"]} {current_type} -> {column["Type"]}')
+    current_parameters = current.get('Parameters',{})
+    for key,value in desired['Parameters'].items():
+        if key != 'schema_fingerprint' and current_parameters.get(key) != value:
+            changes.append(f'set {key}')
+    if current.get('StorageDescriptor',{}).get('Location') != desired['StorageDescriptor']['Location']:
+        changes.append('set location')
+    return changes
@@ -0,0 +1,144 @@
+import time
+import threading
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass,field
+from typing import Dict,List,Optional
+from utils.metrics import get_registry,COUNT_BUCKETS,BYTES_BUCKETS
+
+KINESIS_MAX_RECORDS_PER_CALL = 500
+KINESIS_MAX_BYTES_PER_CALL = 5 * 1024 * 1024
+KINESIS_MAX_BYTES_PER_RECORD = 1024 * 1024
+
+BATCH_RECORDS = get_registry().histogram('kinesis_batch_records','Records per put_records batch',('stream',),COUNT_BUCKETS)
+BATCH_BYTES = get_registry().histogram('kinesis_batch_bytes','Bytes per put_records batch',('stream',),BYTES_BUCKETS)
+BATCH_LATENCY = get_registry().histogram('kinesis_batch_latency_seconds','put_records latency per batch including retries',('stream',))
+RECORDS_WRITTEN = get_registry().counter('kinesis_records_written_total','Records accepted by put_records',('stream',))
+RECORDS_FAILED = get_registry().counter('kinesis_records_failed_total','Records still failing after retries',('stream',))
+RETRIES = get_registry().counter('kinesis_put_retries_total','put_records retry attempts',('stream',))
+THROTTLES = get_registry().counter('kinesis_write_throttles_total','Records rejected by put_records',('stream','shard','error_code'))
+
+
+@dataclass
+class BatchResult:
+    record_count: int
+    byte_count: int
+    latency_seconds: float = 0.0
+    retries: int = 0
+    failed_records: List[Dict] = field(default_factory=list)
+    # set when put_records raised, in which case every record of the batch is in failed_records
+    error: Optional[Exception] = None
+
+
+class KinesisBatchWriter():
+    def __init__(self,logger,kinesis_client,stream,max_records=KINESIS_MAX_RECORDS_PER_CALL,
+                 max_bytes=KINESIS_MAX_BYTES_PER_CALL,max_workers=4,max_retries=5,base_delay=0.1,max_delay=5.0,shard_resolver=None):
+        self.logger = logger
+        # maps a record to its shard id so throttles can be counted per shard
+        self.shard_resolver = shard_resolver
+        self.kinesis_client = kinesis_client
+        self.stream = stream
+        self.max_records = min(max_records,KINESIS_MAX_RECORDS_PER_CALL)
+        self.max_bytes = min(max_bytes,KINESIS_MAX_BYTES_PER_CALL)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def record_size(record):
+        # Kinesis counts the partition key towards both the record and the call limit
+        return len(record['Data']) + len(record['PartitionKey'].encode('utf-8'))
+
+    def make_batches(self,records):
+        # returns the batches to send and the records Kinesis would reject outright for their size
+        batches,oversized = [],[]
+        batch,batch_bytes = [],0
+        for record in records:
+            size = self.record_size(record)
+            if size > KINESIS_MAX_BYTES_PER_RECORD:
+                self.logger.error(f'Record for partition key {record["PartitionKey"]} is {size} bytes, exceeding the Kinesis record limit')
+                oversized.append(record)
+                continue
+            if batch and (len(batch) >= self.max_records or batch_bytes + size > self.max_bytes):
+                batches.append(batch)
+                batch,batch_bytes = [],0
+            batch.append(record)
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches,oversized
+
+    def _backoff(self,attempt):
+        # full jitter keeps concurrent batches from retrying in lockstep
+        return random.uniform(0,min(self.max_delay,self.base_delay * (2 ** attempt)))
+
+    def _send_batch(self,batch):
+        result = BatchResult(record_count=len(batch),byte_count=sum(self.record_size(record) for record in batch))
+        start = time.perf_counter()
+        pending = batch
+        attempt = 0
+        while True:
+            try:
+                response = self.kinesis_client.put_records(StreamName=self.stream,Records=pending)
+            except Exception as e:
+                # a failed call fails only its own batch; the other batches' results still reach the caller
+                self.logger.error(f'put_records to {self.stream} failed for {len(pending)} records: {e}')
+                result.error = e
+                break
+            if not response.get('FailedRecordCount'):
+                pending = []
+                break
+            failed = [(record,entry['ErrorCode']) for record,entry in zip(pending,response['Records']) if 'ErrorCode' in entry]
+            for record,error_code in failed:
+                THROTTLES.inc(stream=self.stream,shard=self.shard_resolver(record) if self.shard_resolver else '',error_code=error_code)
+            pending = [record for record,_ in failed]
+            if attempt >= self.max_retries:
+                break
+            delay = self._backoff(attempt)
+            attempt += 1
+            self.logger.info(f'{len(pending)} of {result.record_count} records throttled on {self.stream}. Retry {attempt} in {delay:.3f}s')
+            time.sleep(delay)
+        result.retries = attempt
+        result.failed_records = pending
+        result.latency_seconds = time.perf_counter() - start
+        BATCH_RECORDS.observe(result.record_count,stream=self.stream)
+        BATCH_BYTES.observe(result.byte_count,stream=self.stream)
+        BATCH_LATENCY.observe(result.latency_seconds,stream=self.stream)
+        RECORDS_WRITTEN.inc(result.record_count - len(pending),stream=self.stream)
+        if pending:
+            RECORDS_FAILED.inc(len(pending),stream=self.stream)
+        if attempt:
+            RETRIES.inc(attempt,stream=self.stream)
+        return result
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,thread_name_prefix=f'put-records-{self.stream}')
+        return self._executor
+
+    def write(self,records):
+        batches,oversized = self.make_batches(records)
+        results = []
+        if len(batches) == 1 or self.max_workers <= 1:
+            results = [self._send_batch(batch) for batch in batches]
+        elif batches:
+            results = list(self._get_executor().map(self._send_batch,batches))
+        if oversized:
+            RECORDS_FAILED.inc(len(oversized),stream=self.stream)
+            results.append(BatchResult(record_count=len(oversized),byte_count=sum(self.record_size(record) for record in oversized),
+                                       failed_records=oversized))
+        for index,result in enumerate(results):
+            self.logger.debug(f'Batch {index} to {self.stream}: records={result.record_count} bytes={result.byte_count} '
+                              f'latency={result.latency_seconds * 1000:.1f}ms retries={result.retries} failed={len(result.failed_records)}')
+        return results
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,75 @@
+import math
+import time
+import sqlite3
+import threading
+
+
+class LeaseStore():
+    # shard leases shared by worker processes through one SQLite file; a lease nobody renews expires and can be taken over
+    def __init__(self,db_path,timeout_seconds=30):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path,timeout=timeout_seconds,check_same_thread=False,isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS leases (
+                                    role TEXT NOT NULL,
+                                    resource TEXT NOT NULL,
+                                    owner TEXT,
+                                    expires_at REAL NOT NULL DEFAULT 0,
+                                    active INTEGER NOT NULL DEFAULT 1,
+                                    PRIMARY KEY (role,resource))''')
+
+    def _transaction(self,statements):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot claim the same expired lease
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(cursor)
+                cursor.execute('COMMIT')
+                return result
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def sync_resources(self,role,resources):
+        def statements(cursor):
+            cursor.execute('UPDATE leases SET active=0 WHERE role=?',(role,))
+            cursor.executemany('''INSERT INTO leases (role,resource) VALUES (?,?)
+                                  ON CONFLICT(role,resource) DO UPDATE SET active=1''',[(role,resource) for resource in resources])
+        self._transaction(statements)
+
+    def balance(self,role,owner,workers,ttl_seconds):
+        # renews what this owner holds, then claims free leases or releases surplus to reach an even share
+        def statements(cursor):
+            now = time.time()
+            cursor.execute('UPDATE leases SET owner=NULL,expires_at=0 WHERE role=? AND owner=? AND active=0',(role,owner))
+            resources = [row[0] for row in cursor.execute('SELECT resource FROM leases WHERE role=? AND active=1 ORDER BY resource',(role,))]
+            share = math.ceil(len(resources) / max(1,workers))
+            held = [row[0] for row in cursor.execute('''SELECT resource FROM leases WHERE role=? AND active=1 AND owner=? AND expires_at>?
+                                                        ORDER BY resource''',(role,owner,now))]
+            released = held[share:]
+            held = held[:share]
+            cursor.executemany('UPDATE leases SET owner=NULL,expires_at=0 WHERE role=? AND resource=? AND owner=?',
+                               [(role,resource,owner) for resource in released])
+            if len(held) < share:
+                free = [row[0] for row in cursor.execute('''SELECT resource FROM leases WHERE role=? AND active=1
+                                                            AND (owner IS NULL OR expires_at<=?) ORDER BY resource''',(role,now))]
+                held += free[:share - len(held)]
+            cursor.executemany('UPDATE leases SET owner=?,expires_at=? WHERE role=? AND resource=?',
+                               [(owner,now + ttl_seconds,role,resource) for resource in held])
+            return set(held)
+        return self._transaction(statements)
+
+    def release(self,role,owner):
+        self._transaction(lambda cursor:cursor.execute('UPDATE leases SET owner=NULL,expires_at=0 WHERE role=? AND owner=?',(role,owner)))
+
+    def holders(self,role):
+        with self._lock:
+            rows = self._connection.execute('''SELECT resource,owner,expires_at FROM leases WHERE role=? AND active=1
+                                               ORDER BY resource''',(role,)).fetchall()
+        now = time.time()
+        return {resource:owner if owner and expires_at > now else None for resource,owner,expires_at in rows}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,756 @@
+import io
+import re
+import time
+import uuid
+import hashlib
+import threading
+import itertools
+from bisect import bisect_left,bisect_right
+from types import SimpleNamespace
+from datetime import datetime,timezone
+from botocore.exceptions import ClientError
+
+KINESIS_HASH_KEY_SPACE = 2 ** 128
+# per shard service limits
+SHARD_WRITE_RECORDS_PER_SECOND = 1000
+SHARD_WRITE_BYTES_PER_SECOND = 1024 * 1024
+SHARD_READ_CALLS_PER_SECOND = 5
+SHARD_READ_BYTES_PER_SECOND = 2 * 1024 * 1024
+SHARD_ITERATOR_TTL_SECONDS = 300
+FIREHOSE_TIMESTAMP_PATTERN = re.compile(r'!\{timestamp:([^}]*)\}')
+FIREHOSE_TIMESTAMP_TOKENS = (('yyyy','%Y'),('MM','%m'),('dd','%d'),('HH','%H'))
+
+
+class TokenBucket():
+    # holds one second of capacity; consume may overdraw so a large read throttles the calls after it
+    def __init__(self,rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate,self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def consume(self,amount):
+        self._refill()
+        self.tokens -= amount
+
+
+class _Exceptions():
+    # mirrors client.exceptions: every error code is a ClientError subclass created on first use
+    def __init__(self):
+        self._classes = {}
+
+    def __getattr__(self,code):
+        if code.startswith('_'):
+            raise AttributeError(code)
+        if code not in self._classes:
+            self._classes[code] = type(code,(ClientError,),{})
+        return self._classes[code]
+
+    def error(self,code,operation,message):
+        return getattr(self,code)({'Error':{'Code':code,'Message':message}},operation)
+
+
+class _Paginator():
+    def __init__(self,method,input_token,output_token):
+        self.method = method
+        self.input_token = input_token
+        self.output_token = output_token
+
+    def paginate(self,**kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            token = page.get(self.output_token)
+            if not token:
+                return
+            kwargs = kwargs | {self.input_token:token}
+
+
+class _Waiter():
+    def __init__(self,check):
+        self.check = check
+        self.config = SimpleNamespace(delay=0,max_attempts=1,retry_function=None)
+
+    def wait(self,**kwargs):
+        for _ in range(max(int(self.config.max_attempts),1)):
+            if self.check(**kwargs):
+                return
+            time.sleep(float(self.config.delay))
+        raise RuntimeError(f'Waiter gave up after {self.config.max_attempts} attempts')
+
+
+class _Shard():
+    def __init__(self,shard_id,starting_hash_key,ending_hash_key,starting_sequence_number,limits,parent_shard_id=None):
+        self.shard_id = shard_id
+        self.starting_hash_key = starting_hash_key
+        self.ending_hash_key = ending_hash_key
+        self.starting_sequence_number = starting_sequence_number
+        self.parent_shard_id = parent_shard_id
+        # set when the shard is split; a closed shard keeps its records but takes no new writes
+        self.ending_sequence_number = None
+        self.records = []
+        self.sequence_numbers = []
+        self.write_records,self.write_bytes,self.read_calls,self.read_bytes = [TokenBucket(rate) for rate in limits]
+
+    def describe(self):
+        description = {'ShardId':self.shard_id,
+                       'HashKeyRange':{'StartingHashKey':str(self.starting_hash_key),'EndingHashKey':str(self.ending_hash_key)},
+                       'SequenceNumberRange':{'StartingSequenceNumber':str(self.starting_sequence_number)}}
+        if self.parent_shard_id:
+            description['ParentShardId'] = self.parent_shard_id
+        if self.ending_sequence_number is not None:
+            description['SequenceNumberRange']['EndingSequenceNumber'] = str(self.ending_sequence_number)
+        return description
+
+
+class LocalAWS():
+    def __init__(self,account_id='000000000000',region='us-east-1',write_records_per_second=SHARD_WRITE_RECORDS_PER_SECOND,
+                 write_bytes_per_second=SHARD_WRITE_BYTES_PER_SECOND,read_calls_per_second=SHARD_READ_CALLS_PER_SECOND,
+                 read_bytes_per_second=SHARD_READ_BYTES_PER_SECOND,request_latency_seconds=0.0):
+        self.account_id = account_id
+        self.region = region
+        self.limits = (write_records_per_second,write_bytes_per_second,read_calls_per_second,read_bytes_per_second)
+        self.request_latency_seconds = request_latency_seconds
+        self.lock = threading.RLock()
+        self.sequence = itertools.count(49000000000000000000000000000000000000000000000000000000)
+        self.streams = {}
+        self.iterators = {}
+        self.delivery_streams = {}
+        self.buckets = {}
+        self.metrics = []
+        self.roles = {}
+        self.policies = {}
+        self.databases = {}
+        self.log_groups = {}
+
+    def client(self,service,config=None,**kwargs):
+        clients = {'kinesis':LocalKinesis,'firehose':LocalFirehose,'s3':LocalS3,'sts':LocalSTS,'iam':LocalIAM,
+                   'glue':LocalGlue,'logs':LocalLogs,'cloudwatch':LocalCloudWatch}
+        if service not in clients:
+            raise ValueError(f'Service {service} is not available in the local AWS backend')
+        return clients[service](self)
+
+    def put_metric(self,namespace,name,dimensions,value,unit):
+        self.metrics.append((namespace,name,tuple(sorted(dimensions.items())),datetime.now(timezone.utc),value,unit))
+
+    def flush_delivery_streams(self,force=False):
+        with self.lock:
+            for delivery_stream in self.delivery_streams.values():
+                delivery_stream.flush(force)
+
+
+class LocalSession():
+    # stands in for boto3.Session so AWSConnector.get_client works unchanged
+    def __init__(self,backend,region_name=None):
+        self.backend = backend
+        self.region_name = region_name
+
+    def client(self,service,config=None,**kwargs):
+        return self.backend.client(service,config=config,**kwargs)
+
+
+class _LocalClient():
+    def __init__(self,backend):
+        self.backend = backend
+        self.exceptions = _Exceptions()
+
+    def _call(self):
+        if self.backend.request_latency_seconds:
+            time.sleep(self.backend.request_latency_seconds)
+
+    def get_paginator(self,operation):
+        input_token,output_token = self.paginators[operation]
+        return _Paginator(getattr(self,operation),input_token,output_token)
+
+
+class LocalSTS(_LocalClient):
+    def get_caller_identity(self):
+        self._call()
+        return {'Account':self.backend.account_id,'Arn':f'arn:aws:iam::{self.backend.account_id}:user/local','UserId':'local'}
+
+
+class LocalKinesis(_LocalClient):
+    paginators = {'list_shards':('NextToken','NextToken')}
+
+    def _stream(self,operation,name):
+        stream = self.backend.streams.get(name)
+        if stream is None:
+            raise self.exceptions.error('ResourceNotFoundException',operation,f'Stream {name} not found')
+        return stream
+
+    def _shard(self,operation,stream,shard_id):
+        for shard in stream['shards']:
+            if shard.shard_id == shard_id:
+                return shard
+        raise self.exceptions.error('ResourceNotFoundException',operation,f'Shard {shard_id} not found')
+
+    def create_stream(self,StreamName,ShardCount=1,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if StreamName in self.backend.streams:
+                raise self.exceptions.error('ResourceInUseException','CreateStream',f'Stream {StreamName} already exists')
+            shards = []
+            width = KINESIS_HASH_KEY_SPACE // ShardCount
+            for index in range(ShardCount):
+                end = KINESIS_HASH_KEY_SPACE - 1 if index == ShardCount - 1 else (index + 1) * width - 1
+                shards.append(_Shard(f'shardId-{index:012d}',index * width,end,next(self.backend.sequence),self.backend.limits))
+            self.backend.streams[StreamName] = {
+                'name':StreamName,
+                'arn':f'arn:aws:kinesis:{self.backend.region}:{self.backend.account_id}:stream/{StreamName}',
+                'shards':shards,
+                'open':shards,
+                'starts':[shard.starting_hash_key for shard in shards]
+            }
+        return {}
+
+    def split_shard(self,StreamName,ShardToSplit,NewStartingHashKey,**kwargs):
+        self._call()
+        with self.backend.lock:
+            stream = self._stream('SplitShard',StreamName)
+            parent = self._shard('SplitShard',stream,ShardToSplit)
+            new_starting_hash_key = int(NewStartingHashKey)
+            if parent.ending_sequence_number is not None:
+                raise self.exceptions.error('ResourceInUseException','SplitShard',f'Shard {ShardToSplit} is already closed')
+            if not parent.starting_hash_key < new_starting_hash_key <= parent.ending_hash_key:
+                raise self.exceptions.error('InvalidArgumentException','SplitShard',f'NewStartingHashKey is outside {ShardToSplit}')
+            parent.ending_sequence_number = next(self.backend.sequence)
+            children = [_Shard(f'shardId-{len(stream["shards"]) + index:012d}',start,end,next(self.backend.sequence),self.backend.limits,ShardToSplit)
+                        for index,(start,end) in enumerate(((parent.starting_hash_key,new_starting_hash_key - 1),
+                                                            (new_starting_hash_key,parent.ending_hash_key)))]
+            stream['shards'] = stream['shards'] + children
+            stream['open'] = sorted((shard for shard in stream['shards'] if shard.ending_sequence_number is None),
+                                    key=lambda shard: shard.starting_hash_key)
+            stream['starts'] = [shard.starting_hash_key for shard in stream['open']]
+        return {}
+
+    def delete_stream(self,StreamName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self._stream('DeleteStream',StreamName)
+            del self.backend.streams[StreamName]
+        return {}
+
+    def describe_stream(self,StreamName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            stream = self._stream('DescribeStream',StreamName)
+            return {'StreamDescription':{'StreamName':StreamName,'StreamARN':stream['arn'],'StreamStatus':'ACTIVE',
+                                         'Shards':[shard.describe() for shard in stream['shards']],
+                                         'HasMoreShards':False,'RetentionPeriodHours':24}}
+
+    def list_shards(self,StreamName=None,NextToken=None,MaxResults=1000,**kwargs):
+        self._call()
+        with self.backend.lock:
+            # the token carries the stream name and offset, as StreamName is not sent with NextToken
+            if NextToken:
+                StreamName,offset = NextToken.rsplit(':',1)
+                offset = int(offset)
+            else:
+                offset = 0
+            shards = self._stream('ListShards',StreamName)['shards']
+            page = shards[offset:offset + MaxResults]
+            response = {'Shards':[shard.describe() for shard in page]}
+            if offset + MaxResults < len(shards):
+                response['NextToken'] = f'{StreamName}:{offset + MaxResults}'
+            return response
+
+    def get_waiter(self,name):
+        def stream_exists(StreamName,**kwargs):
+            return StreamName in self.backend.streams
+
+        def stream_not_exists(StreamName,**kwargs):
+            return StreamName not in self.backend.streams
+
+        return _Waiter({'stream_exists':stream_exists,'stream_not_exists':stream_not_exists}[name])
+
+    def put_records(self,StreamName,Records,**kwargs):
+        self._call()
+        if len(Records) > 500:
+            raise self.exceptions.error('InvalidArgumentException','PutRecords','Records has more than 500 entries')
+        if sum(len(record['Data']) + len(record['PartitionKey']) for record in Records) > 5 * 1024 * 1024:
+            raise self.exceptions.error('InvalidArgumentException','PutRecords','Request exceeds 5 MiB')
+        with self.backend.lock:
+            stream = self._stream('PutRecords',StreamName)
+            arrival = datetime.now(timezone.utc)
+            entries,accepted = [],[]
+            for record in Records:
+                explicit_hash_key = record.get('ExplicitHashKey')
+                hash_key = int(explicit_hash_key) if explicit_hash_key is not None else \
+                    int.from_bytes(hashlib.md5(record['PartitionKey'].encode('utf-8')).digest(),'big')
+                shard = stream['open'][bisect_right(stream['starts'],hash_key) - 1]
+                size = len(record['Data']) + len(record['PartitionKey'])
+                if shard.write_records.available() < 1 or shard.write_bytes.available() < size:
+                    entries.append({'ErrorCode':'ProvisionedThroughputExceededException',
+                                    'ErrorMessage':f'Rate exceeded for shard {shard.shard_id} in stream {StreamName}'})
+                    continue
+                shard.write_records.consume(1)
+                shard.write_bytes.consume(size)
+                sequence_number = next(self.backend.sequence)
+                stored = {'SequenceNumber':str(sequence_number),'ApproximateArrivalTimestamp':arrival,
+                          'Data':bytes(record['Data']),'PartitionKey':record['PartitionKey']}
+                shard.records.append(stored)
+                shard.sequence_numbers.append(sequence_number)
+                accepted.append(stored)
+                entries.append({'SequenceNumber':str(sequence_number),'ShardId':shard.shard_id})
+            for delivery_stream in self.backend.delivery_streams.values():
+                if delivery_stream.source_arn == stream['arn']:
+                    delivery_stream.receive(accepted)
+            failed = len(Records) - len(accepted)
+            return {'FailedRecordCount':failed,'Records':entries}
+
+    def get_shard_iterator(self,StreamName,ShardId,ShardIteratorType,StartingSequenceNumber=None,Timestamp=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            shard = self._shard('GetShardIterator',self._stream('GetShardIterator',StreamName),ShardId)
+            if ShardIteratorType == 'TRIM_HORIZON':
+                position = 0
+            elif ShardIteratorType == 'LATEST':
+                position = len(shard.records)
+            elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                position = bisect_left(shard.sequence_numbers,int(StartingSequenceNumber))
+            elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                position = bisect_right(shard.sequence_numbers,int(StartingSequenceNumber))
+            elif ShardIteratorType == 'AT_TIMESTAMP':
+                position = next((index for index,record in enumerate(shard.records) if record['ApproximateArrivalTimestamp'] >= Timestamp),
+                                len(shard.records))
+            else:
+                raise self.exceptions.error('InvalidArgumentException','GetShardIterator',f'Unknown iterator type {ShardIteratorType}')
+            return {'ShardIterator':self._new_iterator(StreamName,shard,position)}
+
+    def _new_iterator(self,stream_name,shard,position):
+        now = time.monotonic()
+        iterators = self.backend.iterators
+        # iterators are stored in creation order, so the expired ones are always at the front
+        while iterators:
+            oldest = next(iter(iterators))
+            if now - iterators[oldest][3] <= SHARD_ITERATOR_TTL_SECONDS:
+                break
+            del iterators[oldest]
+        # the creation time rides in the token so an evicted iterator still reads as expired rather than invalid
+        iterator = f'{uuid.uuid4().hex}-{now!r}'
+        iterators[iterator] = (stream_name,shard.shard_id,position,now)
+        return iterator
+
+    def get_records(self,ShardIterator,Limit=10000,**kwargs):
+        self._call()
+        with self.backend.lock:
+            state = self.backend.iterators.get(ShardIterator)
+            if state is None:
+                try:
+                    expired = time.monotonic() - float(ShardIterator.rpartition('-')[2]) > SHARD_ITERATOR_TTL_SECONDS
+                except ValueError:
+                    expired = False
+                if expired:
+                    raise self.exceptions.error('ExpiredIteratorException','GetRecords','Iterator expired')
+                raise self.exceptions.error('InvalidArgumentException','GetRecords','Invalid ShardIterator')
+            stream_name,shard_id,position,created = state
+            if time.monotonic() - created > SHARD_ITERATOR_TTL_SECONDS:
+                del self.backend.iterators[ShardIterator]
+                raise self.exceptions.error('ExpiredIteratorException','GetRecords','Iterator expired')
+            shard = self._shard('GetRecords',self._stream('GetRecords',stream_name),shard_id)
+            if shard.read_calls.available() < 1 or shard.read_bytes.available() <= 0:
+                raise self.exceptions.error('ProvisionedThroughputExceededException','GetRecords',
+                                            f'Rate exceeded for shard {shard_id} in stream {stream_name}')
+            shard.read_calls.consume(1)
+            # a throttled call leaves the iterator in place for the retry; a successful one hands out the next iterator
+            del self.backend.iterators[ShardIterator]
+            records = shard.records[position:position + min(Limit,10000)]
+            shard.read_bytes.consume(sum(len(record['Data']) for record in records))
+            position += len(records)
+            behind = 0
+            if position < len(shard.records):
+                behind = int((shard.records[-1]['ApproximateArrivalTimestamp'] - shard.records[position]['ApproximateArrivalTimestamp']).total_seconds() * 1000)
+            response = {'Records':records,'MillisBehindLatest':behind}
+            # a closed shard read to its end has no next iterator, which is how consumers learn to move on to its children
+            if shard.ending_sequence_number is None or position < len(shard.records):
+                response['NextShardIterator'] = self._new_iterator(stream_name,shard,position)
+            return response
+
+
+class _DeliveryStream():
+    def __init__(self,backend,name,source_arn,destination):
+        self.backend = backend
+        self.name = name
+        self.arn = f'arn:aws:firehose:{backend.region}:{backend.account_id}:deliverystream/{name}'
+        self.source_arn = source_arn
+        self.destination = destination
+        self.version = 1
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.buffer_started = None
+
+    def _hints(self):
+        hints = self.destination.get('BufferingHints',{})
+        return hints.get('SizeInMBs',5) * 1024 * 1024,hints.get('IntervalInSeconds',300)
+
+    def receive(self,records):
+        if not records:
+            return
+        incoming = sum(len(record['Data']) for record in records)
+        # records only arrive from a source stream, and Kinesis-sourced delivery streams never report IncomingRecords
+        self.backend.put_metric('AWS/Firehose','DataReadFromKinesisStream.Bytes',{'DeliveryStreamName':self.name},incoming,'Bytes')
+        self.backend.put_metric('AWS/Firehose','DataReadFromKinesisStream.Records',{'DeliveryStreamName':self.name},len(records),'Count')
+        if self.buffer_started is None:
+            self.buffer_started = time.monotonic()
+        self.buffer.extend(records)
+        self.buffer_bytes += incoming
+        self.flush()
+
+    def flush(self,force=False):
+        if not self.buffer:
+            return
+        size_limit,interval = self._hints()
+        age = time.monotonic() - self.buffer_started
+        if not force and self.buffer_bytes < size_limit and age < interval:
+            return
+        now = datetime.now(timezone.utc)
+
+        def expand(match):
+            pattern = match.group(1)
+            for token,directive in FIREHOSE_TIMESTAMP_TOKENS:
+                pattern = pattern.replace(token,directive)
+            return now.strftime(pattern)
+
+        prefix = FIREHOSE_TIMESTAMP_PATTERN.sub(expand,self.destination.get('Prefix',''))
+        bucket = self.destination['BucketARN'].split(':::',1)[1]
+        key = f'{prefix}/{self.name}-{self.version}-{now:%Y-%m-%d-%H-%M-%S}-{uuid.uuid4()}'
+        # format conversion is not emulated; objects hold the raw record payloads, one per line
+        body = b'\n'.join(record['Data'] for record in self.buffer)
+        self.backend.buckets.setdefault(bucket,{})[key] = (body,now)
+        oldest = min(record['ApproximateArrivalTimestamp'] for record in self.buffer)
+        dimensions = {'DeliveryStreamName':self.name}
+        self.backend.put_metric('AWS/Firehose','DeliveryToS3.Success',dimensions,1,'None')
+        self.backend.put_metric('AWS/Firehose','DeliveryToS3.Records',dimensions,len(self.buffer),'Count')
+        self.backend.put_metric('AWS/Firehose','DeliveryToS3.Bytes',dimensions,self.buffer_bytes,'Bytes')
+        self.backend.put_metric('AWS/Firehose','DeliveryToS3.DataFreshness',dimensions,(now - oldest).total_seconds(),'Seconds')
+        self.buffer,self.buffer_bytes,self.buffer_started = [],0,None
+
+
+class LocalFirehose(_LocalClient):
+    def _delivery_stream(self,operation,name):
+        self.backend.flush_delivery_streams()
+        delivery_stream = self.backend.delivery_streams.get(name)
+        if delivery_stream is None:
+            raise self.exceptions.error('ResourceNotFoundException',operation,f'Delivery stream {name} not found')
+        return delivery_stream
+
+    def create_delivery_stream(self,DeliveryStreamName,KinesisStreamSourceConfiguration=None,ExtendedS3DestinationConfiguration=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if DeliveryStreamName in self.backend.delivery_streams:
+                raise self.exceptions.error('ResourceInUseException','CreateDeliveryStream',f'Delivery stream {DeliveryStreamName} already exists')
+            source_arn = (KinesisStreamSourceConfiguration or {}).get('KinesisStreamARN')
+            self.backend.delivery_streams[DeliveryStreamName] = _DeliveryStream(self.backend,DeliveryStreamName,source_arn,
+                                                                                dict(ExtendedS3DestinationConfiguration or {}))
+            return {'DeliveryStreamARN':self.backend.delivery_streams[DeliveryStreamName].arn}
+
+    def describe_delivery_stream(self,DeliveryStreamName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            delivery_stream = self._delivery_stream('DescribeDeliveryStream',DeliveryStreamName)
+            return {'DeliveryStreamDescription':{
+                'DeliveryStreamName':DeliveryStreamName,
+                'DeliveryStreamARN':delivery_stream.arn,
+                'DeliveryStreamStatus':'ACTIVE',
+                'DeliveryStreamType':'KinesisStreamAsSource',
+                'VersionId':str(delivery_stream.version),
+                'Destinations':[{'DestinationId':'destinationId-000000000001',
+                                 'ExtendedS3DestinationDescription':dict(delivery_stream.destination)}],
+                'HasMoreDestinations':False}}
+
+    def update_destination(self,DeliveryStreamName,CurrentDeliveryStreamVersionId,DestinationId,ExtendedS3DestinationUpdate=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            delivery_stream = self._delivery_stream('UpdateDestination',DeliveryStreamName)
+            if str(CurrentDeliveryStreamVersionId) != str(delivery_stream.version):
+                raise self.exceptions.error('ConcurrentModificationException','UpdateDestination',
+                                            f'Version {CurrentDeliveryStreamVersionId} is not the current version {delivery_stream.version}')
+            # buffered records are delivered under the old configuration, as Firehose does
+            delivery_stream.flush(force=True)
+            delivery_stream.destination.update(ExtendedS3DestinationUpdate or {})
+            delivery_stream.version += 1
+        return {}
+
+    def delete_delivery_stream(self,DeliveryStreamName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self._delivery_stream('DeleteDeliveryStream',DeliveryStreamName).flush(force=True)
+            del self.backend.delivery_streams[DeliveryStreamName]
+        return {}
+
+
+class _Body():
+    def __init__(self,data):
+        self._stream = io.BytesIO(data)
+
+    def read(self,amount=None):
+        return self._stream.read(amount)
+
+    def close(self):
+        self._stream.close()
+
+
+class LocalS3(_LocalClient):
+    paginators = {'list_objects_v2':('ContinuationToken','NextContinuationToken')}
+
+    def _bucket(self,operation,name):
+        bucket = self.backend.buckets.get(name)
+        if bucket is None:
+            raise self.exceptions.error('NoSuchBucket',operation,f'Bucket {name} does not exist')
+        return bucket
+
+    def create_bucket(self,Bucket,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self.backend.buckets.setdefault(Bucket,{})
+        return {'Location':f'/{Bucket}'}
+
+    def head_bucket(self,Bucket,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if Bucket not in self.backend.buckets:
+                raise self.exceptions.error('404','HeadBucket','Not Found')
+        return {}
+
+    def put_object(self,Bucket,Key,Body=b'',**kwargs):
+        self._call()
+        if isinstance(Body,str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body,'read'):
+            Body = Body.read()
+        with self.backend.lock:
+            self._bucket('PutObject',Bucket)[Key] = (bytes(Body),datetime.now(timezone.utc))
+        return {'ETag':f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def get_object(self,Bucket,Key,Range=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self.backend.flush_delivery_streams()
+            entry = self._bucket('GetObject',Bucket).get(Key)
+        if entry is None:
+            raise self.exceptions.error('NoSuchKey','GetObject',f'Key {Key} does not exist')
+        data,last_modified = entry
+        size = len(data)
+        if Range:
+            start,end = Range.split('=',1)[1].split('-')
+            if not start:
+                start,end = max(size - int(end),0),size - 1
+            data = data[int(start):(int(end) + 1 if end else size)]
+        return {'Body':_Body(data),'ContentLength':len(data),'LastModified':last_modified,
+                'ETag':f'"{hashlib.md5(entry[0]).hexdigest()}"'}
+
+    def delete_object(self,Bucket,Key,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self._bucket('DeleteObject',Bucket).pop(Key,None)
+        return {}
+
+    def list_objects_v2(self,Bucket,Prefix='',Delimiter=None,MaxKeys=1000,ContinuationToken=None,StartAfter=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self.backend.flush_delivery_streams()
+            keys = sorted(key for key in self._bucket('ListObjectsV2',Bucket) if key.startswith(Prefix))
+            objects = self.backend.buckets[Bucket]
+        start_after = ContinuationToken or StartAfter
+        if start_after:
+            keys = keys[bisect_right(keys,start_after):]
+        contents,prefixes = [],[]
+        last_key = None
+        for key in keys:
+            if len(contents) + len(prefixes) >= MaxKeys:
+                break
+            last_key = key
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common_prefix = key[:len(Prefix) + key[len(Prefix):].index(Delimiter) + len(Delimiter)]
+                if common_prefix not in prefixes:
+                    prefixes.append(common_prefix)
+                continue
+            data,last_modified = objects[key]
+            contents.append({'Key':key,'Size':len(data),'LastModified':last_modified,'ETag':f'"{hashlib.md5(data).hexdigest()}"'})
+        truncated = last_key is not None and last_key != keys[-1]
+        response = {'Contents':contents,'KeyCount':len(contents) + len(prefixes),'IsTruncated':truncated,'Prefix':Prefix}
+        if prefixes:
+            response['CommonPrefixes'] = [{'Prefix':prefix} for prefix in prefixes]
+        if truncated:
+            response['NextContinuationToken'] = last_key
+        return response
+
+
+class LocalIAM(_LocalClient):
+    paginators = {'list_policies':('Marker','Marker'),'list_attached_role_policies':('Marker','Marker')}
+
+    def create_role(self,RoleName,AssumeRolePolicyDocument=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if RoleName in self.backend.roles:
+                raise self.exceptions.error('EntityAlreadyExistsException','CreateRole',f'Role {RoleName} already exists')
+            self.backend.roles[RoleName] = {'Arn':f'arn:aws:iam::{self.backend.account_id}:role/{RoleName}','RoleName':RoleName,'Policies':{}}
+            return {'Role':{key:value for key,value in self.backend.roles[RoleName].items() if key != 'Policies'}}
+
+    def get_role(self,RoleName,**kwargs):
+        self._call()
+        role = self.backend.roles.get(RoleName)
+        if role is None:
+            raise self.exceptions.error('NoSuchEntityException','GetRole',f'Role {RoleName} not found')
+        return {'Role':{'Arn':role['Arn'],'RoleName':RoleName}}
+
+    def create_policy(self,PolicyName,PolicyDocument=None,Description=None,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if PolicyName in self.backend.policies:
+                raise self.exceptions.error('EntityAlreadyExistsException','CreatePolicy',f'Policy {PolicyName} already exists')
+            self.backend.policies[PolicyName] = f'arn:aws:iam::{self.backend.account_id}:policy/{PolicyName}'
+            return {'Policy':{'PolicyName':PolicyName,'Arn':self.backend.policies[PolicyName]}}
+
+    def list_policies(self,Scope='All',OnlyAttached=False,**kwargs):
+        self._call()
+        return {'Policies':[{'PolicyName':name,'Arn':arn} for name,arn in self.backend.policies.items()],'IsTruncated':False}
+
+    def attach_role_policy(self,RoleName,PolicyArn,**kwargs):
+        self._call()
+        with self.backend.lock:
+            role = self.backend.roles.get(RoleName)
+            if role is None:
+                raise self.exceptions.error('NoSuchEntityException','AttachRolePolicy',f'Role {RoleName} not found')
+            role['Policies'][PolicyArn.rsplit('/',1)[1]] = PolicyArn
+        return {}
+
+    def list_attached_role_policies(self,RoleName,**kwargs):
+        self._call()
+        role = self.backend.roles.get(RoleName)
+        if role is None:
+            raise self.exceptions.error('NoSuchEntityException','ListAttachedRolePolicies',f'Role {RoleName} not found')
+        return {'AttachedPolicies':[{'PolicyName':name,'PolicyArn':arn} for name,arn in role['Policies'].items()],'IsTruncated':False}
+
+
+class LocalGlue(_LocalClient):
+    def create_database(self,DatabaseInput,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if DatabaseInput['Name'] in self.backend.databases:
+                raise self.exceptions.error('AlreadyExistsException','CreateDatabase',f'Database {DatabaseInput["Name"]} already exists')
+            self.backend.databases[DatabaseInput['Name']] = {}
+        return {}
+
+    def _database(self,operation,name):
+        database = self.backend.databases.get(name)
+        if database is None:
+            raise self.exceptions.error('EntityNotFoundException',operation,f'Database {name} not found')
+        return database
+
+    def create_table(self,DatabaseName,TableInput,**kwargs):
+        self._call()
+        with self.backend.lock:
+            database = self._database('CreateTable',DatabaseName)
+            if TableInput['Name'] in database:
+                raise self.exceptions.error('AlreadyExistsException','CreateTable',f'Table {TableInput["Name"]} already exists')
+            database[TableInput['Name']] = [dict(TableInput)]
+        return {}
+
+    def _versions(self,operation,DatabaseName,Name):
+        versions = self._database(operation,DatabaseName).get(Name)
+        if versions is None:
+            raise self.exceptions.error('EntityNotFoundException',operation,f'Table {Name} not found')
+        return versions
+
+    def get_table(self,DatabaseName,Name,**kwargs):
+        self._call()
+        versions = self._versions('GetTable',DatabaseName,Name)
+        return {'Table':versions[-1] | {'DatabaseName':DatabaseName,'VersionId':str(len(versions) - 1)}}
+
+    def update_table(self,DatabaseName,TableInput,**kwargs):
+        self._call()
+        with self.backend.lock:
+            self._versions('UpdateTable',DatabaseName,TableInput['Name']).append(dict(TableInput))
+        return {}
+
+    def get_table_versions(self,DatabaseName,TableName,**kwargs):
+        self._call()
+        versions = self._versions('GetTableVersions',DatabaseName,TableName)
+        return {'TableVersions':[{'Table':table | {'DatabaseName':DatabaseName,'VersionId':str(index)},'VersionId':str(index)}
+                                 for index,table in reversed(list(enumerate(versions)))]}
+
+
+class LocalLogs(_LocalClient):
+    def create_log_group(self,logGroupName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            if logGroupName in self.backend.log_groups:
+                raise self.exceptions.error('ResourceAlreadyExistsException','CreateLogGroup',f'Log group {logGroupName} already exists')
+            self.backend.log_groups[logGroupName] = set()
+        return {}
+
+    def create_log_stream(self,logGroupName,logStreamName,**kwargs):
+        self._call()
+        with self.backend.lock:
+            streams = self.backend.log_groups.get(logGroupName)
+            if streams is None:
+                raise self.exceptions.error('ResourceNotFoundException','CreateLogStream',f'Log group {logGroupName} not found')
+            if logStreamName in streams:
+                raise self.exceptions.error('ResourceAlreadyExistsException','CreateLogStream',f'Log stream {logStreamName} already exists')
+            streams.add(logStreamName)
+        return {}
+
+
+class LocalCloudWatch(_LocalClient):
+    def _statistics(self,Namespace,MetricName,StartTime,EndTime,Period,Dimensions):
+        dimensions = tuple(sorted((dimension['Name'],dimension['Value']) for dimension in Dimensions))
+        start,end = [value if value.tzinfo else value.astimezone(timezone.utc) for value in (StartTime,EndTime)]
+        buckets = {}
+        with self.backend.lock:
+            for namespace,name,metric_dimensions,timestamp,value,unit in self.backend.metrics:
+                if namespace == Namespace and name == MetricName and metric_dimensions == dimensions and start <= timestamp < end:
+                    bucket = start.timestamp() + (timestamp - start).total_seconds() // Period * Period
+                    buckets.setdefault(bucket,[]).append(value)
+        return [(datetime.fromtimestamp(bucket,timezone.utc),{'Sum':sum(values),'SampleCount':len(values),
+                                                              'Average':sum(values) / len(values),
+                                                              'Minimum':min(values),'Maximum':max(values)})
+                for bucket,values in sorted(buckets.items())]
+
+    def get_metric_statistics(self,Namespace,MetricName,StartTime,EndTime,Period,Statistics,Dimensions=(),Unit=None,**kwargs):
+        self._call()
+        self.backend.flush_delivery_streams()
+        datapoints = [{'Timestamp':timestamp,'Unit':Unit or 'None'} | {name:statistics[name] for name in Statistics}
+                      for timestamp,statistics in self._statistics(Namespace,MetricName,StartTime,EndTime,Period,Dimensions)]
+        return {'Label':MetricName,'Datapoints':datapoints}
+
+    def get_metric_data(self,MetricDataQueries,StartTime,EndTime,ScanBy='TimestampDescending',**kwargs):
+        self._call()
+        self.backend.flush_delivery_streams()
+        results = []
+        for query in MetricDataQueries:
+            metric_stat = query['MetricStat']
+            metric = metric_stat['Metric']
+            datapoints = self._statistics(metric['Namespace'],metric['MetricName'],StartTime,EndTime,metric_stat['Period'],
+                                          metric.get('Dimensions',()))
+            if ScanBy == 'TimestampDescending':
+                datapoints.reverse()
+            results.append({'Id':query['Id'],'Label':query.get('Label',metric['MetricName']),'StatusCode':'Complete',
+                            'Timestamps':[timestamp for timestamp,_ in datapoints],
+                            'Values':[statistics[metric_stat['Stat']] for _,statistics in datapoints]})
+        return {'MetricDataResults':results,'Messages':[]}
+
+
+_default_backend = None
+_default_backend_kwargs = None
+_default_backend_lock = threading.Lock()
+
+
+def get_local_backend(**kwargs):
+    # one emulator per process, so producer, consumer and readers built from separate connectors share state
+    global _default_backend,_default_backend_kwargs
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = LocalAWS(**kwargs)
+            _default_backend_kwargs = kwargs
+        elif kwargs != _default_backend_kwargs:
+            raise ValueError(f'The local AWS backend already runs with {_default_backend_kwargs}; it cannot be reopened with {kwargs}')
+        return _default_backend
@@ -0,0 +1,151 @@
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime,timezone
+from logging.handlers import QueueHandler,QueueListener,RotatingFileHandler
+
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('',0,'',0,'',(),None))) | {'message','asctime','sampled_out'}
+TEXT_FORMAT = '%(asctime)s - %(levelname)s- %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self,record):
+        entry = {
+            'ts':datetime.fromtimestamp(record.created,timezone.utc).isoformat(timespec='milliseconds'),
+            'level':record.levelname,
+            'logger':record.name,
+            'message':record.getMessage(),
+            'thread':record.threadName,
+            'module':record.module,
+            'line':record.lineno
+        }
+        if getattr(record,'sampled_out',0):
+            entry['sampled_out'] = record.sampled_out
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        # anything passed through extra= is kept as a structured field
+        entry.update({key:value for key,value in vars(record).items() if key not in STANDARD_ATTRIBUTES})
+        return json.dumps(entry,default=str)
+
+
+class RateSamplingFilter(logging.Filter):
+    # per call site token bucket for INFO and below; warnings and errors always pass
+    def __init__(self,rate_per_second=20,burst=50):
+        super().__init__()
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self,record):
+        if self.rate_per_second <= 0 or record.levelno > logging.INFO:
+            return True
+        key = (record.pathname,record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            tokens,updated,suppressed = self.sites.get(key,(self.burst,now,0))
+            tokens = min(self.burst,tokens + (now - updated) * self.rate_per_second)
+            if tokens < 1:
+                self.sites[key] = (tokens,now,suppressed + 1)
+                return False
+            self.sites[key] = (tokens - 1,now,0)
+        if suppressed:
+            record.sampled_out = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # a full queue drops the record instead of blocking the caller; drops are reported once space frees up
+    def __init__(self,log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self,record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self,record):
+        try:
+            if self.dropped:
+                dropped,self.dropped = self.dropped,0
+                self.queue.put_nowait(logging.makeLogRecord({'name':record.name,'levelno':logging.WARNING,'levelname':'WARNING',
+                                                             'msg':f'Log queue full, dropped {dropped} records'}))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    # the stop sentinel waits for space so a full queue is still drained at shutdown
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def logging_configured():
+    return _listener is not None
+
+
+def setup_logging(logger,section=None):
+    global _listener,_queue_handler
+    section = section or {}
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        if section.get('log_format','json') == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(TEXT_FORMAT,style='%')
+        handlers = []
+        if section.get('log_file','crypto_stream.log'):
+            file_handler = RotatingFileHandler(section.get('log_file','crypto_stream.log'),mode='a',
+                                               maxBytes=int(section.get('log_max_bytes',10485760)),
+                                               backupCount=int(section.get('log_backup_count',5)),encoding='utf-8')
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        if section.get('log_console','false').lower() == 'true':
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(maxsize=int(section.get('log_queue_size',10000)))
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(RateSamplingFilter(float(section.get('log_sample_rate_per_second',20)),
+                                                   float(section.get('log_sample_burst',50))))
+        logger.setLevel(section.get('log_level','INFO').upper())
+        logger.addHandler(queue_handler)
+        _queue_handler = (logger,queue_handler)
+        _listener = DrainingQueueListener(log_queue,*handlers,respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    global _listener,_queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            logger,queue_handler = _queue_handler
+            logger.removeHandler(queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            # flushes whatever is still queued before the handlers close
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
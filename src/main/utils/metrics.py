@@ -0,0 +1,325 @@
+import os
+import time
+import json
+import socket
+import random
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30)
+COUNT_BUCKETS = (1,5,10,25,50,100,250,500,1000,2500,5000,10000)
+BYTES_BUCKETS = (1024,4096,16384,65536,262144,1048576,2097152,5242880)
+
+
+def _label_key(label_names,labels):
+    return tuple(str(labels.get(name,'')) for name in label_names)
+
+
+def _format_labels(label_names,values,extra=None):
+    pairs = list(zip(label_names,values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name,value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')) for name,value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name,value in escaped) + '}'
+
+
+class Counter():
+    kind = 'counter'
+
+    def __init__(self,name,help_text='',label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self,amount=1,**labels):
+        key = _label_key(self.label_names,labels)
+        with self.lock:
+            self.values[key] = self.values.get(key,0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name,key,value) for key,value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self,value,**labels):
+        key = _label_key(self.label_names,labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram():
+    kind = 'histogram'
+
+    def __init__(self,name,help_text='',label_names=(),buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: bucket counts (last slot is +Inf), sum, count
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self,value,**labels):
+        key = _label_key(self.label_names,labels)
+        index = bisect_left(self.buckets,value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1),0.0,0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self,**labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start,**labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {key:(list(counts),total,count) for key,(counts,total,count) in self.values.items()}
+
+
+class MetricsRegistry():
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self,metric_class,name,*args,**kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = metric_class(name,*args,**kwargs)
+        if type(metric) is not metric_class:
+            raise ValueError(f'Metric {name} is already registered as a {metric.kind}')
+        return metric
+
+    def counter(self,name,help_text='',label_names=()):
+        return self._get_or_create(Counter,name,help_text,label_names)
+
+    def gauge(self,name,help_text='',label_names=()):
+        return self._get_or_create(Gauge,name,help_text,label_names)
+
+    def histogram(self,name,help_text='',label_names=(),buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram,name,help_text,label_names,buckets=buckets)
+
+    def render_prometheus(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if metric.kind == 'histogram':
+                for key,(counts,total,count) in metric.snapshot().items():
+                    cumulative = 0
+                    for bound,bucket_count in zip(metric.buckets + (float('inf'),),counts):
+                        cumulative += bucket_count
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f'{metric.name}_bucket{_format_labels(metric.label_names,key,[("le",le)])} {cumulative}')
+                    lines.append(f'{metric.name}_sum{_format_labels(metric.label_names,key)} {total}')
+                    lines.append(f'{metric.name}_count{_format_labels(metric.label_names,key)} {count}')
+            else:
+                for name,key,value in metric.samples():
+                    lines.append(f'{name}{_format_labels(metric.label_names,key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def get_registry():
+    return REGISTRY
+
+
+class PrometheusExporter():
+    def __init__(self,registry,host='0.0.0.0',port=9108):
+        registry_ref = registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?',1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_ref.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,format,*args):
+                pass
+
+        self.server = ThreadingHTTPServer((host,port),MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,name='metrics-exporter',daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StatsdExporter():
+    # pushes counter and histogram deltas plus gauge values over UDP, using DogStatsD tags for labels
+    def __init__(self,registry,host='127.0.0.1',port=8125,prefix='crypto_stream',flush_interval_seconds=10,max_packet_bytes=1432):
+        self.registry = registry
+        self.address = (host,port)
+        self.prefix = prefix
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_packet_bytes = max_packet_bytes
+        self.socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.sent = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run,name='statsd-exporter',daemon=True)
+
+    def _line(self,name,value,statsd_type,label_names,key):
+        tags = ','.join(f'{label}:{label_value}' for label,label_value in zip(label_names,key) if label_value)
+        return f'{self.prefix}.{name}:{value}|{statsd_type}' + (f'|#{tags}' if tags else '')
+
+    def _delta(self,sent_key,value):
+        delta = value - self.sent.get(sent_key,0)
+        self.sent[sent_key] = value
+        return delta
+
+    def lines(self):
+        lines = []
+        for metric in list(self.registry.metrics.values()):
+            if metric.kind == 'histogram':
+                for key,(_,total,count) in metric.snapshot().items():
+                    count_delta = self._delta((metric.name,key,'count'),count)
+                    if count_delta:
+                        lines.append(self._line(f'{metric.name}.count',count_delta,'c',metric.label_names,key))
+                        lines.append(self._line(f'{metric.name}.sum',self._delta((metric.name,key,'sum'),total),'c',metric.label_names,key))
+            elif metric.kind == 'counter':
+                for name,key,value in metric.samples():
+                    delta = self._delta((name,key),value)
+                    if delta:
+                        lines.append(self._line(name,delta,'c',metric.label_names,key))
+            else:
+                for name,key,value in metric.samples():
+                    lines.append(self._line(name,value,'g',metric.label_names,key))
+        return lines
+
+    def flush(self):
+        packet = []
+        size = 0
+        for line in self.lines():
+            encoded = line.encode('utf-8')
+            if packet and size + len(encoded) + 1 > self.max_packet_bytes:
+                self.socket.sendto(b'\n'.join(packet),self.address)
+                packet,size = [],0
+            packet.append(encoded)
+            size += len(encoded) + 1
+        if packet:
+            self.socket.sendto(b'\n'.join(packet),self.address)
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval_seconds):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self.socket.close()
+
+
+_current_span = contextvars.ContextVar('current_span',default=None)
+
+
+class Tracer():
+    # every span feeds the stage duration histogram; span records are only written when tracing is enabled
+    def __init__(self,registry):
+        self.duration = registry.histogram('pipeline_stage_duration_seconds','Time spent in each pipeline stage',('stage',))
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.trace_file = None
+        self.lock = threading.Lock()
+
+    def configure(self,enabled=False,trace_file=None,sample_rate=1.0):
+        self.close()
+        self.sample_rate = sample_rate
+        self.trace_file = open(trace_file,'a',buffering=1) if enabled and trace_file else None
+        self.enabled = enabled
+
+    @contextmanager
+    def span(self,stage,**attributes):
+        parent = _current_span.get()
+        recording = self.enabled and (parent[2] if parent else random.random() < self.sample_rate)
+        # ids are only drawn for spans that are written, so a disabled tracer costs no urandom calls
+        trace_id = parent[0] if parent else (os.urandom(16).hex() if recording else None)
+        span_id = os.urandom(8).hex() if recording else None
+        token = _current_span.set((trace_id,span_id,recording))
+        start_wall = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_span.reset(token)
+            self.duration.observe(duration,stage=stage)
+            if recording:
+                self._write({'trace_id':trace_id,'span_id':span_id,'parent_span_id':parent[1] if parent else None,
+                             'name':stage,'start':start_wall,'duration_ms':duration * 1000,'error':error,'attributes':attributes})
+
+    def _write(self,span):
+        line = json.dumps(span,default=str)
+        if self.trace_file:
+            with self.lock:
+                self.trace_file.write(line + '\n')
+
+    def close(self):
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+_tracer = Tracer(REGISTRY)
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure_metrics(section,registry=REGISTRY):
+    section = section or {}
+    _tracer.configure(enabled=section.get('tracing_enabled','false').lower() == 'true',
+                      trace_file=section.get('trace_file','traces.jsonl'),
+                      sample_rate=float(section.get('trace_sample_rate',1.0)))
+    exporter = section.get('exporter','none')
+    if exporter == 'prometheus':
+        return PrometheusExporter(registry,section.get('prometheus_host','0.0.0.0'),int(section.get('prometheus_port',9108))).start()
+    if exporter == 'statsd':
+        return StatsdExporter(registry,section.get('statsd_host','127.0.0.1'),int(section.get('statsd_port',8125)),
+                              section.get('statsd_prefix','crypto_stream'),float(section.get('statsd_flush_seconds',10))).start()
+    if exporter != 'none':
+        raise ValueError(f'Unsupported metrics exporter {exporter}')
+    return None
@@ -0,0 +1,133 @@
+import time
+import threading
+
+KINESIS_SHARD_BYTES_PER_SECOND = 1024 * 1024
+KINESIS_SHARD_RECORDS_PER_SECOND = 1000
+
+
+class HashKeyPartitioner():
+    """Pins each partition key to a shard through an explicit hash key and moves keys off hot shards.
+
+    A key keeps its shard between rebalances, so its records stay in order. A rebalance moves keys to other
+    shards, and records written after the move can be read before the ones still queued on the old shard.
+    Consumers that need strict per-key order should disable rebalancing with a very large
+    rebalance_interval_seconds.
+    """
+
+    def __init__(self,logger,shard_hash_ranges,rate_window_seconds=5,rate_smoothing=0.3,rebalance_interval_seconds=60,imbalance_threshold=1.25):
+        self.logger = logger
+        self.rate_window_seconds = rate_window_seconds
+        self.rate_smoothing = rate_smoothing
+        self.rebalance_interval_seconds = rebalance_interval_seconds
+        self.imbalance_threshold = imbalance_threshold
+        self.assignment = {}
+        self.asset_load = {}
+        self._window_bytes = {}
+        self._window_records = {}
+        self._window_start = time.monotonic()
+        self._last_rebalance = self._window_start
+        self._lock = threading.Lock()
+        self.set_shard_hash_ranges(shard_hash_ranges)
+
+    def set_shard_hash_ranges(self,shard_hash_ranges):
+        ranges = sorted((int(start),int(end)) for start,end in shard_hash_ranges)
+        if not ranges:
+            raise ValueError('At least one open shard hash range is required for explicit hash key partitioning')
+        # the midpoint of each range is the explicit hash key that pins a record to that shard
+        self.hash_keys = [str(start + (end - start) // 2) for start,end in ranges]
+        self.shard_byte_rate = [0.0] * len(ranges)
+        self.shard_record_rate = [0.0] * len(ranges)
+        self.assignment = {}
+        self._shard_load = [0.0] * len(ranges)
+        self._shard_keys = [0] * len(ranges)
+
+    @staticmethod
+    def _shard_utilisation(byte_rate,record_rate):
+        return max(byte_rate / KINESIS_SHARD_BYTES_PER_SECOND,record_rate / KINESIS_SHARD_RECORDS_PER_SECOND)
+
+    def _asset_utilisation(self,key):
+        byte_rate,record_rate = self.asset_load.get(key,(0.0,0.0))
+        return self._shard_utilisation(byte_rate,record_rate)
+
+    def _shard_loads(self):
+        loads = [0.0] * len(self.hash_keys)
+        for key,shard in self.assignment.items():
+            loads[shard] += self._asset_utilisation(key)
+        return loads
+
+    def _assign_new_key(self,key):
+        shard = min(range(len(self.hash_keys)),key=lambda index: (self._shard_load[index],self._shard_keys[index]))
+        self.assignment[key] = shard
+        self._shard_keys[shard] += 1
+        return shard
+
+    def _refresh_shard_totals(self):
+        self._shard_load = self._shard_loads()
+        self._shard_keys = [0] * len(self.hash_keys)
+        for shard in self.assignment.values():
+            self._shard_keys[shard] += 1
+
+    def assign(self,records):
+        # returns new records and leaves the caller's untouched, so they can be spooled or retried as they were
+        assigned = []
+        with self._lock:
+            for record in records:
+                key = record['PartitionKey']
+                shard = self.assignment.get(key)
+                if shard is None:
+                    shard = self._assign_new_key(key)
+                assigned.append(record | {'ExplicitHashKey':self.hash_keys[shard]})
+                self._window_bytes[key] = self._window_bytes.get(key,0) + len(record['Data']) + len(key)
+                self._window_records[key] = self._window_records.get(key,0) + 1
+            self._maybe_roll_window()
+        return assigned
+
+    def _maybe_roll_window(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.rate_window_seconds:
+            return
+        alpha = self.rate_smoothing
+        for key in set(self.asset_load) | set(self._window_records):
+            byte_rate,record_rate = self.asset_load.get(key,(0.0,0.0))
+            self.asset_load[key] = (byte_rate + alpha * (self._window_bytes.get(key,0) / elapsed - byte_rate),
+                                    record_rate + alpha * (self._window_records.get(key,0) / elapsed - record_rate))
+        self._window_bytes.clear()
+        self._window_records.clear()
+        self._window_start = now
+
+        if now - self._last_rebalance >= self.rebalance_interval_seconds:
+            self._last_rebalance = now
+            self.rebalance()
+        self.shard_byte_rate = [0.0] * len(self.hash_keys)
+        self.shard_record_rate = [0.0] * len(self.hash_keys)
+        for key,shard in self.assignment.items():
+            byte_rate,record_rate = self.asset_load.get(key,(0.0,0.0))
+            self.shard_byte_rate[shard] += byte_rate
+            self.shard_record_rate[shard] += record_rate
+        self._refresh_shard_totals()
+
+    def rebalance(self):
+        loads = self._shard_loads()
+        mean_load = sum(loads) / len(loads)
+        if not mean_load or max(loads) / mean_load < self.imbalance_threshold:
+            return False
+        # longest-processing-time greedy packing; assets keep their shard on ties to limit reordering
+        new_loads = [0.0] * len(loads)
+        new_assignment = {}
+        for key in sorted(self.assignment,key=self._asset_utilisation,reverse=True):
+            current = self.assignment[key]
+            shard = min(range(len(loads)),key=lambda index: (new_loads[index],index != current))
+            new_assignment[key] = shard
+            new_loads[shard] += self._asset_utilisation(key)
+        moved = sum(1 for key,shard in new_assignment.items() if shard != self.assignment[key])
+        self.assignment = new_assignment
+        self.logger.info(f'Rebalanced {moved} partition keys across {len(loads)} shards. '
+                         f'Peak utilisation {max(loads):.2f} -> {max(new_loads):.2f}')
+        return True
+
+    def shard_rates(self):
+        with self._lock:
+            return [{'shard':index,'explicit_hash_key':hash_key,'bytes_per_second':self.shard_byte_rate[index],
+                     'records_per_second':self.shard_record_rate[index]}
+                    for index,hash_key in enumerate(self.hash_keys)]
@@ -0,0 +1,171 @@
+import hashlib
+from bisect import bisect_right
+
+# KPL aggregated record layout: magic, protobuf AggregatedRecord, md5 of the protobuf bytes
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+KPL_DIGEST_SIZE = 16
+KPL_DEFAULT_MAX_BYTES = 51200
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(field_number,payload):
+    return _varint((field_number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _read_varint(buffer,offset):
+    result = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result,offset
+        shift += 7
+
+
+def _iter_fields(buffer):
+    offset = 0
+    end = len(buffer)
+    while offset < end:
+        key,offset = _read_varint(buffer,offset)
+        field_number,wire_type = key >> 3,key & 0x07
+        if wire_type == 0:
+            value,offset = _read_varint(buffer,offset)
+        elif wire_type == 2:
+            length,offset = _read_varint(buffer,offset)
+            value = buffer[offset:offset + length]
+            offset += length
+        elif wire_type == 1:
+            value = buffer[offset:offset + 8]
+            offset += 8
+        elif wire_type == 5:
+            value = buffer[offset:offset + 4]
+            offset += 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield field_number,value
+
+
+def partition_key_hash(partition_key):
+    return int.from_bytes(hashlib.md5(partition_key.encode('utf-8')).digest(),'big')
+
+
+class _AggregatedRecordBuilder():
+    def __init__(self):
+        self.partition_keys = {}
+        self.explicit_hash_keys = {}
+        self.records = []
+        self.size = len(KPL_MAGIC) + KPL_DIGEST_SIZE
+        self.first_partition_key = None
+        self.first_explicit_hash_key = None
+
+    @staticmethod
+    def _key_table_cost(table,value):
+        if value is None or value in table:
+            return 0
+        return len(_length_delimited(1,value.encode('utf-8')))
+
+    def encode(self,record):
+        partition_key,explicit_hash_key = record['PartitionKey'],record.get('ExplicitHashKey')
+        body = _varint(1 << 3) + _varint(self.partition_keys.get(partition_key,len(self.partition_keys)))
+        if explicit_hash_key is not None:
+            body += _varint(2 << 3) + _varint(self.explicit_hash_keys.get(explicit_hash_key,len(self.explicit_hash_keys)))
+        body += _length_delimited(3,record['Data'])
+        size = (len(_length_delimited(3,body)) + self._key_table_cost(self.partition_keys,partition_key)
+                + self._key_table_cost(self.explicit_hash_keys,explicit_hash_key))
+        return body,size
+
+    def add(self,record,body,size):
+        partition_key,explicit_hash_key = record['PartitionKey'],record.get('ExplicitHashKey')
+        if self.first_partition_key is None:
+            self.first_partition_key = partition_key
+            self.first_explicit_hash_key = explicit_hash_key
+        self.partition_keys.setdefault(partition_key,len(self.partition_keys))
+        if explicit_hash_key is not None:
+            self.explicit_hash_keys.setdefault(explicit_hash_key,len(self.explicit_hash_keys))
+        self.records.append(body)
+        self.size += size
+
+    def build(self):
+        message = b''.join(_length_delimited(1,key.encode('utf-8')) for key in self.partition_keys)
+        message += b''.join(_length_delimited(2,key.encode('utf-8')) for key in self.explicit_hash_keys)
+        message += b''.join(_length_delimited(3,record) for record in self.records)
+        aggregated = {'Data':KPL_MAGIC + message + hashlib.md5(message).digest(),'PartitionKey':self.first_partition_key}
+        if self.first_explicit_hash_key is not None:
+            aggregated['ExplicitHashKey'] = self.first_explicit_hash_key
+        return aggregated
+
+
+class RecordAggregator():
+    def __init__(self,shard_hash_ranges=None,max_bytes=KPL_DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.set_shard_hash_ranges(shard_hash_ranges or [])
+
+    def set_shard_hash_ranges(self,shard_hash_ranges):
+        # sorted starting hash keys of the open shards; records bucketed together always land on one shard
+        self.range_starts = sorted(int(start) for start,_ in shard_hash_ranges)
+
+    def _bucket(self,record):
+        if not self.range_starts:
+            return 0
+        hash_key = record.get('ExplicitHashKey')
+        hash_value = int(hash_key) if hash_key is not None else partition_key_hash(record['PartitionKey'])
+        return max(bisect_right(self.range_starts,hash_value) - 1,0)
+
+    def aggregate(self,records):
+        builders = {}
+        aggregated = []
+        for record in records:
+            bucket = self._bucket(record)
+            builder = builders.get(bucket)
+            if builder is None:
+                builder = builders[bucket] = _AggregatedRecordBuilder()
+            body,size = builder.encode(record)
+            if builder.records and builder.size + size > self.max_bytes:
+                aggregated.append(builder.build())
+                builder = builders[bucket] = _AggregatedRecordBuilder()
+                body,size = builder.encode(record)
+            builder.add(record,body,size)
+        aggregated.extend(builder.build() for builder in builders.values() if builder.records)
+        return aggregated
+
+
+def deaggregate_record(record):
+    data = record['Data']
+    if not data.startswith(KPL_MAGIC) or len(data) < len(KPL_MAGIC) + KPL_DIGEST_SIZE:
+        return [record]
+    message = data[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    if hashlib.md5(message).digest() != data[-KPL_DIGEST_SIZE:]:
+        return [record]
+
+    partition_keys,explicit_hash_keys,user_records = [],[],[]
+    for field_number,value in _iter_fields(message):
+        if field_number == 1:
+            partition_keys.append(bytes(value).decode('utf-8'))
+        elif field_number == 2:
+            explicit_hash_keys.append(bytes(value).decode('utf-8'))
+        elif field_number == 3:
+            user_records.append(value)
+
+    deaggregated = []
+    for sub_sequence_number,user_record in enumerate(user_records):
+        fields = dict(_iter_fields(user_record))
+        deaggregated.append(record | {
+            'Data':bytes(fields[3]),
+            'PartitionKey':partition_keys[fields[1]],
+            'ExplicitHashKey':explicit_hash_keys[fields[2]] if 2 in fields else None,
+            'SubSequenceNumber':sub_sequence_number
+        })
+    return deaggregated
+
+
+def deaggregate_records(records):
+    return [user_record for record in records for user_record in deaggregate_record(record)]
@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor,FIRST_COMPLETED,wait
+
+
+class ResourceProvisioner():
+    def __init__(self,logger,manifest_path,fingerprint_values,max_workers=4):
+        self.logger = logger
+        self.manifest_path = manifest_path
+        self.fingerprint = hashlib.sha256(json.dumps(fingerprint_values,sort_keys=True).encode('utf-8')).hexdigest()
+        self.max_workers = max_workers
+        self.steps = {}
+        self._manifest_lock = threading.Lock()
+
+    def add_step(self,name,func,depends_on=()):
+        self.steps[name] = (func,tuple(depends_on))
+
+    def load_manifest(self):
+        if not self.manifest_path:
+            return {}
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError,ValueError) as e:
+            self.logger.error(f'Unable to read resource manifest {self.manifest_path}: {e}')
+            return {}
+        if manifest.get('fingerprint') != self.fingerprint:
+            self.logger.info(f'Resource manifest {self.manifest_path} was built for a different configuration. Ignoring it')
+            return {}
+        return manifest.get('steps',{})
+
+    def save_manifest(self,steps):
+        if not self.manifest_path:
+            return
+        with self._manifest_lock:
+            temp_path = f'{self.manifest_path}.tmp'
+            with open(temp_path,'w') as manifest_file:
+                json.dump({'fingerprint':self.fingerprint,'steps':steps},manifest_file,indent=2)
+            os.replace(temp_path,self.manifest_path)
+
+    def clear_manifest(self,step_names=None):
+        steps = self.load_manifest()
+        if step_names is None:
+            steps = {}
+        else:
+            for name in step_names:
+                steps.pop(name,None)
+        self.save_manifest(steps)
+
+    def _check_graph(self):
+        for name,(_,depends_on) in self.steps.items():
+            missing = [dependency for dependency in depends_on if dependency not in self.steps]
+            if missing:
+                raise ValueError(f'Step {name} depends on unknown steps {missing}')
+        visited,in_progress = set(),set()
+
+        def visit(name):
+            if name in in_progress:
+                raise ValueError(f'Dependency cycle detected at step {name}')
+            if name not in visited:
+                in_progress.add(name)
+                for dependency in self.steps[name][1]:
+                    visit(dependency)
+                in_progress.discard(name)
+                visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def _run_step(self,name,results):
+        func,depends_on = self.steps[name]
+        return func({dependency:results[dependency] for dependency in depends_on})
+
+    def run(self):
+        self._check_graph()
+        manifest = self.load_manifest()
+        results = {name:manifest[name] for name in self.steps if name in manifest}
+        for name in results:
+            self.logger.info(f'Resource step {name} verified in manifest. Skipping')
+        failed = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for name,(_,depends_on) in self.steps.items():
+                    if name in results or name in failed or name in running.values():
+                        continue
+                    if any(dependency in failed for dependency in depends_on):
+                        self.logger.error(f'Resource step {name} skipped because a dependency failed')
+                        failed.add(name)
+                    elif all(dependency in results for dependency in depends_on):
+                        running[executor.submit(self._run_step,name,dict(results))] = name
+                if not running:
+                    break
+                done,_ = wait(running,return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.logger.error(f'Resource step {name} failed: {e}',exc_info=True)
+                        result = None
+                    if result:
+                        results[name] = result
+                        manifest[name] = result
+                        self.save_manifest(manifest)
+                        self.logger.info(f'Resource step {name} complete')
+                    else:
+                        failed.add(name)
+        return results,failed
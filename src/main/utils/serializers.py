@@ -0,0 +1,151 @@
+import json
+import math
+import struct
+import zlib
+import threading
+import importlib.util
+
+ASSET_STRING_FIELDS = ('id','symbol','name','explorer')
+ASSET_INT_FIELDS = ('rank',)
+ASSET_FLOAT_FIELDS = ('supply','maxSupply','marketCapUsd','volumeUsd24Hr','priceUsd','changePercent24Hr','vwap24Hr')
+
+COMPACT_MAGIC = 0xC5
+COMPACT_SCHEMA_VERSION = 1
+MISSING_STRING = 0xFFFF
+MISSING_RANK = -1
+
+
+def _zstd_codec():
+    import zstandard
+    # zstd contexts are not thread safe, and records are built and decoded on worker threads
+    contexts = threading.local()
+
+    def compress(data):
+        if not hasattr(contexts,'compressor'):
+            contexts.compressor = zstandard.ZstdCompressor(level=3)
+        return contexts.compressor.compress(data)
+
+    def decompress(data):
+        if not hasattr(contexts,'decompressor'):
+            contexts.decompressor = zstandard.ZstdDecompressor()
+        return contexts.decompressor.decompress(data)
+    return compress,decompress
+
+
+def _lz4_codec():
+    import lz4.frame
+    return lz4.frame.compress,lz4.frame.decompress
+
+
+def _zlib_codec():
+    return (lambda data: zlib.compress(data,6)),zlib.decompress
+
+
+# codec id is stored in the record header, so consumers can decode without knowing the producer config
+CODECS = {
+    'none':(0,None),
+    'zlib':(1,_zlib_codec),
+    'zstd':(2,_zstd_codec),
+    'lz4':(3,_lz4_codec)
+}
+# zstd and lz4 come from optional packages that are only imported when the codec is first used
+CODEC_MODULES = {'zstd':'zstandard','lz4':'lz4'}
+_codec_cache = {}
+
+
+def missing_codec_module(compression):
+    module = CODEC_MODULES.get(compression)
+    return module if module and importlib.util.find_spec(module) is None else None
+
+
+def get_codec(codec_id):
+    if codec_id not in _codec_cache:
+        factory = next((factory for known_id,factory in CODECS.values() if known_id == codec_id),None)
+        if factory is None and codec_id != 0:
+            raise ValueError(f'Unknown record compression codec id {codec_id}')
+        _codec_cache[codec_id] = factory() if factory else (None,None)
+    return _codec_cache[codec_id]
+
+
+class JsonSerializer():
+    def encode(self,record):
+        return json.dumps(record).encode('utf-8')
+
+    def encode_batch(self,batch):
+        return [self.encode(record) for record in batch.to_records()]
+
+    def decode(self,data):
+        return json.loads(data)
+
+
+class CompactSerializer():
+    # fixed schema: Timestamp int64, rank int32, float64 numeric fields, then length-prefixed utf-8 strings
+    fixed = struct.Struct('<qi' + 'd' * len(ASSET_FLOAT_FIELDS))
+    string_length = struct.Struct('<H')
+
+    def __init__(self,compression='none'):
+        if compression not in CODECS:
+            raise ValueError(f'Unsupported record compression {compression}. Expected one of {list(CODECS)}')
+        self.codec_id = CODECS[compression][0]
+        self.compress,_ = get_codec(self.codec_id)
+        self.header = bytes([COMPACT_MAGIC,(COMPACT_SCHEMA_VERSION << 4) | self.codec_id])
+
+    def _pack(self,timestamp,rank,floats,strings):
+        parts = [self.fixed.pack(timestamp,rank,*floats)]
+        for value in strings:
+            if value is None:
+                parts.append(self.string_length.pack(MISSING_STRING))
+            else:
+                encoded = value.encode('utf-8')
+                parts.append(self.string_length.pack(len(encoded)))
+                parts.append(encoded)
+        body = b''.join(parts)
+        return self.header + (self.compress(body) if self.compress else body)
+
+    def encode(self,record):
+        rank = record.get('rank')
+        floats = [float(record[name]) if record.get(name) is not None else math.nan for name in ASSET_FLOAT_FIELDS]
+        return self._pack(int(record['Timestamp']),int(rank) if rank is not None else MISSING_RANK,floats,
+                          [record.get(name) for name in ASSET_STRING_FIELDS])
+
+    def encode_batch(self,batch):
+        timestamp = batch.timestamp
+        ranks = batch.ints['rank'].tolist()
+        float_rows = zip(*[batch.floats[name].tolist() for name in ASSET_FLOAT_FIELDS])
+        string_rows = zip(*[batch.strings[name].tolist() for name in ASSET_STRING_FIELDS])
+        return [self._pack(timestamp,rank,floats,strings) for rank,floats,strings in zip(ranks,float_rows,string_rows)]
+
+    @classmethod
+    def decode(cls,data):
+        if data[0] != COMPACT_MAGIC or data[1] >> 4 != COMPACT_SCHEMA_VERSION:
+            raise ValueError('Record is not in the compact schema format')
+        _,decompress = get_codec(data[1] & 0x0F)
+        body = decompress(data[2:]) if decompress else memoryview(data)[2:]
+        values = cls.fixed.unpack_from(body,0)
+        record = {'Timestamp':values[0],'rank':values[1] if values[1] != MISSING_RANK else None}
+        for name,value in zip(ASSET_FLOAT_FIELDS,values[2:]):
+            record[name] = value if value == value else None
+        offset = cls.fixed.size
+        for name in ASSET_STRING_FIELDS:
+            (length,) = cls.string_length.unpack_from(body,offset)
+            offset += cls.string_length.size
+            if length == MISSING_STRING:
+                record[name] = None
+            else:
+                record[name] = bytes(body[offset:offset + length]).decode('utf-8')
+                offset += length
+        return record
+
+
+def get_serializer(record_format='json',compression='none'):
+    if record_format == 'json':
+        return JsonSerializer()
+    if record_format == 'compact':
+        return CompactSerializer(compression)
+    raise ValueError(f'Unsupported record format {record_format}')
+
+
+def decode_record(data):
+    if data[:1] == bytes([COMPACT_MAGIC]):
+        return CompactSerializer.decode(data)
+    return json.loads(data)
@@ -0,0 +1,182 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+from bisect import bisect_right
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+ACK_FILE = 'spool.ack'
+# crc32 of the body, then data, partition key and explicit hash key lengths
+ENTRY_HEADER = struct.Struct('<IIHH')
+ACK_FORMAT = struct.Struct('<q')
+
+
+class WriteAheadSpool():
+    def __init__(self,logger,directory,segment_max_bytes=64 * 1024 * 1024,fsync=False):
+        self.logger = logger
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # [first sequence number, entry count, size in bytes] per segment, oldest first
+        self.segments = []
+        self.acked = set()
+        self.positions = {}
+        self.active = None
+        os.makedirs(directory,exist_ok=True)
+        self.watermark = self._load_watermark()
+        self._recover()
+
+    def _segment_path(self,first_seq):
+        return os.path.join(self.directory,f'{SEGMENT_PREFIX}{first_seq:020d}{SEGMENT_SUFFIX}')
+
+    def _load_watermark(self):
+        try:
+            with open(os.path.join(self.directory,ACK_FILE),'rb') as file:
+                return ACK_FORMAT.unpack(file.read(ACK_FORMAT.size))[0]
+        except (FileNotFoundError,struct.error):
+            return 0
+
+    def _save_watermark(self):
+        path = os.path.join(self.directory,ACK_FILE)
+        with open(path + '.tmp','wb') as file:
+            file.write(ACK_FORMAT.pack(self.watermark))
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + '.tmp',path)
+
+    @staticmethod
+    def _entries(buffer,offset=0):
+        # stops at the first torn or corrupt entry, which can only be the tail of the last segment
+        end = len(buffer)
+        while offset + ENTRY_HEADER.size <= end:
+            crc,data_length,key_length,hash_key_length = ENTRY_HEADER.unpack_from(buffer,offset)
+            body_start = offset + ENTRY_HEADER.size
+            body_end = body_start + key_length + hash_key_length + data_length
+            if body_end > end or zlib.crc32(buffer[body_start:body_end]) != crc:
+                return
+            yield offset,body_end,body_start,data_length,key_length,hash_key_length
+            offset = body_end
+
+    @staticmethod
+    def _decode(buffer,body_start,data_length,key_length,hash_key_length):
+        hash_key_start = body_start + key_length
+        data_start = hash_key_start + hash_key_length
+        record = {'Data':bytes(buffer[data_start:data_start + data_length]),
+                  'PartitionKey':bytes(buffer[body_start:hash_key_start]).decode('utf-8')}
+        if hash_key_length:
+            record['ExplicitHashKey'] = bytes(buffer[hash_key_start:data_start]).decode('ascii')
+        return record
+
+    @staticmethod
+    def _encode(record):
+        key = record['PartitionKey'].encode('utf-8')
+        hash_key = (record.get('ExplicitHashKey') or '').encode('ascii')
+        body = key + hash_key + record['Data']
+        return ENTRY_HEADER.pack(zlib.crc32(body),len(record['Data']),len(key),len(hash_key)) + body
+
+    def _recover(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            first_seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            path = os.path.join(self.directory,name)
+            with open(path,'rb') as file:
+                buffer = file.read()
+            count,valid_end = 0,0
+            for offset,entry_end,*_ in self._entries(buffer):
+                if first_seq + count >= self.watermark:
+                    self.positions[first_seq + count] = (first_seq,offset)
+                count += 1
+                valid_end = entry_end
+            if valid_end < len(buffer):
+                self.logger.warning(f'Truncating {len(buffer) - valid_end} bytes of torn writes from spool segment {name}')
+                with open(path,'r+b') as file:
+                    file.truncate(valid_end)
+            self.segments.append([first_seq,count,valid_end])
+        self.next_seq = self.segments[-1][0] + self.segments[-1][1] if self.segments else self.watermark
+        self.watermark = min(self.watermark,self.next_seq)
+        self._remove_acked_segments()
+        if self.pending_count():
+            self.logger.info(f'Spool {self.directory} recovered {self.pending_count()} unacknowledged records for replay')
+
+    def _open_active(self):
+        if self.segments and self.segments[-1][2] < self.segment_max_bytes:
+            first_seq = self.segments[-1][0]
+        else:
+            first_seq = self.next_seq
+            self.segments.append([first_seq,0,0])
+        self.active = open(self._segment_path(first_seq),'ab')
+
+    def _remove_acked_segments(self):
+        # the last segment stays even when fully acked so sequence numbers keep counting from it
+        while len(self.segments) > 1 and self.segments[0][0] + self.segments[0][1] <= self.watermark:
+            os.remove(self._segment_path(self.segments.pop(0)[0]))
+
+    def pending_count(self):
+        return self.next_seq - self.watermark - len(self.acked)
+
+    def append(self,records):
+        with self.lock:
+            seqs = []
+            for record in records:
+                if self.active is None or self.segments[-1][2] >= self.segment_max_bytes:
+                    if self.active:
+                        self.active.close()
+                        self.active = None
+                    self._open_active()
+                entry = self._encode(record)
+                segment = self.segments[-1]
+                self.active.write(entry)
+                self.positions[self.next_seq] = (segment[0],segment[2])
+                segment[1] += 1
+                segment[2] += len(entry)
+                seqs.append(self.next_seq)
+                self.next_seq += 1
+            self.active.flush()
+            if self.fsync:
+                os.fsync(self.active.fileno())
+            return seqs
+
+    def pending(self,max_records=None):
+        with self.lock:
+            pending = []
+            seq = self.watermark
+            starts = [segment[0] for segment in self.segments]
+            while seq < self.next_seq and (max_records is None or len(pending) < max_records):
+                if seq in self.acked:
+                    seq += 1
+                    continue
+                first_seq,offset = self.positions[seq]
+                segment = self.segments[bisect_right(starts,first_seq) - 1]
+                if not segment[2]:
+                    break
+                with open(self._segment_path(first_seq),'rb') as file,mmap.mmap(file.fileno(),segment[2],access=mmap.ACCESS_READ) as buffer:
+                    for _,_,*fields in self._entries(buffer,offset):
+                        if seq >= first_seq + segment[1] or (max_records is not None and len(pending) >= max_records):
+                            break
+                        if seq not in self.acked:
+                            pending.append((seq,self._decode(buffer,*fields)))
+                        seq += 1
+            return pending
+
+    def acknowledge(self,seqs):
+        with self.lock:
+            self.acked.update(seq for seq in seqs if seq >= self.watermark)
+            watermark = self.watermark
+            while watermark in self.acked:
+                self.acked.discard(watermark)
+                self.positions.pop(watermark,None)
+                watermark += 1
+            if watermark != self.watermark:
+                self.watermark = watermark
+                self._save_watermark()
+                self._remove_acked_segments()
+
+    def close(self):
+        with self.lock:
+            if self.active:
+                self.active.close()
+                self.active = None
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import threading
+import pytest
+from configparser import ConfigParser
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from benchmarks.fixtures import synthesize_assets_payload
+from utils.aws_connector import StreamUnavailableError
+from utils.record_aggregation import partition_key_hash
+
+ETAG = '"assets-v1"'
+MAIN_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,'main','config.ini')
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    # the shipped config.ini with per-test overrides; logging stays off disk so tests never touch crypto_stream.log
+    def write(**sections):
+        config = ConfigParser(interpolation=None)
+        config.optionxform = str
+        config.read(MAIN_CONFIG)
+        overrides = {'logging':{'log_file':'','log_console':'false'},'metrics':{'exporter':'none','tracing_enabled':'false'}}
+        for section,values in sections.items():
+            overrides.setdefault(section,{}).update(values)
+        for section,values in overrides.items():
+            if not config.has_section(section):
+                config.add_section(section)
+            for key,value in values.items():
+                config[section][key] = str(value)
+        path = tmp_path / 'config.ini'
+        with open(path,'w') as config_file:
+            config.write(config_file)
+        return str(path)
+    return write
+
+
+class StubConnector():
+    # stands in for AWSConnector; a cleared gate holds every write until the test releases it,
+    # and unavailable fails provisioning and writes the way missing credentials do
+    def __init__(self):
+        self.writes = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.unavailable = False
+        self.deleted = False
+        self.shard_count = 2
+        self.resolved = []
+
+    def ensure_resources(self):
+        if self.unavailable:
+            raise StreamUnavailableError('AWS credentials unavailable')
+
+    def get_shard_hash_ranges(self):
+        return [('0',str(2 ** 128 - 1))]
+
+    def resolve_shard(self,record):
+        self.resolved.append(record['PartitionKey'])
+        return f'shardId-{partition_key_hash(record["PartitionKey"]) * self.shard_count >> 128:012d}'
+
+    def write_to_kinesis_stream(self,records):
+        self.ensure_resources()
+        self.gate.wait()
+        self.writes.append(records)
+        return []
+
+    def delete_streams(self):
+        self.deleted = True
+
+
+@pytest.fixture
+def stub_connector():
+    connector = StubConnector()
+    yield connector
+    connector.gate.set()
+
+
+@pytest.fixture
+def assets_server():
+    # serves a CoinCap-shaped /v2/assets payload with an ETag, answers 304 to a matching If-None-Match,
+    # and records when each request arrived and its status
+    payload = synthesize_assets_payload(50)
+    request_times = []
+    statuses = []
+
+    class AssetsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            request_times.append(time.monotonic())
+            if self.headers.get('If-None-Match') == ETAG:
+                statuses.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            statuses.append(200)
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('ETag',ETAG)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self,format,*args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1',0),AssetsHandler)
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/v2/assets'
+    server.payload = payload
+    server.request_times = request_times
+    server.statuses = statuses
+    yield server
+    server.shutdown()
+    server.server_close()
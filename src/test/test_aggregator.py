@@ -0,0 +1,66 @@
+import math
+import random
+import statistics
+import pytest
+from data_processing.aggregator import StreamingAggregator
+
+MINUTE_MS = 60000
+
+
+def test_bar_volume_is_the_increase_in_rolling_24h_volume():
+    aggregator = StreamingAggregator(tumbling_window_seconds=60)
+    ticks = [(0,100.0,5e9),(10000,110.0,5e9 + 1000),(20000,90.0,5e9 + 4000),(30000,95.0,5e9 + 3000),(40000,100.0,None)]
+    for timestamp,price,volume_24h in ticks:
+        aggregator.update_records([{'id':'bitcoin','Timestamp':timestamp,'priceUsd':price,'volumeUsd24Hr':volume_24h}])
+    bar = aggregator.current_bar('bitcoin')
+    # the first tick has no baseline, the drop at 30s and the price-only tick count as no volume
+    assert bar['volume'] == pytest.approx(1000 + 3000)
+    assert bar['vwap'] == pytest.approx((1000 + 3000) / (1000 / 110.0 + 3000 / 90.0))
+    assert (bar['open'],bar['high'],bar['low'],bar['close'],bar['ticks']) == (100.0,110.0,90.0,100.0,5)
+
+    closed = aggregator.update('bitcoin',MINUTE_MS,100.0,5e9 + 5000)
+    assert closed['window_start'] == 0 and closed['volume'] == pytest.approx(4000)
+    # the price-only tick kept the previous 24h total as the baseline
+    assert aggregator.current_bar('bitcoin')['volume'] == pytest.approx(2000)
+
+
+def test_bar_without_volume_uses_close_as_vwap():
+    aggregator = StreamingAggregator()
+    aggregator.update('bitcoin',0,100.0,math.nan)
+    aggregator.update('bitcoin',1000,101.0,math.nan)
+    assert aggregator.current_bar('bitcoin')['vwap'] == 101.0
+
+
+def test_sliding_stats_stay_accurate_for_large_volumes():
+    # 24h totals near 1e13 with tick volumes near 1e9 that differ by a few units; unshifted sums of squares lose all of it
+    rng = random.Random(3)
+    aggregator = StreamingAggregator(sliding_window_seconds=600,sliding_capacity=64)
+    volume_24h,price = 1e13,50000.0
+    tick_volumes,log_returns = [],[]
+    for tick in range(2000):
+        tick_volume = 1e9 + rng.uniform(-4,4)
+        volume_24h += tick_volume
+        previous_price,price = price,price * math.exp(rng.gauss(0,1e-4))
+        aggregator.update('bitcoin',tick * 15000,price,volume_24h)
+        tick_volumes.append(tick_volume)
+        log_returns.append(math.log(price / previous_price))
+
+    stats = aggregator.sliding_stats('bitcoin')
+    window = 600 // 15
+    assert stats['ticks'] == window
+    volumes = tick_volumes[-window:]
+    # volumes are reconstructed from differences of 1e13 totals, so they carry about 1e-3 of rounding each
+    expected_zscore = (volumes[-1] - statistics.fmean(volumes)) / statistics.stdev(volumes)
+    assert stats['volume_zscore'] == pytest.approx(expected_zscore,abs=2e-3)
+    assert stats['volatility'] == pytest.approx(statistics.stdev(log_returns[-window:]),rel=1e-6)
+    assert stats['volume'] == pytest.approx(math.fsum(volumes),rel=1e-9)
+
+
+def test_sliding_window_evicts_old_ticks():
+    aggregator = StreamingAggregator(sliding_window_seconds=60,sliding_capacity=8)
+    for tick in range(20):
+        aggregator.update('bitcoin',tick * 10000,100.0 + tick,1e6 + tick * 100)
+    stats = aggregator.sliding_stats('bitcoin')
+    assert stats['ticks'] == 6
+    assert stats['last_price'] == 119.0
+    assert aggregator.sliding_stats('ethereum') is None
@@ -0,0 +1,167 @@
+import time
+import threading
+import pytest
+from data_ingestion import base_producer
+from data_ingestion.base_producer import BaseProducer
+from data_ingestion.payload_decoder import decode_assets_payload
+from utils import serializers
+from utils.serializers import COMPACT_MAGIC
+
+POLL_INTERVAL = 0.1
+
+
+def make_producer(write_config,stub_connector,assets_server,**api):
+    config = write_config(api={'api_endpoint':assets_server.url,'producer_mode':'async','poll_interval_seconds':POLL_INTERVAL,
+                               'http_max_concurrency':1,'spool_enabled':'false','teardown_on_exit':'false'} | api)
+    return BaseProducer(config,'api','aws',aws_connector=stub_connector)
+
+
+def test_run_async_keeps_poll_cadence_and_blocks_on_full_queue(write_config,stub_connector,assets_server):
+    producer = make_producer(write_config,stub_connector,assets_server,queue_max_size=1,max_iterations=8)
+    stub_connector.gate.clear()
+    thread = threading.Thread(target=producer.run)
+    thread.start()
+
+    # the writer holds one dataset and the queue holds another, so the third poll waits on queue.put
+    time.sleep(POLL_INTERVAL * 8)
+    assert len(assets_server.request_times) == 3
+    assert stub_connector.writes == []
+
+    stub_connector.gate.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(assets_server.request_times) == 8
+    assert len(stub_connector.writes) == 8
+    assert all(len(records) == len(assets_server.payload['data']) for records in stub_connector.writes)
+
+
+def test_run_async_poll_cadence_is_fixed_rate(write_config,stub_connector,assets_server):
+    producer = make_producer(write_config,stub_connector,assets_server,queue_max_size=10,max_iterations=6)
+    producer.run()
+
+    times = assets_server.request_times
+    assert len(times) == 6
+    # polls are scheduled from the first one, so they neither drift nor bunch up behind slow writes
+    for index,request_time in enumerate(times):
+        assert request_time - times[0] == pytest.approx(index * POLL_INTERVAL,abs=0.05)
+
+
+@pytest.mark.parametrize('producer_mode',['sync','async','pipeline'])
+def test_max_iterations_ends_the_loop(write_config,stub_connector,assets_server,producer_mode):
+    producer = make_producer(write_config,stub_connector,assets_server,producer_mode=producer_mode,max_iterations=3,
+                             poll_interval_seconds=0.01,pipeline_linger_seconds=0.01)
+    thread = threading.Thread(target=producer.run)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(assets_server.request_times) == 3
+    assert sum(len(records) for records in stub_connector.writes) == 3 * len(assets_server.payload['data'])
+
+
+def test_compact_records_are_rejected_while_firehose_delivers(write_config,stub_connector,assets_server):
+    producer = make_producer(write_config,stub_connector,assets_server,record_format='compact')
+    with pytest.raises(ValueError,match='firehose_enabled=false'):
+        producer.initialize()
+
+
+def test_compact_records_are_allowed_without_firehose(write_config,stub_connector,assets_server):
+    config = write_config(api={'api_endpoint':assets_server.url,'record_format':'compact','http_max_concurrency':1,
+                               'spool_enabled':'false','max_iterations':1,'poll_interval_seconds':0.01},
+                          aws={'firehose_enabled':'false'})
+    BaseProducer(config,'api','aws',aws_connector=stub_connector).run()
+    assert len(stub_connector.writes) == 1
+    assert all(record['Data'][0] == COMPACT_MAGIC for record in stub_connector.writes[0])
+
+
+@pytest.mark.parametrize('compression,module',[('zstd','zstandard'),('lz4','lz4')])
+def test_missing_codec_packages_are_rejected(write_config,stub_connector,assets_server,monkeypatch,compression,module):
+    monkeypatch.setattr(serializers.importlib.util,'find_spec',lambda name: None)
+    producer = make_producer(write_config,stub_connector,assets_server,record_format='compact',record_compression=compression)
+    producer.aws_section['firehose_enabled'] = 'false'
+    with pytest.raises(ValueError,match=f'needs the {module} package'):
+        producer.initialize()
+
+
+def test_full_snapshot_is_republished_while_the_api_answers_304(write_config,stub_connector,assets_server):
+    producer = make_producer(write_config,stub_connector,assets_server,producer_mode='sync',delta_enabled='true',
+                             full_snapshot_interval_seconds=0.25,poll_interval_seconds=0.05,max_iterations=12)
+    producer.run()
+    assert assets_server.statuses[0] == 200 and set(assets_server.statuses[1:]) == {304}
+    # the first poll and every snapshot due afterwards publish all assets, the unchanged polls in between publish nothing
+    assert len(stub_connector.writes) >= 2
+    assert all(len(records) == len(assets_server.payload['data']) for records in stub_connector.writes)
+
+
+def make_spooling_producer(write_config,stub_connector,assets_server,tmp_path,**api):
+    return make_producer(write_config,stub_connector,assets_server,producer_mode='sync',spool_enabled='true',
+                         spool_directory=str(tmp_path / 'spool'),spool_retry_seconds=0.05,poll_interval_seconds=0.01,**api)
+
+
+def test_stream_outage_keeps_records_in_spool_until_it_recovers(write_config,stub_connector,assets_server,tmp_path):
+    stub_connector.unavailable = True
+    producer = make_spooling_producer(write_config,stub_connector,assets_server,tmp_path,aggregation_enabled='true',max_iterations=3)
+    producer.run()
+    # every poll still ran, and nothing was written or lost while provisioning failed
+    assert len(assets_server.request_times) == 3
+    assert stub_connector.writes == []
+
+    stub_connector.unavailable = False
+    make_spooling_producer(write_config,stub_connector,assets_server,tmp_path,max_iterations=1).run()
+    written = [record for records in stub_connector.writes for record in records]
+    assert len(written) == 4 * len(assets_server.payload['data'])
+    assert [record['PartitionKey'] for record in written[:3 * len(assets_server.payload['data'])]] == \
+        [asset['id'] for _ in range(3) for asset in assets_server.payload['data']]
+
+
+def test_spool_replay_does_not_stall_polling(write_config,stub_connector,assets_server,tmp_path):
+    producer = make_spooling_producer(write_config,stub_connector,assets_server,tmp_path,max_iterations=5)
+    stub_connector.gate.clear()
+    thread = threading.Thread(target=producer.run)
+    thread.start()
+    # the drainer is stuck on the first replay, yet the poll loop keeps spooling
+    expected = 5 * len(assets_server.payload['data'])
+    deadline = time.monotonic() + 5
+    while (getattr(producer,'spool',None) is None or producer.spool.pending_count() < expected) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(assets_server.request_times) == 5
+    assert producer.spool.pending_count() == expected
+
+    stub_connector.gate.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert sum(len(records) for records in stub_connector.writes) == 5 * len(assets_server.payload['data'])
+
+
+def test_oversized_records_are_rejected_before_the_spool(write_config,stub_connector,assets_server,tmp_path):
+    producer = make_spooling_producer(write_config,stub_connector,assets_server,tmp_path)
+    producer.initialize()
+    producer.write_records([{'Data':b'x' * (1024 * 1024),'PartitionKey':'oversized'},{'Data':b'{}','PartitionKey':'bitcoin'}])
+    assert producer.spool.pending_count() == 1
+    producer.close_spool()
+    assert stub_connector.writes == [[{'Data':b'{}','PartitionKey':'bitcoin'}]]
+
+
+def test_supervised_workers_decode_only_their_own_assets(write_config,stub_connector,assets_server,monkeypatch):
+    decoded = []
+
+    def recording_decode(payload):
+        decoded.append(len(payload['data']))
+        return decode_assets_payload(payload)
+    monkeypatch.setattr(base_producer,'decode_assets_payload',recording_decode)
+
+    published = []
+    for shard in ('shardId-000000000000','shardId-000000000001'):
+        stub_connector.writes = []
+        producer = make_producer(write_config,stub_connector,assets_server,producer_mode='sync',max_iterations=2,poll_interval_seconds=0.01)
+        producer.owned_shards = {shard}
+        resolved = len(stub_connector.resolved)
+        producer.run()
+        # each partition key is hashed once per worker, not once per poll
+        assert len(stub_connector.resolved) - resolved == len(assets_server.payload['data'])
+        keys = [record['PartitionKey'] for records in stub_connector.writes for record in records]
+        assert {stub_connector.resolve_shard({'PartitionKey':key}) for key in keys} == {shard}
+        published.append(set(keys))
+    # the two workers split the universe between them, and each decoded only its own slice
+    assert published[0].isdisjoint(published[1])
+    assert published[0] | published[1] == {asset['id'] for asset in assets_server.payload['data']}
+    assert decoded == [len(published[0])] * 2 + [len(published[1])] * 2
@@ -0,0 +1,134 @@
+import io
+import re
+import json
+import uuid
+import pytest
+import pyarrow.parquet as pq
+from datetime import datetime,timedelta,timezone
+from configparser import ConfigParser,ExtendedInterpolation
+from botocore.exceptions import ClientError
+from utils.aws_connector import AWSConnector
+from utils.base_component import BaseComponent
+from utils.record_aggregation import partition_key_hash
+from data_processing.compaction import LakeCompactor,seed_local_sources
+from benchmarks.fixtures import load_assets_payload
+
+ASSET_BUCKETS = 4
+PARTITION = re.compile(r'^date=(\d{4}-\d{2}-\d{2})/hour=(\d{2})/asset_bucket=(\d+)$')
+
+
+@pytest.fixture
+def compactor(write_config):
+    # the local backend is shared by the whole process, so every test gets its own prefixes
+    run = uuid.uuid4().hex[:8]
+    config_file = write_config(compaction={'source_prefix':f'raw-{run}','target_prefix':f'compacted-{run}',
+                                           'manifest_key':f'compacted-{run}/_manifest.json','asset_buckets':ASSET_BUCKETS,
+                                           'row_group_rows':64,'row_groups_per_file':2,'glue_table':''})
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(config_file)
+    aws_connector = AWSConnector(BaseComponent.logger,dict(config['aws']) | {'backend':'local','resource_manifest':''})
+    compactor = LakeCompactor(config_file,'compaction','aws',aws_connector=aws_connector)
+    compactor.initialize()
+    return compactor
+
+
+def manifest_reader(compactor):
+    return compactor.aws_connector.get_lake_reader({'bucket':compactor.target_bucket,'prefix':compactor.target_prefix,
+                                                    'manifest_key':compactor.manifest_key})
+
+
+def test_compacted_files_round_trip_through_the_manifest(compactor):
+    start,end = seed_local_sources(compactor,3)
+    manifest = compactor.run(start,end)
+    assets = load_assets_payload()['data']
+    assert manifest['version'] == 1
+    assert sum(entry['rows'] for entry in manifest['files']) == 3 * len(assets)
+    assert len(manifest['sources']) == 3
+
+    for entry in manifest['files']:
+        match = PARTITION.match(entry['partition'])
+        assert match and entry['key'].startswith(f'{compactor.target_prefix}/{entry["partition"]}/')
+        parquet_file = pq.ParquetFile(io.BytesIO(compactor.aws_connector.read_from_s3(compactor.target_bucket,None,entry['key'],decode=False)))
+        assert parquet_file.metadata.num_row_groups == entry['row_groups'] <= 2
+        table = parquet_file.read()
+        assert table.num_rows == entry['rows']
+        # every row sits in the partition of its hour and asset bucket, sorted by asset then time
+        assert {partition_key_hash(asset_id) % ASSET_BUCKETS for asset_id in table['id'].to_pylist()} == {int(match.group(3))}
+        assert {f'{datetime.fromtimestamp(timestamp / 1000,timezone.utc):%Y-%m-%d/%H}' for timestamp in table['Timestamp'].to_pylist()} == {f'{match.group(1)}/{match.group(2)}'}
+        rows = list(zip(table['id'].to_pylist(),table['Timestamp'].to_pylist()))
+        assert rows == sorted(rows)
+
+    table = manifest_reader(compactor).read_table(start,end,columns=['id','Timestamp','priceUsd'])
+    assert table.num_rows == 3 * len(assets)
+    expected = sorted((asset['id'],int(start.timestamp() * 1000) + tick * 30000) for tick in range(3) for asset in assets)
+    assert sorted(zip(table['id'].to_pylist(),table['Timestamp'].to_pylist())) == expected
+
+
+def test_recompaction_rewrites_touched_partitions(compactor):
+    start,end = seed_local_sources(compactor,2)
+    first = compactor.run(start,end)
+    # the same ticks written again under new keys are new sources for the same partitions
+    for key,_ in compactor.source_reader.list_objects(start,end):
+        body = compactor.aws_connector.read_from_s3(compactor.source_bucket,None,key,decode=False)
+        compactor.aws_connector.write_to_s3(compactor.source_bucket,None,f'{key}-again',body)
+    second = compactor.run(start,end)
+    assert second['version'] == 2
+    assert sum(entry['rows'] for entry in second['files']) == 2 * sum(entry['rows'] for entry in first['files'])
+    assert {entry['key'] for entry in second['stale']} == {entry['key'] for entry in first['files']}
+    assert manifest_reader(compactor).read_table(start,end).num_rows == sum(entry['rows'] for entry in second['files'])
+
+
+class UnreadableManifestS3():
+    # wraps the local S3 client; any read or listing of the manifest key fails with the given error code
+    def __init__(self,s3_client,manifest_key,code):
+        self.s3_client = s3_client
+        self.manifest_key = manifest_key
+        self.code = code
+
+    def _check(self,key,operation):
+        if key == self.manifest_key:
+            raise ClientError({'Error':{'Code':self.code,'Message':self.code}},operation)
+
+    def get_object(self,Bucket,Key,**kwargs):
+        self._check(Key,'GetObject')
+        return self.s3_client.get_object(Bucket=Bucket,Key=Key,**kwargs)
+
+    def get_paginator(self,operation):
+        paginator = self.s3_client.get_paginator(operation)
+        wrapper = self
+
+        class Paginator():
+            def paginate(self,Prefix='',**kwargs):
+                wrapper._check(Prefix,operation)
+                return paginator.paginate(Prefix=Prefix,**kwargs)
+        return Paginator()
+
+    def __getattr__(self,name):
+        return getattr(self.s3_client,name)
+
+
+def test_unreadable_manifest_aborts_instead_of_starting_over(compactor,monkeypatch):
+    start,end = seed_local_sources(compactor,1)
+    manifest = compactor.run(start,end)
+    s3_client = compactor.aws_connector.get_s3_client()
+    monkeypatch.setattr(compactor.aws_connector,'get_s3_client',lambda: UnreadableManifestS3(s3_client,compactor.manifest_key,'AccessDenied'))
+    seed_local_sources(compactor,2)
+    assert compactor.run(start,end) is None
+    stored = json.loads(s3_client.get_object(Bucket=compactor.target_bucket,Key=compactor.manifest_key)['Body'].read())
+    assert stored == manifest
+
+
+def test_missing_manifest_starts_empty(compactor):
+    assert compactor.load_manifest()['files'] == []
+
+
+def test_sources_before_the_window_leave_the_manifest(compactor):
+    start,end = seed_local_sources(compactor,2)
+    assert len(compactor.run(start,end)['sources']) == 2
+    # a later window no longer lists the seeded days, so only its own source stays tracked
+    later = end + timedelta(days=3)
+    record = load_assets_payload()['data'][0] | {'Timestamp':int(later.timestamp() * 1000)}
+    compactor.aws_connector.write_to_s3(compactor.source_bucket,compactor.source_prefix,f'{later:%Y/%m/%d}/late-00000',json.dumps(record).encode('utf-8'))
+    manifest = compactor.run(later - timedelta(hours=1),later + timedelta(hours=1))
+    assert manifest['sources'] == [f'{compactor.source_prefix}/{later:%Y/%m/%d}/late-00000']
+    assert sum(entry['rows'] for entry in manifest['files']) == 2 * len(load_assets_payload()['data']) + 1
@@ -0,0 +1,73 @@
+import time
+import logging
+from datetime import datetime,timezone
+from utils.firehose_controller import FirehoseDeliveryController,DELIVERY_METRICS
+from utils.local_aws import LocalAWS
+
+
+class StubCloudWatch():
+    # answers get_metric_data from a queue of {query id: total} snapshots, repeating the last one
+    def __init__(self,*snapshots):
+        self.snapshots = list(snapshots)
+        self.calls = 0
+
+    def get_metric_data(self,MetricDataQueries,StartTime,EndTime,**kwargs):
+        snapshot = self.snapshots[min(self.calls,len(self.snapshots) - 1)]
+        self.calls += 1
+        return {'MetricDataResults':[{'Id':query_id,'Timestamps':[EndTime] if query_id in snapshot else [],
+                                      'Values':[snapshot[query_id]] if query_id in snapshot else []}
+                                     for query_id in DELIVERY_METRICS]}
+
+
+def make_controller(cloudwatch,**kwargs):
+    return FirehoseDeliveryController(logging.getLogger('test'),None,cloudwatch,'delivery',**kwargs)
+
+
+def test_defaults_keep_the_30_second_buffer_interval():
+    assert make_controller(StubCloudWatch({})).buffering_hints() == {'SizeInMBs':64,'IntervalInSeconds':30}
+
+
+def test_wait_for_drain_returns_at_once_when_nothing_was_written():
+    cloudwatch = StubCloudWatch({})
+    start = time.monotonic()
+    assert make_controller(cloudwatch,drain_poll_seconds=30).wait_for_drain(datetime.now(timezone.utc),expected_records=0)
+    assert time.monotonic() - start < 1
+    assert cloudwatch.calls == 0
+
+
+def test_wait_for_drain_outlasts_lagging_metrics():
+    # CloudWatch still reads zero right after the last write; the written count keeps the wait going
+    cloudwatch = StubCloudWatch({},{},{'incoming_records':10,'delivered_records':10})
+    assert make_controller(cloudwatch,drain_poll_seconds=0.01).wait_for_drain(datetime.now(timezone.utc),expected_records=10)
+    assert cloudwatch.calls == 4
+
+
+def test_wait_for_drain_reads_the_kinesis_source_metrics():
+    backend = LocalAWS()
+    kinesis = backend.client('kinesis')
+    kinesis.create_stream(StreamName='source',ShardCount=1)
+    backend.client('s3').create_bucket(Bucket='lake')
+    backend.client('firehose').create_delivery_stream(
+        DeliveryStreamName='delivery',DeliveryStreamType='KinesisStreamAsSource',
+        KinesisStreamSourceConfiguration={'KinesisStreamARN':kinesis.describe_stream(StreamName='source')['StreamDescription']['StreamARN']},
+        ExtendedS3DestinationConfiguration={'BucketARN':'arn:aws:s3:::lake','Prefix':'raw','BufferingHints':{'SizeInMBs':64,'IntervalInSeconds':0}})
+    since = datetime.now(timezone.utc)
+    kinesis.put_records(StreamName='source',Records=[{'Data':b'{}','PartitionKey':f'asset-{index}'} for index in range(10)])
+    names = {name for _,name,*_ in backend.metrics}
+    assert {'DataReadFromKinesisStream.Records','DataReadFromKinesisStream.Bytes'} <= names
+    assert not names & {'IncomingRecords','IncomingBytes'}
+    controller = make_controller(backend.client('cloudwatch'),drain_poll_seconds=0.01,drain_timeout_seconds=5)
+    assert controller.wait_for_drain(since,expected_records=10)
+    assert controller.summarize(controller.fetch_metrics(since),1)['incoming_records'] == 10
+
+
+def test_wait_for_drain_waits_until_intake_settles_and_is_delivered():
+    cloudwatch = StubCloudWatch({'incoming_records':10,'delivered_records':4},
+                                {'incoming_records':10,'delivered_records':10})
+    assert make_controller(cloudwatch,drain_poll_seconds=0.01).wait_for_drain(datetime.now(timezone.utc))
+    assert cloudwatch.calls == 2
+
+
+def test_wait_for_drain_gives_up_at_the_timeout():
+    cloudwatch = StubCloudWatch({'incoming_records':10,'delivered_records':4})
+    assert not make_controller(cloudwatch,drain_poll_seconds=0.01,drain_timeout_seconds=0.05).wait_for_drain(datetime.now(timezone.utc))
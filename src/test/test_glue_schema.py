@@ -0,0 +1,108 @@
+import copy
+import logging
+import pytest
+from datetime import datetime,timezone
+from configparser import ConfigParser,ExtendedInterpolation
+from utils.aws_connector import AWSConnector
+from utils.local_aws import LocalAWS,FIREHOSE_TIMESTAMP_PATTERN,FIREHOSE_TIMESTAMP_TOKENS
+from utils.glue_schema import raw_table_input,table_changes,evolve_table_input,schema_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def desired():
+    return raw_table_input('assets','lake','raw/crypto')
+
+
+def with_columns(table_input,columns):
+    current = copy.deepcopy(table_input)
+    current['StorageDescriptor']['Columns'] = columns
+    return current
+
+
+def names(table_input):
+    return [(column['Name'],column['Type']) for column in table_input['StorageDescriptor']['Columns']]
+
+
+def test_added_column_is_appended():
+    table_input = desired()
+    current = with_columns(table_input,[column for column in table_input['StorageDescriptor']['Columns'] if column['Name'] != 'vwap24Hr'])
+    assert table_changes(current,table_input) == ['add vwap24Hr double']
+    evolved = evolve_table_input(current,table_input)
+    assert names(evolved) == names(current) + [('vwap24Hr','double')]
+    assert evolved['Parameters']['schema_fingerprint'] == schema_fingerprint(evolved['StorageDescriptor']['Columns'],evolved['PartitionKeys'])
+
+
+def test_retyped_column_keeps_its_place_and_unknown_columns_stay():
+    table_input = desired()
+    columns = [dict(column,Type='string') if column['Name'] == 'priceUsd' else column for column in table_input['StorageDescriptor']['Columns']]
+    # a column the current code no longer writes stays, so files written under older versions remain readable
+    current = with_columns(table_input,columns + [{'Name':'legacy','Type':'string'}])
+    assert table_changes(current,table_input) == ['retype priceUsd string -> double']
+    assert names(evolve_table_input(current,table_input)) == names(table_input) + [('legacy','string')]
+
+
+def test_column_names_compare_case_insensitively():
+    table_input = desired()
+    current = with_columns(table_input,[dict(column,Name=column['Name'].lower()) for column in table_input['StorageDescriptor']['Columns']])
+    assert table_changes(current,table_input) == []
+
+
+def strftime_format(pattern):
+    for token,directive in FIREHOSE_TIMESTAMP_TOKENS:
+        pattern = pattern.replace(token,directive)
+    return pattern
+
+
+def test_dt_projection_template_matches_the_firehose_prefix():
+    table_input = desired()
+    parameters = table_input['Parameters']
+    assert table_input['PartitionKeys'] == [{'Name':'dt','Type':'string'}]
+    assert table_input['StorageDescriptor']['Location'] == 's3://lake/raw/crypto/'
+    assert parameters['storage.location.template'] == 's3://lake/raw/crypto/${dt}/'
+    assert parameters['projection.dt.range'] == '2024/01/01,NOW'
+    # the prefix setup_resources gives Firehose expands to the same path the template builds from a projected dt
+    day = datetime(2024,10,15,tzinfo=timezone.utc)
+    firehose_prefix = FIREHOSE_TIMESTAMP_PATTERN.sub(lambda match: day.strftime(strftime_format(match.group(1))),'raw/crypto/!{timestamp:yyyy/MM/dd}')
+    dt = day.strftime(strftime_format(parameters['projection.dt.format']))
+    assert parameters['storage.location.template'].replace('${dt}',dt) == f's3://lake/{firehose_prefix}/'
+
+
+class RecordingGlue():
+    def __init__(self,glue_client):
+        self.glue_client = glue_client
+        self.updates = []
+
+    def update_table(self,DatabaseName,TableInput,**kwargs):
+        self.updates.append(TableInput)
+        return self.glue_client.update_table(DatabaseName=DatabaseName,TableInput=TableInput,**kwargs)
+
+    def __getattr__(self,name):
+        return getattr(self.glue_client,name)
+
+
+@pytest.fixture
+def glue(write_config):
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(write_config())
+    connector = AWSConnector(logger,dict(config['aws']) | {'backend':'local','resource_manifest':''})
+    return connector,RecordingGlue(LocalAWS().client('glue'))
+
+
+def test_unchanged_table_is_not_updated(glue):
+    connector,glue_client = glue
+    assert connector.create_glue_table(glue_client,'crypto','assets',desired())
+    assert connector.create_glue_table(glue_client,'crypto','assets',desired())
+    assert glue_client.updates == []
+    assert len(glue_client.get_table_versions(DatabaseName='crypto',TableName='assets')['TableVersions']) == 1
+
+
+def test_changed_table_is_updated_to_a_new_version(glue):
+    connector,glue_client = glue
+    table_input = desired()
+    current = with_columns(table_input,table_input['StorageDescriptor']['Columns'][:-1])
+    assert connector.create_glue_table(glue_client,'crypto','assets',current)
+    assert connector.create_glue_table(glue_client,'crypto','assets',table_input)
+    assert len(glue_client.updates) == 1
+    assert names(glue_client.get_table(DatabaseName='crypto',Name='assets')['Table']) == names(table_input)
+    assert len(glue_client.get_table_versions(DatabaseName='crypto',TableName='assets')['TableVersions']) == 2
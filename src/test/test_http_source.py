@@ -0,0 +1,80 @@
+import time
+import json
+import logging
+import threading
+import pytest
+from urllib.parse import urlsplit,parse_qs
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from data_ingestion.http_source import HttpSource,ApiRateLimitError,ApiResponseError
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def api_server():
+    # pages through 25 assets with limit/offset; `responses` queues (status, headers) answers ahead of the normal one
+    assets = [{'id':f'asset-{index}'} for index in range(25)]
+    state = {'responses':[],'requests':[]}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            state['requests'].append(url.query)
+            if state['responses']:
+                status,headers = state['responses'].pop(0)
+                self.send_response(status)
+                for name,value in headers.items():
+                    self.send_header(name,value)
+                self.send_header('Content-Length','0')
+                self.end_headers()
+                return
+            query = {name:int(values[-1]) for name,values in parse_qs(url.query).items()}
+            offset,limit = query.get('offset',0),query.get('limit',len(assets))
+            body = json.dumps({'data':assets[offset:offset + limit],'timestamp':1729000000000 + offset}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self,format,*args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/v2/assets'
+    server.state = state
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_paged_walks_pages_until_a_short_one(api_server):
+    source = HttpSource(logger,max_concurrency=2)
+    payload,modified = source.fetch_paged(api_server.url,page_size=10,max_pages=10)
+    assert modified
+    assert [record['id'] for record in payload['data']] == [f'asset-{index}' for index in range(25)]
+    assert payload['timestamp'] == 1729000000020
+    # two waves of two concurrent pages; the second wave's first page is short, so no third wave is sent
+    assert len(api_server.state['requests']) == 4
+
+
+def test_retry_after_is_capped_at_the_maximum_backoff(api_server):
+    api_server.state['responses'] = [(429,{'Retry-After':'3600'}),(503,{'Retry-After':'3600'})]
+    source = HttpSource(logger,max_retries=3,backoff_seconds=0.01,max_backoff_seconds=0.05)
+    start = time.monotonic()
+    payload,_ = source.fetch(api_server.url)
+    assert time.monotonic() - start < 1
+    assert len(payload['data']) == 25
+    assert len(api_server.state['requests']) == 3
+
+
+def test_exhausted_rate_limit_and_client_errors_raise(api_server):
+    api_server.state['responses'] = [(429,{'Retry-After':'1'})] * 2
+    with pytest.raises(ApiRateLimitError) as error:
+        HttpSource(logger,max_retries=1,max_backoff_seconds=0.01).fetch(api_server.url)
+    assert error.value.retry_after == 1.0
+    api_server.state['responses'] = [(404,{})]
+    with pytest.raises(ApiResponseError) as error:
+        HttpSource(logger).fetch(api_server.url)
+    assert error.value.status_code == 404
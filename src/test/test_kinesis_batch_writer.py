@@ -0,0 +1,135 @@
+import uuid
+import logging
+import threading
+from configparser import ConfigParser,ExtendedInterpolation
+from utils.aws_connector import AWSConnector
+from utils.kinesis_batch_writer import (KinesisBatchWriter,KINESIS_MAX_RECORDS_PER_CALL,KINESIS_MAX_BYTES_PER_CALL,
+                                        KINESIS_MAX_BYTES_PER_RECORD)
+
+logger = logging.getLogger(__name__)
+
+
+class StubKinesis():
+    # rejects each listed partition key for that many calls with the given error code, then accepts it
+    def __init__(self,rejections=None,error_code='ProvisionedThroughputExceededException'):
+        self.rejections = dict(rejections or {})
+        self.error_code = error_code
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def put_records(self,StreamName,Records):
+        entries = []
+        with self.lock:
+            self.calls.append([record['PartitionKey'] for record in Records])
+            for record in Records:
+                key = record['PartitionKey']
+                if self.rejections.get(key,0) > 0:
+                    self.rejections[key] -= 1
+                    entries.append({'ErrorCode':self.error_code,'ErrorMessage':'Rate exceeded for shard'})
+                else:
+                    entries.append({'SequenceNumber':'1','ShardId':'shardId-000000000000'})
+        return {'FailedRecordCount':sum('ErrorCode' in entry for entry in entries),'Records':entries}
+
+
+def records(count,size=10,prefix='key'):
+    return [{'Data':b'x' * size,'PartitionKey':f'{prefix}-{index}'} for index in range(count)]
+
+
+def writer(client,**options):
+    return KinesisBatchWriter(logger,client,'stream',base_delay=0,**options)
+
+
+def test_batches_are_capped_at_500_records():
+    batches,_ = writer(StubKinesis()).make_batches(records(1201))
+    assert [len(batch) for batch in batches] == [KINESIS_MAX_RECORDS_PER_CALL,KINESIS_MAX_RECORDS_PER_CALL,201]
+
+
+def test_batches_are_capped_at_5_mib_including_partition_keys():
+    size = 600 * 1024
+    batches,_ = writer(StubKinesis()).make_batches(records(20,size))
+    assert sum(len(batch) for batch in batches) == 20
+    for batch in batches:
+        assert sum(KinesisBatchWriter.record_size(record) for record in batch) <= KINESIS_MAX_BYTES_PER_CALL
+    # eight 600 KiB records fit in 5 MiB, a ninth would not
+    assert [len(batch) for batch in batches] == [8,8,4]
+
+
+def test_oversized_records_are_reported_as_failed():
+    oversized = {'Data':b'x' * KINESIS_MAX_BYTES_PER_RECORD,'PartitionKey':'too-big'}
+    client = StubKinesis()
+    results = writer(client).write(records(2) + [oversized] + records(1,prefix='after'))
+    assert client.calls == [['key-0','key-1','after-0']]
+    assert [[record['PartitionKey'] for record in result.failed_records] for result in results] == [[],['too-big']]
+
+
+def test_configured_limits_cannot_exceed_kinesis_limits():
+    batch_writer = writer(StubKinesis(),max_records=1000,max_bytes=10 * KINESIS_MAX_BYTES_PER_CALL)
+    assert batch_writer.max_records == KINESIS_MAX_RECORDS_PER_CALL
+    assert batch_writer.max_bytes == KINESIS_MAX_BYTES_PER_CALL
+
+
+def test_only_failed_entries_are_retried():
+    client = StubKinesis({'key-1':1,'key-3':2})
+    results = writer(client,max_workers=1).write(records(5))
+    assert client.calls == [['key-0','key-1','key-2','key-3','key-4'],['key-1','key-3'],['key-3']]
+    assert len(results) == 1
+    assert results[0].retries == 2
+    assert results[0].failed_records == []
+
+
+def test_entries_still_failing_after_max_retries_are_returned():
+    client = StubKinesis({'key-2':10},error_code='InternalFailure')
+    results = writer(client,max_workers=1,max_retries=3).write(records(4))
+    assert len(client.calls) == 4
+    assert all(call == ['key-2'] for call in client.calls[1:])
+    assert [record['PartitionKey'] for record in results[0].failed_records] == ['key-2']
+    assert results[0].retries == 3
+
+
+def test_parallel_batches_retry_independently():
+    client = StubKinesis({'key-0':1,'key-700':1})
+    results = writer(client,max_workers=4).write(records(1000))
+    assert [result.record_count for result in results] == [500,500]
+    assert all(result.retries == 1 and not result.failed_records for result in results)
+    assert sorted(call for call in client.calls if len(call) == 1) == [['key-0'],['key-700']]
+
+
+class FailingKinesis(StubKinesis):
+    # raises for any call that carries the given partition key
+    def __init__(self,failing_key):
+        super().__init__()
+        self.failing_key = failing_key
+
+    def put_records(self,StreamName,Records):
+        if any(record['PartitionKey'] == self.failing_key for record in Records):
+            raise ConnectionError('connection reset')
+        return super().put_records(StreamName,Records)
+
+
+def test_a_raising_batch_fails_alone():
+    results = writer(FailingKinesis('key-700'),max_workers=4).write(records(1000))
+    assert [len(result.failed_records) for result in results] == [0,500]
+    assert results[0].error is None and isinstance(results[1].error,ConnectionError)
+    assert results[1].failed_records[0]['PartitionKey'] == 'key-500'
+
+
+def test_the_thread_pool_is_reused_across_writes():
+    batch_writer = writer(StubKinesis(),max_workers=4)
+    batch_writer.write(records(1000))
+    executor = batch_writer._executor
+    batch_writer.write(records(1000))
+    assert executor is not None and batch_writer._executor is executor
+    batch_writer.close()
+    assert batch_writer._executor is None
+
+
+def test_connector_writes_through_one_batch_writer(write_config):
+    config = ConfigParser(interpolation=ExtendedInterpolation())
+    config.read(write_config())
+    connector = AWSConnector(logger,dict(config['aws']) | {'backend':'local','resource_manifest':'','firehose_enabled':'false',
+                                                           'kinesis_stream':f'writer-{uuid.uuid4().hex[:8]}'})
+    connector.write_to_kinesis_stream(records(3))
+    batch_writer = connector.batch_writer
+    connector.write_to_kinesis_stream(records(3))
+    assert batch_writer is not None and connector.batch_writer is batch_writer
+    assert connector.records_written == 6
@@ -0,0 +1,104 @@
+import time
+import threading
+import pytest
+from utils.local_aws import LocalAWS
+from data_processing.kinesis_consumer import BaseConsumer
+
+STREAM = 'prices'
+
+
+class LocalConnector():
+    def __init__(self,kinesis_client):
+        self.kinesis_client = kinesis_client
+
+    def get_kinesis_client(self):
+        return self.kinesis_client
+
+
+class RecordingHandler():
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def __call__(self,shard_id,records):
+        with self.lock:
+            self.records.extend((shard_id,record['PartitionKey'],record['Data'].decode('utf-8')) for record in records)
+
+    def wait_for(self,count,timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.records) >= count:
+                    return list(self.records)
+            time.sleep(0.01)
+        raise AssertionError(f'Consumed {len(self.records)} of {count} records')
+
+
+@pytest.fixture
+def kinesis():
+    kinesis_client = LocalAWS().client('kinesis')
+    kinesis_client.create_stream(StreamName=STREAM,ShardCount=1)
+    return kinesis_client
+
+
+@pytest.fixture
+def make_consumer(write_config,tmp_path,kinesis):
+    def make(iterator_type='TRIM_HORIZON'):
+        config_file = write_config(consumer={'kinesis_stream':STREAM,'iterator_type':iterator_type,'checkpoint_db':str(tmp_path / 'checkpoints.db'),
+                                             'poll_interval_seconds':0.01,'shard_refresh_seconds':0.02,'max_workers':4})
+        return BaseConsumer(config_file,'consumer','aws',aws_connector=LocalConnector(kinesis),record_handler=RecordingHandler())
+    return make
+
+
+def put(kinesis,keys,tick):
+    kinesis.put_records(StreamName=STREAM,Records=[{'Data':f'{key}:{tick}'.encode('utf-8'),'PartitionKey':key} for key in keys])
+
+
+def consume(consumer,count):
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    try:
+        return consumer.record_handler.wait_for(count)
+    finally:
+        consumer.stop()
+        thread.join(5)
+
+
+def test_restart_resumes_after_the_checkpoint(make_consumer,kinesis):
+    keys = [f'asset-{index}' for index in range(10)]
+    put(kinesis,keys,0)
+    assert len(consume(make_consumer(),10)) == 10
+    put(kinesis,keys,1)
+    # a fresh consumer on the same checkpoint database reads only what arrived after the first one stopped
+    resumed = make_consumer()
+    records = consume(resumed,10)
+    time.sleep(0.05)
+    assert len(resumed.record_handler.records) == 10
+    assert {data for _,_,data in records} == {f'{key}:1' for key in keys}
+
+
+def test_children_start_after_their_parent_is_drained(make_consumer,kinesis):
+    keys = [f'asset-{index}' for index in range(20)]
+    for tick in range(3):
+        put(kinesis,keys,tick)
+    kinesis.split_shard(StreamName=STREAM,ShardToSplit='shardId-000000000000',NewStartingHashKey=str(2 ** 127))
+    for tick in range(3,6):
+        put(kinesis,keys,tick)
+    consumer = make_consumer()
+    records = consume(consumer,6 * len(keys))
+    shard_order = [shard_id for shard_id,_,_ in records]
+    last_parent = len(shard_order) - 1 - shard_order[::-1].index('shardId-000000000000')
+    assert set(shard_order[last_parent + 1:]) == {'shardId-000000000001','shardId-000000000002'}
+    assert shard_order.count('shardId-000000000000') == 3 * len(keys)
+    for key in keys:
+        assert [data for _,record_key,data in records if record_key == key] == [f'{key}:{tick}' for tick in range(6)]
+
+
+def test_children_without_a_checkpoint_start_at_trim_horizon(make_consumer,kinesis):
+    kinesis.split_shard(StreamName=STREAM,ShardToSplit='shardId-000000000000',NewStartingHashKey=str(2 ** 127))
+    consumer = make_consumer(iterator_type='LATEST')
+    consumer.initialize()
+    # the parent aged out of retention, so it is neither listed nor in this consumer's closed set
+    shards = [shard for shard in consumer.list_shards() if shard['ShardId'] != 'shardId-000000000000']
+    assert consumer._ready_shards(shards) == [('shardId-000000000001','TRIM_HORIZON'),('shardId-000000000002','TRIM_HORIZON')]
+    consumer.checkpoint_store.close()
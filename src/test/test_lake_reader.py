@@ -0,0 +1,54 @@
+import io
+import json
+import logging
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime,timezone
+from utils.local_aws import LocalAWS
+from data_processing.lake_reader import LakeReader,ROW_GROUPS
+
+START = 1729000000000
+HOUR = 3600 * 1000
+
+
+def make_reader(objects):
+    s3_client = LocalAWS().client('s3')
+    s3_client.create_bucket(Bucket='lake')
+    for key,body in objects.items():
+        s3_client.put_object(Bucket='lake',Key=key,Body=body)
+    return LakeReader(logging.getLogger('test'),s3_client,'lake','raw',timestamp_column='Timestamp')
+
+
+def firehose_parquet(timestamps):
+    # Firehose writes the Glue schema, whose column names are lowercase
+    table = pa.table({'id':[f'asset-{index}' for index in range(len(timestamps))],'priceUsd':[1.0] * len(timestamps),'timestamp':timestamps})
+    buffer = io.BytesIO()
+    pq.write_table(table,buffer,row_group_size=2)
+    return buffer.getvalue()
+
+
+def pruned_row_groups():
+    return sum(value for _,key,value in ROW_GROUPS.samples() if key == ('pruned',))
+
+
+def at(millis):
+    return datetime.fromtimestamp(millis / 1000,timezone.utc)
+
+
+def test_time_filter_prunes_lowercase_firehose_parquet():
+    reader = make_reader({'raw/2024/10/15/part-0.parquet':firehose_parquet([START,START + 1,START + HOUR,START + HOUR + 1,START + 2 * HOUR,START + 2 * HOUR])})
+    pruned = pruned_row_groups()
+    table = reader.read_table(at(START + HOUR),at(START + 2 * HOUR),columns=['id','Timestamp'])
+    assert table.column_names == ['id','Timestamp']
+    assert table['Timestamp'].to_pylist() == [START + HOUR,START + HOUR + 1]
+    # the statistics matched the lowercase column, so the first and last row groups were never read
+    assert pruned_row_groups() - pruned == 2
+
+
+def test_parquet_and_json_objects_scan_into_one_table():
+    json_lines = '\n'.join(json.dumps({'id':'bitcoin','priceUsd':2.0,'Timestamp':START + HOUR + index}) for index in range(3))
+    reader = make_reader({'raw/2024/10/15/part-0.parquet':firehose_parquet([START + HOUR]),
+                          'raw/2024/10/15/part-1.json':json_lines.encode('utf-8')})
+    table = reader.read_table(at(START),at(START + 2 * HOUR),columns=['id','Timestamp'],filters=[('priceUsd','>',0)])
+    assert table.num_rows == 4
+    assert sorted(table['Timestamp'].to_pylist()) == [START + HOUR,START + HOUR,START + HOUR + 1,START + HOUR + 2]
@@ -0,0 +1,107 @@
+import pytest
+from datetime import datetime,timezone
+from utils import local_aws
+from utils.local_aws import LocalAWS,get_local_backend
+
+STREAM = 'prices'
+
+
+def make_kinesis(**limits):
+    backend = LocalAWS(**limits)
+    kinesis = backend.client('kinesis')
+    kinesis.create_stream(StreamName=STREAM,ShardCount=1)
+    return backend,kinesis
+
+
+def put(kinesis,count,start=0):
+    return kinesis.put_records(StreamName=STREAM,Records=[{'Data':f'tick-{index}'.encode('utf-8'),'PartitionKey':f'asset-{index}'}
+                                                          for index in range(start,start + count)])
+
+
+def iterator(kinesis,iterator_type,**kwargs):
+    return kinesis.get_shard_iterator(StreamName=STREAM,ShardId='shardId-000000000000',ShardIteratorType=iterator_type,**kwargs)['ShardIterator']
+
+
+def read(kinesis,shard_iterator):
+    return [record['Data'].decode('utf-8') for record in kinesis.get_records(ShardIterator=shard_iterator)['Records']]
+
+
+def test_put_records_throttles_past_the_shard_write_limit():
+    _,kinesis = make_kinesis(write_records_per_second=10)
+    response = put(kinesis,15)
+    assert response['FailedRecordCount'] == 5
+    assert [entry.get('ErrorCode') for entry in response['Records'][10:]] == ['ProvisionedThroughputExceededException'] * 5
+    assert all('SequenceNumber' in entry for entry in response['Records'][:10])
+
+
+def test_get_records_throttles_past_the_read_call_limit():
+    _,kinesis = make_kinesis(read_calls_per_second=2)
+    put(kinesis,3)
+    shard_iterator = iterator(kinesis,'TRIM_HORIZON')
+    for _ in range(2):
+        shard_iterator = kinesis.get_records(ShardIterator=shard_iterator)['NextShardIterator']
+    with pytest.raises(kinesis.exceptions.ProvisionedThroughputExceededException):
+        kinesis.get_records(ShardIterator=shard_iterator)
+    # the throttled iterator is still good for the retry
+    assert shard_iterator in kinesis.backend.iterators
+
+
+def test_iterator_types_start_where_documented():
+    _,kinesis = make_kinesis()
+    sequence_numbers = [entry['SequenceNumber'] for entry in put(kinesis,3)['Records']]
+    latest = iterator(kinesis,'LATEST')
+    since = datetime.now(timezone.utc)
+    put(kinesis,2,start=3)
+    assert read(kinesis,iterator(kinesis,'TRIM_HORIZON')) == [f'tick-{index}' for index in range(5)]
+    assert read(kinesis,latest) == ['tick-3','tick-4']
+    assert read(kinesis,iterator(kinesis,'AT_SEQUENCE_NUMBER',StartingSequenceNumber=sequence_numbers[1]))[0] == 'tick-1'
+    assert read(kinesis,iterator(kinesis,'AFTER_SEQUENCE_NUMBER',StartingSequenceNumber=sequence_numbers[1]))[0] == 'tick-2'
+    assert read(kinesis,iterator(kinesis,'AT_TIMESTAMP',Timestamp=since)) == ['tick-3','tick-4']
+    with pytest.raises(kinesis.exceptions.InvalidArgumentException):
+        iterator(kinesis,'SOMEWHERE')
+
+
+def test_iterators_are_released_once_used_or_expired(monkeypatch):
+    backend,kinesis = make_kinesis()
+    put(kinesis,2)
+    first = iterator(kinesis,'TRIM_HORIZON')
+    kinesis.get_records(ShardIterator=first,Limit=1)
+    assert first not in backend.iterators and len(backend.iterators) == 1
+    with pytest.raises(kinesis.exceptions.InvalidArgumentException):
+        kinesis.get_records(ShardIterator=first)
+
+    stale = iterator(kinesis,'TRIM_HORIZON')
+    monkeypatch.setattr(local_aws,'SHARD_ITERATOR_TTL_SECONDS',-1)
+    # creating any iterator evicts the expired ones, and the evicted token still reads as expired
+    fresh = iterator(kinesis,'TRIM_HORIZON')
+    assert list(backend.iterators) == [fresh]
+    with pytest.raises(kinesis.exceptions.ExpiredIteratorException):
+        kinesis.get_records(ShardIterator=stale)
+
+
+def test_firehose_delivers_the_source_stream_to_s3():
+    backend,kinesis = make_kinesis()
+    backend.client('s3').create_bucket(Bucket='lake')
+    backend.client('firehose').create_delivery_stream(
+        DeliveryStreamName='delivery',KinesisStreamSourceConfiguration={'KinesisStreamARN':backend.streams[STREAM]['arn']},
+        ExtendedS3DestinationConfiguration={'BucketARN':'arn:aws:s3:::lake','Prefix':'raw/!{timestamp:yyyy/MM/dd}',
+                                            'BufferingHints':{'SizeInMBs':64,'IntervalInSeconds':300}})
+    put(kinesis,3)
+    s3 = backend.client('s3')
+    # nothing is delivered until the buffer is full or its interval passes
+    assert s3.list_objects_v2(Bucket='lake').get('KeyCount',0) == 0
+    backend.flush_delivery_streams(force=True)
+    objects = s3.list_objects_v2(Bucket='lake')['Contents']
+    assert len(objects) == 1
+    assert objects[0]['Key'].startswith(f'raw/{datetime.now(timezone.utc):%Y/%m/%d}/delivery-1-')
+    assert s3.get_object(Bucket='lake',Key=objects[0]['Key'])['Body'].read() == b'tick-0\ntick-1\ntick-2'
+    assert [value for _,name,_,_,value,_ in backend.metrics if name == 'DeliveryToS3.Records'] == [3]
+
+
+def test_local_backend_rejects_conflicting_settings(monkeypatch):
+    monkeypatch.setattr(local_aws,'_default_backend',None)
+    monkeypatch.setattr(local_aws,'_default_backend_kwargs',None)
+    backend = get_local_backend(region='us-east-1')
+    assert get_local_backend(region='us-east-1') is backend
+    with pytest.raises(ValueError):
+        get_local_backend(region='eu-west-1')
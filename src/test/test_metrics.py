@@ -0,0 +1,103 @@
+import json
+import socket
+import pytest
+from utils import metrics
+from utils.metrics import MetricsRegistry,StatsdExporter,Tracer
+
+
+def test_prometheus_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('write_seconds','Write latency',('stream',),buckets=(0.1,1))
+    for value in (0.05,0.5,0.5,5):
+        histogram.observe(value,stream='prices')
+    lines = registry.render_prometheus().splitlines()
+    assert lines[:2] == ['# HELP write_seconds Write latency','# TYPE write_seconds histogram']
+    assert lines[2:] == ['write_seconds_bucket{stream="prices",le="0.1"} 1',
+                         'write_seconds_bucket{stream="prices",le="1.0"} 3',
+                         'write_seconds_bucket{stream="prices",le="+Inf"} 4',
+                         'write_seconds_sum{stream="prices"} 6.05',
+                         'write_seconds_count{stream="prices"} 4']
+
+
+def test_prometheus_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('errors_total','Errors',('message',)).inc(message='bad "key"\\path\nnext')
+    registry.gauge('up','Up').set(1)
+    lines = registry.render_prometheus().splitlines()
+    assert 'errors_total{message="bad \\"key\\"\\\\path\\nnext"} 1' in lines
+    assert 'up 1' in lines
+
+
+@pytest.fixture
+def statsd_server():
+    server = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1',0))
+    server.settimeout(1)
+    yield server
+    server.close()
+
+
+def received(server):
+    packets = []
+    server.settimeout(0.2)
+    try:
+        while True:
+            packets.append(server.recv(65536))
+    except socket.timeout:
+        return packets
+
+
+def test_statsd_sends_counter_deltas_and_gauge_values():
+    registry = MetricsRegistry()
+    counter = registry.counter('records_total','Records',('stream',))
+    gauge = registry.gauge('pending','Pending')
+    histogram = registry.histogram('latency_seconds','Latency')
+    exporter = StatsdExporter(registry,prefix='test')
+    counter.inc(5,stream='prices')
+    gauge.set(3)
+    histogram.observe(0.5)
+    assert exporter.lines() == ['test.records_total:5|c|#stream:prices','test.pending:3|g',
+                                'test.latency_seconds.count:1|c','test.latency_seconds.sum:0.5|c']
+    counter.inc(2,stream='prices')
+    # unchanged counters and histograms send nothing; gauges always report their value
+    assert exporter.lines() == ['test.records_total:2|c|#stream:prices','test.pending:3|g']
+    assert exporter.lines() == ['test.pending:3|g']
+    exporter.socket.close()
+
+
+def test_statsd_splits_lines_across_packets(statsd_server):
+    registry = MetricsRegistry()
+    counter = registry.counter('records_total','Records',('shard',))
+    for shard in range(40):
+        counter.inc(shard + 1,shard=f'shardId-{shard:012d}')
+    exporter = StatsdExporter(registry,*statsd_server.getsockname(),prefix='test',max_packet_bytes=200)
+    exporter.flush()
+    packets = received(statsd_server)
+    exporter.socket.close()
+    assert len(packets) > 1
+    assert all(len(packet) <= 200 for packet in packets)
+    lines = [line.decode('utf-8') for packet in packets for line in packet.split(b'\n')]
+    assert lines == [f'test.records_total:{shard + 1}|c|#shard:shardId-{shard:012d}' for shard in range(40)]
+
+
+def test_disabled_tracer_draws_no_ids(monkeypatch):
+    tracer = Tracer(MetricsRegistry())
+    monkeypatch.setattr(metrics.os,'urandom',lambda size: pytest.fail('urandom called with tracing disabled'))
+    with tracer.span('poll'):
+        with tracer.span('write'):
+            pass
+    assert tracer.duration.snapshot()[('poll',)][2] == 1
+
+
+def test_enabled_tracer_links_child_spans(tmp_path):
+    tracer = Tracer(MetricsRegistry())
+    trace_file = tmp_path / 'traces.jsonl'
+    tracer.configure(enabled=True,trace_file=str(trace_file))
+    with tracer.span('poll',source='rest'):
+        with tracer.span('write',records=3):
+            pass
+    tracer.close()
+    child,parent = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert child['trace_id'] == parent['trace_id'] and len(parent['trace_id']) == 32
+    assert child['parent_span_id'] == parent['span_id'] and parent['parent_span_id'] is None
+    assert (child['name'],child['attributes']) == ('write',{'records':3})
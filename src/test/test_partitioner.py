@@ -0,0 +1,26 @@
+import logging
+from utils.partitioner import HashKeyPartitioner
+
+logger = logging.getLogger(__name__)
+HASH_SPACE = 2 ** 128
+TWO_SHARDS = [('0',str(HASH_SPACE // 2 - 1)),(str(HASH_SPACE // 2),str(HASH_SPACE - 1))]
+
+
+def test_assign_returns_new_records_and_keeps_keys_on_their_shard():
+    partitioner = HashKeyPartitioner(logger,TWO_SHARDS)
+    records = [{'Data':b'x','PartitionKey':key} for key in ('bitcoin','ethereum','bitcoin')]
+    assigned = partitioner.assign(records)
+    assert all('ExplicitHashKey' not in record for record in records)
+    assert [record['PartitionKey'] for record in assigned] == ['bitcoin','ethereum','bitcoin']
+    assert assigned[0]['ExplicitHashKey'] == assigned[2]['ExplicitHashKey'] != assigned[1]['ExplicitHashKey']
+    assert partitioner.assign(records[:1])[0]['ExplicitHashKey'] == assigned[0]['ExplicitHashKey']
+
+
+def test_rebalance_moves_keys_off_a_hot_shard():
+    partitioner = HashKeyPartitioner(logger,TWO_SHARDS)
+    partitioner.assignment = {'bitcoin':0,'ethereum':0,'solana':0,'dogecoin':1}
+    partitioner.asset_load = {'bitcoin':(400000.0,0.0),'ethereum':(300000.0,0.0),'solana':(200000.0,0.0),'dogecoin':(10000.0,0.0)}
+    assert partitioner.rebalance()
+    # shard 0 ran at 86% of its byte limit; after packing neither shard is above half
+    assert max(partitioner._shard_loads()) < 0.5
+    assert partitioner.assignment['bitcoin'] == 0
@@ -0,0 +1,106 @@
+import json
+import math
+import pytest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from data_processing.price_index import PriceIndex,PriceIndexServer
+
+START = 1729000000000
+
+
+def tick(asset_id,offset,price,**fields):
+    return {'id':asset_id,'Timestamp':START + offset,'priceUsd':price} | fields
+
+
+def test_ring_keeps_the_latest_ticks_in_order_after_wrapping():
+    index = PriceIndex(ring_capacity=4,initial_assets=1)
+    index.update_records([tick('bitcoin',offset,float(offset),volumeUsd24Hr=10.0) for offset in range(10)])
+    ticks = index.ticks('bitcoin')
+    assert [entry['Timestamp'] - START for entry in ticks] == [6,7,8,9]
+    assert [entry['priceUsd'] for entry in ticks] == [6.0,7.0,8.0,9.0]
+    assert [entry['Timestamp'] - START for entry in index.ticks('bitcoin',START + 7,START + 9)] == [7,8]
+    assert index.ticks('unknown') is None
+
+
+def test_late_ticks_are_dropped():
+    index = PriceIndex(ring_capacity=8,initial_assets=1)
+    index.update_records([tick('bitcoin',10,10.0),tick('bitcoin',5,5.0),tick('bitcoin',10,11.0),tick('bitcoin',20,20.0)])
+    assert [(entry['Timestamp'] - START,entry['priceUsd']) for entry in index.ticks('bitcoin')] == [(10,10.0),(20,20.0)]
+    # an older record neither rolls back the snapshot nor enters the ring
+    index.update_records([tick('bitcoin',15,15.0,rank=1)])
+    assert index.get('bitcoin')['priceUsd'] == 20.0 and index.get('bitcoin')['rank'] is None
+
+
+def test_partial_updates_only_touch_the_fields_they_carry():
+    index = PriceIndex()
+    index.update_records([tick('bitcoin',0,60000.0,rank=1,symbol='BTC',marketCapUsd=1.2e12,volumeUsd24Hr=3e10)])
+    # websocket ticks carry only a price
+    index.update_records([{'id':'bitcoin','Timestamp':START + 1,'priceUsd':60100.0}])
+    snapshot = index.get('bitcoin')
+    assert (snapshot['Timestamp'],snapshot['priceUsd'],snapshot['rank'],snapshot['symbol'],snapshot['marketCapUsd']) == \
+        (START + 1,60100.0,1,'BTC',1.2e12)
+    assert snapshot['supply'] is None
+    # the tick without volume carries the last known volume into the ring
+    assert index.ticks('bitcoin')[-1] == {'Timestamp':START + 1,'priceUsd':60100.0,'volumeUsd24Hr':3e10}
+
+
+def test_top_skips_assets_without_the_field():
+    index = PriceIndex()
+    index.update_records([tick('bitcoin',0,1.0,marketCapUsd=300.0),tick('ethereum',0,1.0,marketCapUsd=200.0),
+                          tick('unranked',0,1.0),tick('dogecoin',0,1.0,marketCapUsd=100.0)])
+    assert [entry['id'] for entry in index.top('marketCapUsd',10)] == ['bitcoin','ethereum','dogecoin']
+    assert [entry['id'] for entry in index.top('marketCapUsd',2,ascending=True)] == ['dogecoin','ethereum']
+    assert [entry['id'] for entry in index.top('marketCapUsd',1)] == ['bitcoin']
+    assert index.top('marketCapUsd',0) == []
+    with pytest.raises(ValueError):
+        index.top('name')
+
+
+def test_index_grows_past_initial_assets():
+    index = PriceIndex(ring_capacity=2,initial_assets=2)
+    index.update_records([tick(f'asset-{number}',number,float(number),marketCapUsd=float(number)) for number in range(5)])
+    assert index.stats() == {'assets':5,'ring_capacity':2,'latest_timestamp':START + 4}
+    assert [entry['priceUsd'] for entry in index.get_many([f'asset-{number}' for number in range(5)])] == [0.0,1.0,2.0,3.0,4.0]
+    assert [entry['id'] for entry in index.top('marketCapUsd',2)] == ['asset-4','asset-3']
+    assert all(len(index.ticks(f'asset-{number}')) == 1 for number in range(5))
+    assert math.isnan(index.floats['supply'][4])
+
+
+@pytest.fixture
+def server():
+    index = PriceIndex()
+    index.update_records([tick('bitcoin',0,60000.0,marketCapUsd=1.2e12),tick('bitcoin',1,60100.0),
+                          tick('ethereum',0,2500.0,marketCapUsd=3e11)])
+    server = PriceIndexServer(index,port=0).start()
+    server.url = f'http://127.0.0.1:{server.server.server_address[1]}'
+    yield server
+    server.stop()
+
+
+def get(server,path):
+    try:
+        with urlopen(server.url + path,timeout=5) as response:
+            return response.status,json.loads(response.read())
+    except HTTPError as e:
+        return e.code,json.loads(e.read())
+
+
+def test_server_routes(server):
+    assert get(server,'/health') == (200,{'assets':2,'ring_capacity':256,'latest_timestamp':START + 1})
+    status,body = get(server,'/assets/bitcoin')
+    assert status == 200 and body['priceUsd'] == 60100.0
+    status,body = get(server,'/assets?ids=ethereum,unknown,bitcoin')
+    assert status == 200 and [entry['id'] for entry in body] == ['ethereum','bitcoin']
+    status,body = get(server,f'/assets/bitcoin/ticks?start={START + 1}')
+    assert status == 200 and [entry['priceUsd'] for entry in body] == [60100.0]
+    status,body = get(server,'/top?by=marketCapUsd&n=1&order=asc')
+    assert status == 200 and [entry['id'] for entry in body] == ['ethereum']
+
+
+def test_server_error_paths(server):
+    assert get(server,'/assets/unknown') == (404,{'error':'Unknown asset unknown'})
+    assert get(server,'/assets/unknown/ticks') == (404,{'error':'Unknown asset unknown'})
+    assert get(server,'/nowhere')[0] == 404
+    assert get(server,'/top?by=name')[0] == 400
+    assert get(server,'/top?n=ten')[0] == 400
+    assert get(server,'/assets/bitcoin/ticks?start=yesterday')[0] == 400
@@ -0,0 +1,87 @@
+import hashlib
+from bisect import bisect_right
+from utils.record_aggregation import (RecordAggregator,deaggregate_record,deaggregate_records,partition_key_hash,
+                                      KPL_MAGIC,KPL_DIGEST_SIZE,_iter_fields)
+
+HASH_SPACE = 2 ** 128
+TWO_SHARDS = [('0',str(HASH_SPACE // 2 - 1)),(str(HASH_SPACE // 2),str(HASH_SPACE - 1))]
+
+
+def user_records(count,size=20):
+    return [{'Data':f'{index:04d}'.encode() * (size // 4),'PartitionKey':f'asset-{index % 7}'} for index in range(count)]
+
+
+def shard_of(record,ranges=TWO_SHARDS):
+    hash_key = record.get('ExplicitHashKey')
+    hash_value = int(hash_key) if hash_key is not None else partition_key_hash(record['PartitionKey'])
+    return bisect_right([int(start) for start,_ in ranges],hash_value) - 1
+
+
+def test_aggregate_deaggregate_round_trip():
+    records = user_records(50)
+    aggregated = RecordAggregator().aggregate(records)
+    assert len(aggregated) == 1
+    restored = deaggregate_records([aggregated[0] | {'SequenceNumber':'42'}])
+    assert [(record['Data'],record['PartitionKey']) for record in restored] == [(record['Data'],record['PartitionKey']) for record in records]
+    assert [record['SubSequenceNumber'] for record in restored] == list(range(50))
+    assert all(record['SequenceNumber'] == '42' and record['ExplicitHashKey'] is None for record in restored)
+
+
+def test_aggregated_record_layout():
+    records = user_records(10)
+    data = RecordAggregator().aggregate(records)[0]['Data']
+    assert data[:len(KPL_MAGIC)] == KPL_MAGIC == b'\xf3\x89\x9a\xc2'
+    message = data[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    assert data[-KPL_DIGEST_SIZE:] == hashlib.md5(message).digest()
+    fields = list(_iter_fields(message))
+    # partition key table (field 1) holds each distinct key once, followed by one field 3 entry per user record
+    assert [bytes(value).decode() for number,value in fields if number == 1] == [f'asset-{index}' for index in range(7)]
+    entries = [dict(_iter_fields(value)) for number,value in fields if number == 3]
+    assert [bytes(entry[3]) for entry in entries] == [record['Data'] for record in records]
+    assert [entry[1] for entry in entries] == [index % 7 for index in range(10)]
+
+
+def test_non_aggregated_and_corrupt_records_pass_through():
+    plain = {'Data':b'{"id":"bitcoin"}','PartitionKey':'bitcoin'}
+    assert deaggregate_record(plain) == [plain]
+    aggregated = RecordAggregator().aggregate(user_records(3))[0]
+    corrupt = aggregated | {'Data':aggregated['Data'][:-1] + bytes([aggregated['Data'][-1] ^ 1])}
+    assert deaggregate_record(corrupt) == [corrupt]
+
+
+def test_explicit_hash_key_table():
+    low,high = str(HASH_SPACE // 4),str(HASH_SPACE // 2 + 5)
+    records = [{'Data':b'a','PartitionKey':'bitcoin','ExplicitHashKey':low},
+               {'Data':b'b','PartitionKey':'ethereum','ExplicitHashKey':low},
+               {'Data':b'c','PartitionKey':'solana'},
+               {'Data':b'd','PartitionKey':'bitcoin','ExplicitHashKey':high}]
+    aggregated = RecordAggregator().aggregate(records)
+    assert len(aggregated) == 1
+    assert aggregated[0]['PartitionKey'] == 'bitcoin' and aggregated[0]['ExplicitHashKey'] == low
+    message = aggregated[0]['Data'][len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+    assert [bytes(value).decode() for number,value in _iter_fields(message) if number == 2] == [low,high]
+    restored = deaggregate_record(aggregated[0])
+    assert [(record['Data'],record['PartitionKey'],record['ExplicitHashKey']) for record in restored] == [
+        (b'a','bitcoin',low),(b'b','ethereum',low),(b'c','solana',None),(b'd','bitcoin',high)]
+
+
+def test_records_are_grouped_by_shard():
+    records = user_records(40) + [{'Data':b'pinned','PartitionKey':'asset-0','ExplicitHashKey':str(HASH_SPACE - 1)}]
+    aggregated = RecordAggregator(TWO_SHARDS).aggregate(records)
+    assert len(aggregated) == 2
+    for record in aggregated:
+        # the outer record routes to the shard that every user record inside it hashes to
+        assert {shard_of(user_record) for user_record in deaggregate_record(record)} == {shard_of(record)}
+    assert sorted(user_record['Data'] for user_record in deaggregate_records(aggregated)) == sorted(record['Data'] for record in records)
+
+
+def test_size_cutoff_starts_a_new_aggregated_record():
+    records = user_records(200,size=100)
+    aggregated = RecordAggregator(max_bytes=1024).aggregate(records)
+    assert len(aggregated) > 1
+    assert all(len(record['Data']) <= 1024 for record in aggregated)
+    # a record that alone exceeds the cutoff still goes out, on its own
+    oversized = {'Data':b'x' * 2048,'PartitionKey':'big'}
+    alone = RecordAggregator(max_bytes=1024).aggregate(records[:3] + [oversized])
+    assert [len(deaggregate_record(record)) for record in alone] == [3,1]
+    assert [user_record['Data'] for user_record in deaggregate_records(aggregated)] == [record['Data'] for record in records]
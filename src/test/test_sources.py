@@ -0,0 +1,154 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+import pytest
+import websockets
+from data_ingestion.sources import Source,RestPollingSource,WebSocketPriceSource,IngestionPipeline
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingWriter():
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self,records):
+        with self.lock:
+            self.batches.append((time.monotonic(),list(records)))
+
+    def records(self):
+        with self.lock:
+            return [record for _,batch in self.batches for record in batch]
+
+
+class FailingSource(Source):
+    async def run(self,emit,stop_event):
+        await emit(self.name,[{'id':'failing-0'},{'id':'failing-1'}])
+        raise RuntimeError('source failed')
+
+
+def rest_fetch(records_per_poll):
+    polls = iter(range(1000))
+    def fetch():
+        poll = next(polls)
+        return [{'id':f'rest-{poll}-{index}'} for index in range(records_per_poll)]
+    return fetch
+
+
+async def price_server(messages):
+    async def handler(websocket):
+        for message in messages:
+            await websocket.send(json.dumps(message))
+        await websocket.wait_closed()
+    return await websockets.serve(handler,'127.0.0.1',0)
+
+
+async def wait_for(condition,timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline,'condition not met in time'
+        await asyncio.sleep(0.01)
+
+
+def run_pipeline(sources,writer,scenario,**options):
+    async def main():
+        pipeline = IngestionPipeline(logger,sources,lambda dataset:list(dataset),writer,**options)
+        task = asyncio.create_task(pipeline.run())
+        try:
+            await scenario(pipeline)
+        finally:
+            pipeline.stop()
+            await asyncio.wait_for(task,5)
+    asyncio.run(main())
+
+
+def test_rest_and_websocket_share_one_writer_that_flushes_on_batch_size():
+    writer = RecordingWriter()
+    messages = [{'bitcoin':'67000.1','ethereum':'2500.2'},{'bitcoin':'67000.3','solana':'150.4'},{'ethereum':'2500.5','dogecoin':'0.1'}]
+    stopped = []
+
+    async def scenario(pipeline):
+        await wait_for(lambda:len(writer.records()) >= 8)
+        # lets the last emits reach the buffer; a remainder below the batch size is left for the drain on stop
+        await asyncio.sleep(0.2)
+        stopped.append(time.monotonic())
+
+    async def main():
+        server = await price_server(messages)
+        port = server.sockets[0].getsockname()[1]
+        sources = [RestPollingSource(logger,'rest',rest_fetch(3),poll_interval_seconds=0.01,max_iterations=2),
+                   WebSocketPriceSource(logger,'websocket',f'ws://127.0.0.1:{port}')]
+        try:
+            await asyncio.to_thread(run_pipeline,sources,writer,scenario,max_batch_records=4,linger_seconds=30)
+        finally:
+            server.close()
+            await server.wait_closed()
+    asyncio.run(main())
+
+    records = writer.records()
+    assert len(records) == 12
+    assert {record['id'] for record in records if record['id'].startswith('rest-')} == {f'rest-{poll}-{index}' for poll in range(2) for index in range(3)}
+    assert sorted(record['priceUsd'] for record in records if 'priceUsd' in record) == sorted(price for message in messages for price in message.values())
+    # linger is far away, so every flush before stop was triggered by the batch size
+    size_flushes = [batch for flushed_at,batch in writer.batches if flushed_at < stopped[0]]
+    assert len(size_flushes) >= 2
+    assert all(len(batch) >= 4 for batch in size_flushes)
+
+
+def test_writer_flushes_on_linger():
+    writer = RecordingWriter()
+
+    async def scenario(pipeline):
+        await wait_for(lambda:len(writer.records()) == 3,timeout=2)
+
+    sources = [RestPollingSource(logger,'rest',rest_fetch(3),poll_interval_seconds=60,max_iterations=1)]
+    started = time.monotonic()
+    run_pipeline(sources,writer,scenario,max_batch_records=1000,linger_seconds=0.05)
+    flushed_at,batch = writer.batches[0]
+    assert len(batch) == 3
+    assert flushed_at - started < 1
+
+
+def test_stop_flushes_buffered_records():
+    writer = RecordingWriter()
+
+    async def scenario(pipeline):
+        # the REST source is idle for a minute, so only stop() can end the run
+        await asyncio.sleep(0.2)
+        assert writer.batches == []
+
+    sources = [RestPollingSource(logger,'rest',rest_fetch(5),poll_interval_seconds=60)]
+    run_pipeline(sources,writer,scenario,max_batch_records=1000,linger_seconds=30)
+    assert len(writer.records()) == 5
+
+
+def test_failed_source_still_flushes_emitted_records():
+    writer = RecordingWriter()
+
+    async def main():
+        pipeline = IngestionPipeline(logger,[FailingSource(logger,'failing')],lambda dataset:list(dataset),writer,
+                                     max_batch_records=1000,linger_seconds=30)
+        with pytest.raises(RuntimeError,match='source failed'):
+            await pipeline.run()
+    asyncio.run(main())
+    assert [record['id'] for record in writer.records()] == ['failing-0','failing-1']
+
+
+def test_records_are_built_off_the_event_loop():
+    writer = RecordingWriter()
+    build_threads = []
+
+    def build_records(dataset):
+        build_threads.append(threading.current_thread())
+        return list(dataset)
+
+    async def main():
+        pipeline = IngestionPipeline(logger,[RestPollingSource(logger,'rest',rest_fetch(2),poll_interval_seconds=0.01,max_iterations=2)],
+                                     build_records,writer,max_batch_records=1000,linger_seconds=0.01)
+        await pipeline.run()
+    asyncio.run(main())
+    assert len(writer.records()) == 4
+    assert len(build_threads) == 2 and threading.main_thread() not in build_threads
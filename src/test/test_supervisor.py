@@ -0,0 +1,160 @@
+import time
+import threading
+import itertools
+import pytest
+from supervisor import Supervisor,worker_log_file
+from utils.lease_store import LeaseStore
+
+SHARDS = [f'shardId-{index:012d}' for index in range(4)]
+
+
+def test_each_worker_gets_its_own_log_file():
+    assert worker_log_file('crypto_stream.log','producer',0) == 'crypto_stream.producer-0.log'
+    assert worker_log_file('/var/log/crypto/stream.log','consumer',3) == '/var/log/crypto/stream.consumer-3.log'
+    assert worker_log_file('crypto_stream','producer',1) == 'crypto_stream.producer-1'
+    # an empty log_file keeps file logging off in the workers too
+    assert worker_log_file('','producer',0) == ''
+
+
+@pytest.fixture
+def lease_store(tmp_path):
+    store = LeaseStore(str(tmp_path / 'leases.db'))
+    store.sync_resources('consumer',SHARDS)
+    yield store
+    store.close()
+
+
+def test_leases_are_shared_evenly_and_follow_the_worker_count(lease_store):
+    assert lease_store.balance('consumer','a',2,30) == set(SHARDS[:2])
+    assert lease_store.balance('consumer','b',2,30) == set(SHARDS[2:])
+
+    # with four workers the share drops to one, so b hands its surplus back
+    assert lease_store.balance('consumer','b',4,0.2) == {SHARDS[2]}
+    assert lease_store.holders('consumer')[SHARDS[3]] is None
+
+    # shrinking to one worker, a claims the free lease but not the one b still holds
+    assert lease_store.balance('consumer','a',1,30) == {SHARDS[0],SHARDS[1],SHARDS[3]}
+    # b stopped renewing, so its lease expires and a takes it over
+    time.sleep(0.25)
+    assert lease_store.balance('consumer','a',1,30) == set(SHARDS)
+    assert set(lease_store.holders('consumer').values()) == {'a'}
+
+
+def test_inactive_shards_are_dropped_from_leases(lease_store):
+    assert lease_store.balance('consumer','a',1,30) == set(SHARDS)
+    lease_store.sync_resources('consumer',SHARDS[:2])
+    assert lease_store.balance('consumer','a',1,30) == set(SHARDS[:2])
+    assert lease_store.holders('consumer') == {SHARDS[0]:'a',SHARDS[1]:'a'}
+
+
+class FakeProcess():
+    # stands in for a worker process; the test decides when it exits and with which code
+    pids = itertools.count(1000)
+
+    def __init__(self,target,name,args):
+        self.name = name
+        self.stop_event = args[5]
+        self.pid = None
+        self.exitcode = None
+        self.alive = False
+        # a stubborn process ignores its stop event and has to be terminated
+        self.stubborn = False
+        self.terminated = False
+
+    def start(self):
+        self.pid = next(self.pids)
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def exit(self,code):
+        self.alive = False
+        self.exitcode = code
+
+    def join(self,timeout=None):
+        if self.stop_event.is_set() and not self.stubborn:
+            self.exit(0)
+
+    def terminate(self):
+        self.terminated = True
+        self.exit(-15)
+
+
+class FakeContext():
+    def __init__(self):
+        self.processes = []
+
+    def Process(self,target,name,args):
+        process = FakeProcess(target,name,args)
+        self.processes.append(process)
+        return process
+
+    def Event(self):
+        return threading.Event()
+
+
+@pytest.fixture
+def supervisor(write_config,tmp_path,stub_connector):
+    config_file = write_config(supervisor={'lease_db':str(tmp_path / 'leases.db'),'restart_backoff_seconds':1,
+                                           'max_restart_backoff_seconds':4,'healthy_after_seconds':60,'stop_timeout_seconds':0})
+    supervisor = Supervisor(config_file,'supervisor','aws',aws_connector=stub_connector)
+    supervisor.initialize()
+    supervisor.context = FakeContext()
+    yield supervisor
+    supervisor.lease_store.close()
+
+
+def crash_and_check(supervisor,key):
+    handle = supervisor.workers[key]
+    handle['process'].exit(1)
+    supervisor.check_workers()
+    return handle['next_start'] - time.monotonic()
+
+
+def test_crashed_workers_restart_with_growing_backoff(supervisor):
+    key = ('producer',0)
+    supervisor.scale('producer',1)
+    assert crash_and_check(supervisor,key) == pytest.approx(1,abs=0.1)
+    supervisor.check_workers()
+    assert len(supervisor.context.processes) == 1
+    delays = []
+    for _ in range(3):
+        supervisor.workers[key]['next_start'] = 0
+        supervisor.check_workers()
+        delays.append(crash_and_check(supervisor,key))
+    assert delays == [pytest.approx(2,abs=0.1),pytest.approx(4,abs=0.1),pytest.approx(4,abs=0.1)]
+    assert supervisor.workers[key]['restarts'] == 3
+    assert len(supervisor.context.processes) == 4
+
+
+def test_a_healthy_run_resets_the_backoff(supervisor):
+    key = ('consumer',0)
+    supervisor.scale('consumer',1)
+    crash_and_check(supervisor,key)
+    supervisor.workers[key]['next_start'] = 0
+    supervisor.check_workers()
+    supervisor.workers[key]['started_at'] -= 61
+    assert crash_and_check(supervisor,key) == pytest.approx(1,abs=0.1)
+
+
+def test_a_clean_exit_is_not_restarted(supervisor):
+    supervisor.scale('producer',1)
+    supervisor.workers[('producer',0)]['process'].exit(0)
+    supervisor.check_workers()
+    supervisor.check_workers()
+    assert supervisor.workers[('producer',0)]['finished']
+    assert len(supervisor.context.processes) == 1
+
+
+def test_scaling_down_stops_the_surplus_workers(supervisor):
+    supervisor.scale('consumer',3)
+    processes = list(supervisor.context.processes)
+    processes[2].stubborn = True
+    supervisor.scale('consumer',1)
+    assert list(supervisor.workers) == [('consumer',0)]
+    assert processes[0].is_alive()
+    assert processes[1].stop_event.is_set() and not processes[1].is_alive() and not processes[1].terminated
+    # a worker that ignores its stop event is terminated after stop_timeout_seconds
+    assert processes[2].terminated
+    assert len(supervisor.context.processes) == 3